@@ -0,0 +1,51 @@
+"""
+  testAlbireoService - tests of AlbireoService
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/tests/testAlbireoService.py#1 $
+
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from vdomgmnt import AlbireoService
+
+
+class TestAlbireoService(unittest.TestCase):
+
+  def setUp(self):
+    self.indexPath = tempfile.mkdtemp()
+    self.indexDir = AlbireoService.getAlbireoDir(self.indexPath)
+    os.makedirs(os.path.join(self.indexDir, 'zone'))
+    self.alb = AlbireoService('dedupe://localhost:8000',
+                              indexPath=self.indexPath)
+
+  def tearDown(self):
+    shutil.rmtree(self.indexPath)
+
+  def _write(self, name, when):
+    path = os.path.join(self.indexDir, name)
+    with open(path, 'w') as f:
+      f.write('index')
+    os.utime(path, (when, when))
+
+  def testIndexWrittenSince(self):
+    now = int(time.time())
+    self._write('config', now - 100)
+    self.assertFalse(self.alb._indexWrittenSince(now))
+    self._write(os.path.join('zone', 'state'), now)
+    self.assertTrue(self.alb._indexWrittenSince(now))
+
+  def testNoIndex(self):
+    shutil.rmtree(self.indexDir)
+    self.assertFalse(self.alb._indexWrittenSince(0))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,92 @@
+"""
+  testLatencyHistogram - tests of LatencyHistogram
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/tests/testLatencyHistogram.py#1 $
+
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from vdomgmnt import LatencyHistogram
+
+
+# A dump of two histograms as the kvdo module logs it, between other
+# messages.
+_dump = [
+  "dump triggered via dmsetup message",
+  "Acknowledge External Write Request Histogram (number of writes)",
+  "     0 -       0 :          113 =====",
+  "     1 -       1 :          824 ===============================",
+  "     2 -       3 :           50 ==",
+  "Bigger           :           13",
+  "total 1000",
+  "Dedupe Index Reply Histogram",
+  "     0 :            7",
+  "     1 :            3",
+  "total 10",
+  "end of histograms",
+]
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+  def testParse(self):
+    histograms = LatencyHistogram.parse(_dump)
+    self.assertEqual(len(histograms), 2)
+    ack, reply = histograms
+    self.assertEqual(ack.name(), "Acknowledge External Write Request"
+                                 " Histogram")
+    self.assertEqual(ack.buckets, [(0, 0, 113), (1, 1, 824), (2, 3, 50),
+                                   (4, None, 13)])
+    self.assertEqual(ack.count(), 1000)
+    self.assertEqual(reply.label, "Dedupe Index Reply Histogram")
+    self.assertEqual(reply.buckets, [(0, 0, 7), (1, 1, 3)])
+
+  def testParseWithoutTotal(self):
+    histograms = LatencyHistogram.parse(["Label", "     0 -       1 :  4",
+                                         "something else",
+                                         "     5 :  2"])
+    self.assertEqual([h.label for h in histograms], ["Label",
+                                                     "something else"])
+    self.assertEqual(histograms[0].buckets, [(0, 1, 4)])
+
+  def testParseNothing(self):
+    self.assertEqual(LatencyHistogram.parse([]), [])
+    self.assertEqual(LatencyHistogram.parse(["no histograms here"]), [])
+
+  def testPercentile(self):
+    ack = LatencyHistogram.parse(_dump)[0]
+    self.assertEqual(ack.percentile(0.0), 0)
+    self.assertEqual(ack.percentile(0.1), 0)
+    self.assertEqual(ack.percentile(0.5), 1)
+    self.assertEqual(ack.percentile(0.98), 3)
+    # The last bucket has no upper bound, so gives its lower one.
+    self.assertEqual(ack.percentile(0.999), 4)
+    self.assertEqual(ack.percentile(1.0), 4)
+
+  def testPercentileEmpty(self):
+    self.assertEqual(LatencyHistogram("Empty").percentile(0.5), None)
+    self.assertEqual(LatencyHistogram("Zero", [(0, 0, 0)]).percentile(0.5),
+                     None)
+
+  def testSince(self):
+    earlier = LatencyHistogram("H", [(0, 0, 10), (1, 1, 5)])
+    later = LatencyHistogram("H", [(0, 0, 12), (1, 1, 5), (2, 3, 4)])
+    delta = later.since(earlier)
+    self.assertEqual(delta.label, "H")
+    self.assertEqual(delta.buckets, [(0, 0, 2), (1, 1, 0), (2, 3, 4)])
+    self.assertEqual(later.since(None), later)
+
+  def testSinceRestart(self):
+    # The counts fall if the volume was restarted in between.
+    earlier = LatencyHistogram("H", [(0, 0, 10)])
+    later = LatencyHistogram("H", [(0, 0, 3)])
+    self.assertEqual(later.since(earlier).buckets, [(0, 0, 0)])
+
+
+if __name__ == '__main__':
+  unittest.main()
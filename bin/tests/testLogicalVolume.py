@@ -0,0 +1,55 @@
+"""
+  testLogicalVolume - tests of LogicalVolume
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/tests/testLogicalVolume.py#1 $
+
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from vdomgmnt import LogicalVolume, SizeString, SystemState
+
+_G = 1024 * 1024 * 1024
+_extent = 4 * 1024 * 1024
+
+
+class TestLogicalVolume(unittest.TestCase):
+
+  def setUp(self):
+    self._cache = SystemState._cache
+    self.lv = LogicalVolume('/dev/vg/lv')
+
+  def tearDown(self):
+    SystemState._cache = self._cache
+
+  def _layout(self, frees, physicalSize=None):
+    """Returns the layout of the volume on PVs of 200G with the given
+    free space. The PVs do not exist, so they have no RAID geometry."""
+    pvs = [('/nonexistent/pv{0}'.format(i), 200 * _G, free * _G)
+           for i, free in enumerate(frees)]
+    SystemState._cache = {'physicalVolumes': {'vg': pvs},
+                          'extentSizes': {'vg': _extent}}
+    return self.lv._layout(None, physicalSize)
+
+  def testStripeAllFree(self):
+    self.assertEqual(self._layout([100, 100])[0], 2)
+
+  def testLinearUnequalFree(self):
+    self.assertEqual(self._layout([100, 10])[0], 1)
+
+  def testStripeSizeFits(self):
+    self.assertEqual(self._layout([100, 10], SizeString('20G'))[0], 2)
+
+  def testLinearSizeTooBig(self):
+    self.assertEqual(self._layout([100, 10], SizeString('50G'))[0], 1)
+
+  def testFullPvsIgnored(self):
+    self.assertEqual(self._layout([100, 0, 100])[0], 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,48 @@
+"""
+  testMemoryPlanner - tests of MemoryPlanner
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/tests/testMemoryPlanner.py#1 $
+
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from vdomgmnt import MemoryPlanner
+
+
+class TestMemoryPlanner(unittest.TestCase):
+
+  def setUp(self):
+    self.planner = MemoryPlanner(timeout=0)
+    self.planner.available = lambda: 1000
+
+  def testStartingVolumeReservesAll(self):
+    self.planner._reservations['a'] = (300, None)
+    self.assertEqual(self.planner._unreserved(), 700)
+
+  def testLoadingVolumeReservesUnallocated(self):
+    left = [200]
+    self.planner._reservations['a'] = (300, None)
+    self.planner.started('a', lambda: left[0])
+    self.assertEqual(self.planner._unreserved(), 800)
+    # Never more than was reserved.
+    left[0] = 500
+    self.assertEqual(self.planner._unreserved(), 700)
+
+  def testAllocatedVolumeReleased(self):
+    self.planner._reservations['a'] = (300, None)
+    self.planner.started('a', lambda: 0)
+    self.assertEqual(self.planner._unreserved(), 1000)
+    self.assertEqual(self.planner._reservations, {})
+
+  def testResidentBytes(self):
+    self.assertTrue(MemoryPlanner.residentBytes(os.getpid()) > 0)
+    self.assertEqual(MemoryPlanner.residentBytes(-1), 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
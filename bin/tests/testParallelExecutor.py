@@ -0,0 +1,44 @@
+"""
+  testParallelExecutor - tests of ParallelExecutor
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/tests/testParallelExecutor.py#1 $
+
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from vdomgmnt import ParallelExecutor
+
+
+def _square(n):
+  if n < 0:
+    raise ValueError("negative {0}".format(n))
+  return n * n
+
+
+class TestParallelExecutor(unittest.TestCase):
+
+  def testResultsInOrder(self):
+    for jobs in [1, 4]:
+      self.assertEqual(ParallelExecutor(jobs).map(_square, range(10)),
+                       [n * n for n in range(10)])
+
+  def testExceptionRaised(self):
+    for jobs in [1, 4]:
+      executor = ParallelExecutor(jobs)
+      self.assertRaises(ValueError, executor.map, _square, [1, -2, 3])
+
+  def testEarliestExceptionRaised(self):
+    try:
+      ParallelExecutor(2).map(_square, [-1, -2])
+      self.fail("no exception raised")
+    except ValueError as ex:
+      self.assertEqual(str(ex), "negative -1")
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,42 @@
+"""
+  testQueueAnalyzer - tests of QueueAnalyzer
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/tests/testQueueAnalyzer.py#1 $
+
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from vdomgmnt import QueueAnalyzer
+
+
+class TestQueueAnalyzer(unittest.TestCase):
+
+  def testPercentile(self):
+    # Depth 0 was seen 50 times, 1 40 times, 5 9 times, and 20 once.
+    depths = {0: 50, 1: 40, 5: 9, 20: 1}
+    percentile = QueueAnalyzer._percentile
+    self.assertEqual(percentile(depths, 0.0), 0)
+    self.assertEqual(percentile(depths, 0.5), 0)
+    self.assertEqual(percentile(depths, 0.51), 1)
+    self.assertEqual(percentile(depths, 0.9), 1)
+    self.assertEqual(percentile(depths, 0.99), 5)
+    self.assertEqual(percentile(depths, 1.0), 20)
+
+  def testPercentileOneValue(self):
+    self.assertEqual(QueueAnalyzer._percentile({3: 1}, 0.5), 3)
+    self.assertEqual(QueueAnalyzer._percentile({3: 7}, 0.99), 3)
+
+  def testServes(self):
+    self.assertTrue(QueueAnalyzer._serves('kvdoBioQ', 'kvdoBioQ'))
+    self.assertTrue(QueueAnalyzer._serves('kvdoBioQ3', 'kvdoBioQ'))
+    self.assertFalse(QueueAnalyzer._serves('kvdoBioQx', 'kvdoBioQ'))
+    self.assertFalse(QueueAnalyzer._serves('kvdoReqQ', 'kvdoBioQ'))
+
+
+if __name__ == '__main__':
+  unittest.main()
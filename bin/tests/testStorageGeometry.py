@@ -0,0 +1,74 @@
+"""
+  testStorageGeometry - tests of StorageGeometry
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/tests/testStorageGeometry.py#1 $
+
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from vdomgmnt import StorageGeometry
+
+
+class TestStorageGeometry(unittest.TestCase):
+
+  def setUp(self):
+    self.sysDir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(self.sysDir, 'md'))
+
+  def tearDown(self):
+    shutil.rmtree(self.sysDir)
+
+  def _makeArray(self, level, disks, chunkSize):
+    """Fills in the md directory of a fake MD array."""
+    for name, value in [('level', level), ('raid_disks', disks),
+                        ('chunk_size', chunkSize)]:
+      with open(os.path.join(self.sysDir, 'md', name), 'w') as f:
+        f.write("{0}\n".format(value))
+    return StorageGeometry._mdGeometry(self.sysDir)
+
+  def testLcm(self):
+    self.assertEqual(StorageGeometry.lcm(4096, 65536), 65536)
+    self.assertEqual(StorageGeometry.lcm(4096, 3 * 65536), 3 * 65536)
+    self.assertEqual(StorageGeometry.lcm(6, 4), 12)
+    self.assertEqual(StorageGeometry.lcm(0, 4096), 4096)
+    self.assertEqual(StorageGeometry.lcm(4096, 0), 4096)
+    self.assertEqual(StorageGeometry.lcm(0, 0), 0)
+
+  def testRaid0(self):
+    self.assertEqual(self._makeArray('raid0', 4, 524288),
+                     StorageGeometry(524288, 4 * 524288))
+
+  def testRaid5(self):
+    self.assertEqual(self._makeArray('raid5', 4, 65536),
+                     StorageGeometry(65536, 3 * 65536))
+
+  def testRaid6(self):
+    self.assertEqual(self._makeArray('raid6', 6, 65536),
+                     StorageGeometry(65536, 4 * 65536))
+
+  def testRaid10(self):
+    self.assertEqual(self._makeArray('raid10', 4, 524288),
+                     StorageGeometry(524288, 2 * 524288))
+
+  def testUnstriped(self):
+    self.assertEqual(self._makeArray('raid1', 2, 0), StorageGeometry())
+    self.assertEqual(self._makeArray('linear', 3, 0), StorageGeometry())
+    # A degenerate parity array has no data disks.
+    self.assertEqual(self._makeArray('raid5', 1, 65536), StorageGeometry())
+
+  def testUnreadable(self):
+    self.assertEqual(StorageGeometry._mdGeometry(self.sysDir),
+                     StorageGeometry())
+    self.assertEqual(self._makeArray('raid0', 'junk', 65536),
+                     StorageGeometry())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,93 @@
+"""
+  testTraceAnalyzer - tests of TraceAnalyzer
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/tests/testTraceAnalyzer.py#1 $
+
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from vdomgmnt import TraceAnalyzer
+
+
+# A trace as kvdo 1.4.2 logs it; it logs this write as "read".
+_write = ("finishing kvio read data new @ffff88003a5e6000 parent"
+          " ffff88003a5e4000/1 Trace[7!kvdoMapBio:312@100.000000,"
+          "kvdoStartDuplicationWork:405@100.000010,"
+          "processAlbireoResponse:520@100.000110,"
+          "addRecoveryJournalEntry:88@100.000130,"
+          "updateBlockMapForWrite:140@100.000170,"
+          "submitBioWork:77@100.000180,"
+          "writeBlockBioCompletion:96@100.000480]")
+# A read, logged as "write", with no dedupe label.
+_read = ("finishing kvio write data @ffff88003a5e7000 parent"
+         " ffff88003a5e4000/1 Trace[3!kvdoMapBio:312@200.999990,"
+         "kvdoReadVIO:230@201.000000,"
+         "readBlockBioCompletion:101@201.000200]")
+
+
+class TestTraceAnalyzer(unittest.TestCase):
+
+  def testStageOf(self):
+    for function, stage in [
+        ('kvdoMapBio', 'other'),
+        ('kvdoCreateKvio', 'other'),
+        ('kvdoHashDataWork', 'hash'),
+        ('kvdoCheckForDuplication', 'dedupe query'),
+        ('enqueueAlbireoOperation', 'dedupe query'),
+        ('kvdoUpdateDedupeAdviceWork', 'dedupe query'),
+        ('kvdoCompareVIOs', 'dedupe query'),
+        ('verifyReadBlockCallback', 'dedupe query'),
+        ('updateAlbireoForCompression', 'dedupe query'),
+        ('kvdoCompressWork', 'compression'),
+        ('addVIOToInputBin', 'compression'),
+        ('addRecoveryJournalEntry', 'journal'),
+        ('updateBlockMapForWrite', 'block map'),
+        ('submitBio', 'bio submission'),
+        ('kvdoWriteMetadataVIO', 'bio submission'),
+        ('completeFlushBio', 'bio submission'),
+        ('readBlockBioCompletion', 'bio submission'),
+        ('readBlockCompletionWork', 'other'),
+        ('retryPBNReadLock', 'other'),
+        ]:
+      self.assertEqual(TraceAnalyzer.stageOf(function), stage, function)
+
+  def testAdd(self):
+    analyzer = TraceAnalyzer()
+    self.assertTrue(analyzer.add(_write))
+    self.assertTrue(analyzer.add(_read))
+    self.assertEqual(analyzer.traces, 2)
+    self.assertEqual(analyzer.operations, {'write data': 1, 'read data': 1})
+    self.assertEqual(analyzer.totalTime, 480 + 210)
+    self.assertEqual(analyzer.stageTimes['other'], 10 + 10)
+    self.assertEqual(analyzer.stageTimes['dedupe query'], 100 + 20)
+    self.assertEqual(analyzer.stageTimes['journal'], 40)
+    self.assertEqual(analyzer.stageTimes['block map'], 10)
+    self.assertEqual(analyzer.stageTimes['bio submission'], 300 + 200)
+    self.assertEqual(analyzer.stageTimes['hash'], 0)
+    self.assertEqual(analyzer.locationTimes['kvdoMapBio:312'], 20)
+    self.assertEqual(analyzer.hotSpots(1), [('submitBioWork:77', 0.3)])
+
+  def testAddOther(self):
+    analyzer = TraceAnalyzer()
+    self.assertFalse(analyzer.add("kvdo0:journal: some other message"))
+    self.assertFalse(analyzer.add("finishing kvio read data @ffff parent"
+                                  " ffff/1 Trace[]"))
+    self.assertEqual(analyzer.traces, 0)
+    self.assertEqual(analyzer.totalTime, 0)
+
+  def testBreakdown(self):
+    analyzer = TraceAnalyzer()
+    analyzer.add(_read)
+    breakdown = dict((stage, (ms, share, mean))
+                     for stage, ms, share, mean in analyzer.breakdown())
+    self.assertEqual(breakdown['bio submission'], (0.2, 200.0 / 210, 0.2))
+    self.assertEqual(breakdown['hash'], (0.0, 0.0, 0.0))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,73 @@
+"""
+  testVdoStatistics - tests of VdoStatistics
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/tests/testVdoStatistics.py#1 $
+
+"""
+import ctypes
+import errno
+import fcntl
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from vdomgmnt import CommandError, VdoStatistics
+from vdomgmnt.VdoStatistics import KernelStatistics
+
+
+class TestVdoStatistics(unittest.TestCase):
+
+  def setUp(self):
+    self.stats = VdoStatistics('test')
+    self.stats.path = os.devnull
+    self.requests = []
+    self._ioctl = fcntl.ioctl
+    fcntl.ioctl = self._fakeIoctl
+
+  def tearDown(self):
+    fcntl.ioctl = self._ioctl
+
+  def _fakeIoctl(self, fd, request, buf, mutate):
+    """Stands in for fcntl.ioctl, filling in the first two fields of
+    the structure as the kernel would. The real ioctl is issued first
+    on the device (/dev/null), which rejects it, so that a buffer
+    fcntl.ioctl cannot write into still fails as it would in use."""
+    try:
+      self._ioctl(fd, request, buf, mutate)
+    except IOError:
+      pass
+    self.requests.append(request)
+    self.assertTrue(mutate)
+    struct.pack_into('LL', buf, 0, 3, 17)
+    return 0
+
+  def _failingIoctl(self, fd, request, buf, mutate):
+    raise IOError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+
+  def testRead(self):
+    kernel = self.stats.kernel()
+    self.assertEqual(kernel.currIORequests, 3)
+    self.assertEqual(kernel.maxIORequests, 17)
+    self.assertEqual(kernel.currDedupeQueries, 0)
+    size = ctypes.sizeof(KernelStatistics)
+    request = self.requests[0] & 0xffffffff
+    self.assertEqual(request >> 30, 2)
+    self.assertEqual((request >> 16) & 0x3fff, size)
+    self.assertEqual((request >> 8) & 0xff, 0xDE)
+    self.assertEqual(request & 0xff, 1)
+
+  def testIoctlFailure(self):
+    fcntl.ioctl = self._failingIoctl
+    self.assertRaises(CommandError, self.stats.kernel)
+
+  def testOpenFailure(self):
+    self.stats.path = '/nonexistent/vdo'
+    self.assertRaises(CommandError, self.stats.kernel)
+
+
+if __name__ == '__main__':
+  unittest.main()
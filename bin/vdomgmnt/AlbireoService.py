@@ -7,8 +7,10 @@
 
 """
 from . import Brand, Command, CommandError, ArgumentError, Defaults
-from . import Logger, LogicalVolume, Service, SizeString, Utils
+from . import IndexProgress, Logger, Service, SizeString, StorageDevice
+from . import Utils, Waiter
 import os
+import time
 
 
 class AlbireoService(Service):
@@ -19,9 +21,11 @@ class AlbireoService(Service):
       URI 'dedupe://host:port'.
     cfreq (int): The checkpoint frequency.
     enabled (bool): If True, should be started by the `start` method.
+    indexDevice (str): The physical volume on which to allocate
+      `logicalVolume`, or '' to allocate it anywhere in its volume group.
     indexPath (str): Directory to be used for Albireo indexes.
-    logicalVolume (LogicalVolume): The logical volume on which `indexPath`
-      will be mounted.
+    logicalVolume (StorageDevice): The storage, normally a logical
+      volume, on which `indexPath` will be mounted.
     memory (str): The Albireo main memory setting.
     networkSpec (str): The Albireo service address, in the form host:port.
     size (SizeString): Size of the Albireo index.
@@ -35,10 +39,11 @@ class AlbireoService(Service):
     Service.__init__(self, name)
     self.cfreq = kw.get('cfreq', Defaults.cfreq)
     self.enabled = kw.get('enabled', True)
+    self.indexDevice = kw.get('indexDevice', '')
     self.indexPath = kw.get('indexPath', '')
     logicalVolumePath = kw.get('logicalVolumePath', '')
     if logicalVolumePath:
-      self.logicalVolume = LogicalVolume(logicalVolumePath)
+      self.logicalVolume = StorageDevice.fromSpec(logicalVolumePath)
     else:
       self.logicalVolume = None
     self.memory = kw.get('memory', Defaults.albireoMem)
@@ -57,7 +62,7 @@ class AlbireoService(Service):
       elif name in ['size']:
         object.__setattr__(self, name, SizeString(value))
       elif name in ['logicalVolumePath']:
-        self.logicalVolume = LogicalVolume(value)
+        self.logicalVolume = StorageDevice.fromSpec(value)
       else:
         object.__setattr__(self, name, value)
     else:
@@ -65,9 +70,11 @@ class AlbireoService(Service):
 
   def __getattr__(self, name):
     # Fake this attribute so we don't have to make incompatible
-    # changes to the configuration file format.
+    # changes to the configuration file format. The value is the
+    # specification of the index storage, which for a logical volume
+    # is just its path.
     if name in ['logicalVolumePath']:
-      return self.logicalVolume.fullpath()
+      return str(self.logicalVolume)
     else:
       raise AttributeError("'{obj}' object has no attribute '{attr}'".format(
           obj="AlbireoService", attr=name))
@@ -112,9 +119,9 @@ class AlbireoService(Service):
     """Removes an Albireo index."""
     self.log.announce(_("Removing Albireo index {0}").format(self._name))
     if os.path.ismount(self.indexPath):
-      umountCmd = Command(['umount', '-f', self.indexPath])
+      umountCmd = Command(['umount', self.indexPath])
       try:
-        umountCmd.waitFor(5)
+        umountCmd.waitFor(5, settle=True)
       except CommandError as ex:
         self.log.error(_("Could not unmount Albireo index: {0!s}").format(ex))
         return self.ERROR
@@ -146,6 +153,16 @@ class AlbireoService(Service):
     if os.path.exists(albireoDir) and os.listdir(albireoDir):
       raise ArgumentError(_("Albireo index directory {dir} not empty").format(
           dir = albireoDir))
+    if args.indexDevice:
+      volumeGroup = args.indexVolumeGroup or args.volumeGroup
+      pvsCmd = Command(['pvs', '--noheadings', '-o', 'vg_name',
+                        args.indexDevice])
+      if Command.noRunMode():
+        pvsCmd()
+      elif pvsCmd.runOutput().strip() != volumeGroup:
+        raise ArgumentError(_("Index device {dev} is not a physical volume"
+                              " in volume group {vg}").format(
+            dev=args.indexDevice, vg=volumeGroup))
 
   def start(self, readyCmd = None):
     """Starts the Albireo server.
@@ -206,25 +223,79 @@ class AlbireoService(Service):
     if not readyCmd:
       albpingBinary = Brand.map('albping')
       pingCmd = Command([albpingBinary, '--index=' + self.networkSpec])
+      # The server gets one timeout to write its pid file and answer.
+      deadline = time.time() + 20
       try:
-        pingCmd.waitFor()
+        if not Command.noRunMode():
+          # There is no point pinging a server which has not written
+          # its pid file yet.
+          Waiter.forPath(self._pidFilePath(),
+                         max(0, deadline - time.time()))
+        pingCmd.waitFor(max(0, deadline - time.time()))
       except CommandError as e:
         self.log.error(_("Error starting Albireo server {0}: {1!s}").format(
             self._name, e))
         return self.ERROR
     return self.SUCCESS
 
-  def stop(self):
-    """Stops the Albireo server."""
+  def stop(self, saveTimeout=None):
+    """Stops the Albireo server.
+
+    The server saves its index when asked to terminate, and exits once
+    the save is complete; an index which is not saved must be rebuilt
+    from the start on the next start, which can take hours for a large
+    index. The server is therefore given until the save timeout to
+    exit on its own before it is killed. Any VDO volume using the
+    server should be disconnected from it first, so that the save is
+    not slowed by new requests.
+
+    Arguments:
+      saveTimeout (int): seconds to wait for the server to save its
+        index; the default is Defaults.albireoSaveTimeout. 0 kills the
+        server without waiting, for an index which is about to be
+        removed.
+    Returns:
+      SUCCESS, ALREADY, or ERROR if the server could not be signalled.
+      A server which did not save its index is still stopped, and a
+      warning is logged. The index is taken to have been saved if the
+      server exited in time and rewrote the files of its index after
+      it was asked to terminate.
+    """
     self.log.announce(_("Stopping Albireo server {0}").format(self._name))
     pid = self._getPid()
     if pid == 0 and not Command.noRunMode():
       self.log.info(_("Albireo server {0} already stopped").format(self._name))
       return self.ALREADY
-    Utils.killProcess(pid)
+    if saveTimeout is None:
+      saveTimeout = Defaults.albireoSaveTimeout
+    if saveTimeout:
+      self.log.info(_("Waiting up to {0} seconds for Albireo server {1} to"
+                      " save its index").format(saveTimeout, self._name))
+    # File times may only be kept to the second.
+    signalled = int(time.time())
     try:
-      umountCmd = Command(['umount', '-f', self.indexPath])
-      umountCmd.waitFor(5)
+      exited = Utils.killProcess(pid, saveTimeout)
+    except CommandError as ex:
+      self.log.error(_("Could not stop Albireo server {0}: {1!s}").format(
+          self._name, ex))
+      return self.ERROR
+    if not saveTimeout or Command.noRunMode():
+      pass
+    elif not exited:
+      self.log.warn(_("Albireo server {0} did not save its index within {1}"
+                      " seconds and was killed; the index will be rebuilt"
+                      " when it is next started").format(self._name,
+                                                         saveTimeout))
+    elif self._indexWrittenSince(signalled):
+      self.log.announce(_("Albireo server {0} saved its index").format(
+          self._name))
+    else:
+      self.log.warn(_("Albireo server {0} exited without saving its index;"
+                      " the index will be rebuilt when it is next"
+                      " started").format(self._name))
+    try:
+      umountCmd = Command(['umount', self.indexPath])
+      umountCmd.waitFor(5, settle=True)
     except CommandError as ex:
       self.log.info(_("Albireo volume unmount failed: {0!s}").format(ex))
     return self.SUCCESS
@@ -239,8 +310,9 @@ class AlbireoService(Service):
   @staticmethod
   def getKeys():
     """Returns the list of standard attributes for this object."""
-    return ['cfreq', 'enabled', 'indexPath', 'logicalVolumePath', 'memory',
-            'networkSpec', 'size', 'sparse', 'udsParallelFactor']
+    return ['cfreq', 'enabled', 'indexDevice', 'indexPath',
+            'logicalVolumePath', 'memory', 'networkSpec', 'size', 'sparse',
+            'udsParallelFactor']
 
   def status(self, prefix):
     """Prints the status of this object to stdout."""
@@ -248,6 +320,8 @@ class AlbireoService(Service):
     print(prefix + _("  Checkpoint frequency: {0}").format(self.cfreq))
     print(prefix + _("  Enabled: {0}").format(self.enabled))
     print(prefix + _("  Index directory: {0}").format(self.indexPath))
+    if self.indexDevice:
+      print(prefix + _("  Index device: {0}").format(self.indexDevice))
     print(prefix + _("  Index logical volume: {0}").format(
         self.logicalVolume))
     print(prefix + _("  Albireo server memory setting: {0}").format(
@@ -263,13 +337,103 @@ class AlbireoService(Service):
     pid = self._getPid()
     if pid:
       print(prefix + _("  Server process ID: {0}").format(pid))
-      albpingBinary = Brand.map('albping')
-      Utils.statusHelper([albpingBinary, '--index=' + self.networkSpec],
-                         prefix + _("  Server status: ") + os.linesep
-                          + prefix + "    ")
+      pingCmd = self._pingCommand()
+      answered = False
+      try:
+        pingCmd()
+        answered = True
+      except CommandError:
+        pass
+      Utils.printStatus(pingCmd.stdout if answered else None,
+                        prefix + _("  Server status: ") + os.linesep
+                        + prefix + "    ")
+      # One sample only; waitIndex measures the rate of a rebuild.
+      print(prefix + _("  Index state: {0}").format(
+          self.indexProgress(answered=answered)))
     else:
       print(prefix + _("  Server process ID: (not running)"))
 
+  def indexProgress(self, previous=None, answered=None):
+    """Returns the state of the index of the Albireo server. The index
+    is online once the server answers pings.
+
+    Arguments:
+      previous (IndexProgress): an earlier state of this server's
+        index, from which to estimate the rate of a rebuild
+      answered (bool): whether the server has just answered a ping, or
+        None to ping it
+    Returns:
+      An IndexProgress.
+    """
+    pid = self._getPid()
+    if pid == 0:
+      return IndexProgress(IndexProgress.STOPPED)
+    if answered is None:
+      try:
+        self._pingCommand()()
+        answered = True
+      except CommandError:
+        answered = False
+    if answered:
+      return IndexProgress(IndexProgress.ONLINE, pid)
+    bytesRead = self._bytesRead(pid)
+    indexBytes = self._indexBytes()
+    reading = bytesRead is not None and bytesRead < indexBytes
+    if (reading and previous is not None and previous.pid == pid
+        and previous.bytesRead is not None):
+      reading = bytesRead > previous.bytesRead
+    if not reading:
+      return IndexProgress(IndexProgress.NOT_RESPONDING, pid, bytesRead,
+                           indexBytes)
+    return IndexProgress(IndexProgress.REBUILDING, pid, bytesRead, indexBytes,
+                         previous)
+
+  def _pingCommand(self):
+    """Returns the command which pings the Albireo server."""
+    return Command([Brand.map('albping'), '--index=' + self.networkSpec])
+
+  def _bytesRead(self, pid):
+    """Returns the bytes a process has read from storage, or None if
+    that cannot be found out."""
+    try:
+      with open('/proc/{0}/io'.format(pid)) as f:
+        for line in f:
+          key, unused_sep, value = line.partition(':')
+          if key == 'read_bytes':
+            return int(value)
+    except (IOError, ValueError) as ex:
+      self.log.debug("Cannot read I/O counts of {0}: {1}".format(pid, ex))
+    return None
+
+  def _indexWrittenSince(self, when):
+    """Returns True iff a file of the Albireo index has been written
+    since a given time.
+
+    Arguments:
+      when (float): the time, in seconds since the epoch
+    """
+    for directory, unused_subdirs, files in os.walk(
+        self.getAlbireoDir(self.indexPath)):
+      for name in files:
+        try:
+          if os.path.getmtime(os.path.join(directory, name)) >= when:
+            return True
+        except OSError:
+          pass
+    return False
+
+  def _indexBytes(self):
+    """Returns the total size of the files of the Albireo index."""
+    total = 0
+    for directory, unused_subdirs, files in os.walk(
+        self.getAlbireoDir(self.indexPath)):
+      for name in files:
+        try:
+          total += os.path.getsize(os.path.join(directory, name))
+        except OSError:
+          pass
+    return total
+
   @staticmethod
   def getAlbireoDir(indexPath):
     """Return the full path to the Albireo directory."""
@@ -278,7 +442,9 @@ class AlbireoService(Service):
   def _createIndexDir(self):
     """Creates a logical volume and directory for an Albireo index."""
     try:
-      self.logicalVolume.create(4096, self.size)
+      self.logicalVolume.create(4096, self.size,
+                                [self.indexDevice] if self.indexDevice
+                                else None)
     except CommandError as ex:
       self.log.error(_(
           "Can't create index logical volume {lv}: {ex}").format(
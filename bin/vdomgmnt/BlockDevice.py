@@ -0,0 +1,165 @@
+"""
+  BlockDevice - uses a block device as it is for storage
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/BlockDevice.py#1 $
+
+"""
+from . import ArgumentError, Command, Logger, SizeString
+from . import StorageDevice
+import errno
+import os
+import stat
+
+
+class BlockDevice(StorageDevice):
+  """BlockDevice is storage on a whole block device, such as a disk,
+  partition, NVMe namespace, or MD array, with no volume manager in
+  between. The device is never created or destroyed: creating the
+  storage claims the device, whose size is fixed, and extending it
+  picks up any growth of the device since (for instance after an MD
+  array is grown).
+
+  Attributes:
+    _path (str): the block device
+  """
+  log = Logger.getLogger(Logger.myname + '.BlockDevice')
+
+  def __init__(self, path):
+    """Constructs a BlockDevice.
+
+    Arguments:
+      path (str): the path of the block device
+    Exceptions:
+      ArgumentError: invalid path
+    """
+    super(BlockDevice, self).__init__()
+    if not os.path.isabs(path):
+      raise ArgumentError(_("Invalid block device path {path}").format(
+          path=path))
+    self._path = path
+
+  def __str__(self):
+    """Returns the specification of this device, as persisted in the
+    configuration file."""
+    return 'block:' + self._path
+
+  def __repr__(self):
+    return "BlockDevice(" + self._path + ")"
+
+  def canCreate(self):
+    """Tests whether this device can be used. It must be a block device
+    which nothing has open exclusively, such as a mounted file system
+    or a device mapper target.
+
+    Exceptions:
+      ArgumentError: this device cannot be used
+    """
+    if Command.noRunMode():
+      Command(['blockdev', '--getsize64', self._path])()
+      return
+    if not self.exists():
+      raise ArgumentError(_("{path} is not a block device").format(
+          path=self._path))
+    try:
+      os.close(os.open(self._path, os.O_RDONLY | os.O_EXCL))
+    except OSError as ex:
+      if ex.errno == errno.EBUSY:
+        raise ArgumentError(_("Block device {path} is in use").format(
+            path=self._path))
+      raise ArgumentError(_("Cannot open {path}: {err}").format(
+          path=self._path, err=ex.strerror))
+
+  def create(self, blockSize, physicalSize=None, devices=None):
+    """Claims this device.
+
+    Arguments:
+      blockSize (int): the block size in bytes
+      physicalSize (SizeString): the size of the device to use; if
+        None, use all of it
+      devices (list of str): not meaningful for a block device
+    Returns:
+      The physical size to use, as a SizeString.
+    Exceptions:
+      ArgumentError: the device is too small
+    """
+    if devices:
+      raise ArgumentError(_("Cannot choose devices for block device"
+                            " {path}").format(path=self._path))
+    return self._claim(blockSize, physicalSize)
+
+  def extend(self, blockSize, physicalSize=None):
+    """Uses more of this device, up to its current size.
+
+    Arguments:
+      blockSize (int): the block size in bytes
+      physicalSize (SizeString): the new size to use; if None, use
+        all of the device
+    Returns:
+      The physical size to use, as a SizeString.
+    Exceptions:
+      ArgumentError: the device is too small
+    """
+    return self._claim(blockSize, physicalSize)
+
+  def remove(self, noThrow=False):
+    """Releases this device. The device itself is left as it is."""
+    #pylint: disable=W0613
+    self.log.info(_("Block device {0} is no longer in use").format(
+        self._path))
+    self._physicalSize = SizeString('')
+
+  def exists(self):
+    """Tests whether this block device exists."""
+    if Command.noRunMode():
+      return os.path.exists(self._path)
+    try:
+      return stat.S_ISBLK(os.stat(self._path).st_mode)
+    except OSError:
+      return False
+
+  def getSize(self):
+    """Returns the size of this device as a SizeString, or the size set
+    at create or extend in noRun mode. Returns a zero-byte size if the
+    size cannot be read."""
+    if Command.noRunMode():
+      return self._physicalSize
+    try:
+      return SizeString(str(self._deviceSize(self._path)) + 'B')
+    except OSError as ex:
+      self.log.debug("Cannot read size of {0}: {1}".format(self._path, ex))
+      return SizeString('')
+
+  def fullpath(self):
+    """Returns the path of this block device."""
+    return self._path
+
+  def status(self):
+    """Returns the status of this device."""
+    if not self.exists():
+      return _("(not available)")
+    return _("block device, size {0}").format(self.getSize().asDisplay())
+
+  def _claim(self, blockSize, physicalSize):
+    """Checks a size to use against the size of this device.
+
+    Returns:
+      The size to use, rounded down to the block size.
+    Exceptions:
+      ArgumentError: the device is too small
+    """
+    self._maximumSizeCheck(physicalSize)
+    if Command.noRunMode():
+      if physicalSize:
+        self._physicalSize = physicalSize
+      return self._physicalSize
+    deviceSize = self.getSize()
+    if not physicalSize:
+      physicalSize = deviceSize
+    elif physicalSize > deviceSize:
+      raise ArgumentError(_(
+          "Requested physical size {sz} larger than {path} ({dsz})").format(
+          sz=physicalSize, path=self._path, dsz=deviceSize.asDisplay()))
+    self._physicalSize = self._roundDown(blockSize, physicalSize)
+    return self._physicalSize
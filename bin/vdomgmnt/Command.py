@@ -42,8 +42,33 @@ class Command(object):
   """
   defaultNoRun = False
   defaultVerbose = 0
+  listeners = []
   log = logging.getLogger(Logger.myname + '.Command')
 
+  @classmethod
+  def addListener(cls, listener):
+    """Registers a function to be called after every command is run,
+    whether or not it succeeds. Used to keep cached system state
+    consistent with commands that change it.
+
+    Arguments:
+      listener (Callable): called with the command list as its only
+        argument
+    """
+    cls.listeners.append(listener)
+
+  @classmethod
+  def notifyListeners(cls, cmdList):
+    """Calls the registered listeners for a command that has been run.
+    Also used by code which performs the equivalent of a command
+    without running it.
+
+    Arguments:
+      cmdList (list): the command and its arguments
+    """
+    for listener in cls.listeners:
+      listener(cmdList)
+
   @classmethod
   def setDefaults(cls, options):
     """Sets the verbose and noRun default values from command line options.
@@ -51,11 +76,11 @@ class Command(object):
     Arguments:
       options: The OptionParser argument object.
     """
+    cls.defaultNoRun = bool(options.noRun)
+    # Keep the level, which an extension may count, rather than a bool.
+    cls.defaultVerbose = int(options.verbose or 0)
     if options.noRun:
-      cls.defaultNoRun = options.noRun
-      cls.defaultVerbose = True
-    if options.verbose:
-      cls.defaultVerbose = options.verbose
+      cls.defaultVerbose = max(cls.defaultVerbose, 1)
 
   @classmethod
   def noRunMode(cls):
@@ -158,6 +183,7 @@ class Command(object):
       raise CommandError(self.exitStatus)
 
     stdoutdata, stderrdata = p.communicate()
+    self.notifyListeners(self._cmdList)
     self.stdout = "".join(stdoutdata)
     self.stderr = "".join(stderrdata)
     self.exitCode = p.returncode
@@ -239,28 +265,40 @@ class Command(object):
     except CommandError:
       return ''
 
-  def waitFor(self, retries=20):
+  def waitFor(self, timeout=20, settle=False):
     """Runs this command repeatedly until is succeeds or times out.
-    The command is run at one-second intervals.
+    The command is retried after delays starting at a millisecond and
+    growing to half a second (see Waiter).
 
     Arguments:
-      retries: number of retries
+      timeout (int): seconds to keep trying
+      settle (bool): if True, wait for udev to settle before each retry,
+        for commands which fail while udev has the device open
     """
+    from . import Waiter
     cmdList = self.realCmdList()
     cmdLine = string.join(cmdList, ' ')
     self.log.debug("Waiting for '{0}'".format(cmdLine))
     if self.noRun:
       return
 
-    for count in range(retries):
-      self.log.debug("  ... {0}/{1}".format(str(count), str(retries)))
-      try:
-        self()
-        return
-      except CommandError:
-        time.sleep(1)
-    raise CommandError(_("{cmdname}: timed out after {sec} seconds").format(
-        cmdname=self.cmdName(), sec=str(retries)))
+    message = _("{cmdname}: timed out after {sec:.0f} seconds").format(
+        cmdname=self.cmdName(), sec=timeout)
+    with Waiter(timeout, message) as waiter:
+      attempts = []
+      def succeeded():
+        if attempts and settle:
+          # Settling may not use more than the time left.
+          Waiter.settle(int(waiter.remaining()))
+        attempts.append(time.time())
+        self.log.debug("  ... attempt {0}".format(len(attempts)))
+        try:
+          self()
+          return True
+        except CommandError:
+          return False
+
+      waiter.until(succeeded)
 
   def noThrowCall(self):
     """Runs this command, swallowing exceptions. For applications like
@@ -6,11 +6,10 @@
   $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/CommandLock.py#1 $
 
 """
-from . import CommandError, Logger
+from . import CommandError, Defaults, Logger, Waiter
 import errno
 import fcntl
 import os
-import time
 
 class CommandLockTimeout(Exception):
   """Exception raised to indicate a timeout acquiring a CommandLock."""
@@ -24,22 +23,49 @@ class CommandLockTimeout(Exception):
 class CommandLock(object):
   """Simple process locking.
 
+  While waiting for a lock, the lock is retried after growing delays
+  (see Waiter), so a lock which is released is acquired almost at once.
+
   Attributes:
     _fd (int): file descriptor if the lock file is open
     _filename (string): path to the lock file
     _locked (bool): True iff we hold the lock
-    _lockRetries (int): number of retries to attempt at 1 second
-                        intervals before failing
     _readonly (bool): True iff this is a shared (read) lock
+    _timeout (float): seconds to wait for the lock before failing
   """
   log = Logger.getLogger(Logger.myname + '.CommandLock')
 
-  def __init__(self, filename, readonly=True):
+  def __init__(self, filename, readonly=True, timeout=None):
     self._fd = -1
     self._filename = filename
     self._locked = False
-    self._lockRetries = 20
     self._readonly = readonly
+    if timeout is None:
+      timeout = Defaults.lockTimeout
+    self._timeout = timeout
+
+  @classmethod
+  def forVolume(cls, name):
+    """Returns an exclusive lock for changing one VDO volume."""
+    return cls(os.path.join(Defaults.lockDir, name + '.lock'), False)
+
+  @classmethod
+  def forConfiguration(cls):
+    """Returns an exclusive lock for writing a configuration file."""
+    return cls(os.path.join(Defaults.lockDir, 'config.lock'), False)
+
+  @classmethod
+  def forTunables(cls, readonly=True):
+    """Returns a lock on the kvdo module tunables which apply to the
+    next device created: held exclusive to set them, and shared while
+    creating a device with them. Creating a device can take minutes,
+    so the lock is waited for without a timeout.
+
+    Arguments:
+      readonly (bool): True for a shared lock
+    """
+    return cls(os.path.join(Defaults.lockDir, 'tunables.lock'), readonly,
+               float('inf'))
 
   def __str__(self):
     return "CommandLock(\"{0}\")".format(self._filename)
@@ -56,23 +82,60 @@ class CommandLock(object):
     Raises CommandException in case of an error or timeout.
     """
     self._openLockFile()
-
-    for unused_count in range(self._lockRetries):
-      try:
-        if self._readonly:
-          fcntl.flock(self._fd, fcntl.LOCK_SH|fcntl.LOCK_NB)
-        else:
-          fcntl.flock(self._fd, fcntl.LOCK_EX|fcntl.LOCK_NB)
-        self._locked = True
-        return
-      except IOError as e:
-        if e.errno != errno.EACCES and e.errno != errno.EAGAIN:
-          raise CommandError(_("Could not lock file {0}: {1}").format(
-              self._filename, e.strerror))
-        else:
-          time.sleep(1)
-    raise CommandLockTimeout(_("Could not lock {0}: timed out").format(
-        self._filename))
+    message = _("Could not lock {0}: timed out").format(self._filename)
+    try:
+      with Waiter(self._timeout, message) as waiter:
+        waiter.until(self._tryLock)
+    except IOError as e:
+      os.close(self._fd)
+      self._fd = -1
+      raise CommandError(_("Could not lock file {0}: {1}").format(
+          self._filename, e.strerror))
+    except CommandError:
+      os.close(self._fd)
+      self._fd = -1
+      raise CommandLockTimeout(message)
+    self._locked = True
+
+  def relock(self, readonly):
+    """Changes a held lock to shared or exclusive, waiting for it as
+    lock does. flock may release the lock before taking it in the new
+    mode, so another process may take it in between.
+
+    Arguments:
+      readonly (bool): True for a shared lock
+    Exceptions:
+      CommandLockTimeout: the lock could not be taken in time; it is
+        no longer held
+    """
+    assert self._locked, "CommandLock.relock called without the lock"
+    self._readonly = readonly
+    message = _("Could not lock {0}: timed out").format(self._filename)
+    try:
+      with Waiter(self._timeout, message) as waiter:
+        waiter.until(self._tryLock)
+    except CommandError:
+      self.unlock()
+      raise CommandLockTimeout(message)
+
+  def _tryLock(self):
+    """Tries to take the lock without waiting.
+
+    Returns:
+      True iff the lock was taken.
+    Exceptions:
+      IOError: the lock file could not be locked
+    """
+    try:
+      if self._readonly:
+        fcntl.flock(self._fd, fcntl.LOCK_SH|fcntl.LOCK_NB)
+      else:
+        fcntl.flock(self._fd, fcntl.LOCK_EX|fcntl.LOCK_NB)
+      return True
+    except IOError as e:
+      if e.errno != errno.EACCES and e.errno != errno.EAGAIN:
+        raise
+      return False
 
   def unlock(self):
     """Unlock this object."""
@@ -86,13 +149,16 @@ class CommandLock(object):
   def _openLockFile(self):
     """Open the lock file for this object, creating it if necessary.
 
-    Note: for the time being, the lockfile is created with mode
-    666. This is necessary because we're still putting an exclusive
-    lock around every command and we still support non-root use of
-    some vdo commands.
+    Note: the lockfile is created with mode 666, since non-root users
+    may run the read-only vdo commands, which take shared locks. The
+    directories holding per-volume and configuration locks are only
+    writable by root, as are the commands which need those locks.
     """
     oldmask = os.umask(000)
     try:
+      directory = os.path.dirname(self._filename)
+      if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0755)
       if self._readonly:
         self.log.debug("Locking {0} for read".format(self._filename))
         self._fd = os.open(self._filename, os.O_CREAT|os.O_RDONLY, 0666)
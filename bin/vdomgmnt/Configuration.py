@@ -6,8 +6,11 @@
   $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/Configuration.py#2 $
 
 """
-from . import ArgumentError, AlbireoService, Command, Logger, VdoService
+from . import ArgumentError, AlbireoService, Command, CommandLock, Logger
+from . import VdoService
+import copy
 import os
+import tempfile
 import time
 import xml.parsers.expat
 
@@ -29,7 +32,9 @@ class Configuration(object):
   but writes will not be performed.
 
   The Configuration is stored in a simple XML format; see
-  vdoconfig.dtd.
+  vdoconfig.dtd. The file is never rewritten in place: a new file is
+  written beside it and renamed over it, so that a command reading the
+  file while another writes it sees either the old contents or the new.
 
   Attributes:
     _vdos: A dictionary of VDOServices, indexed by name.
@@ -39,15 +44,22 @@ class Configuration(object):
     _fh: The open file handle, or None if the file is not open.
     _dirty: True iff this Configuration has been modified but the
       changes have not been persisted.
+    _changedVdos, _changedAlbservers: The names of the VDOs and
+      albservers added, replaced, or removed since the last persist.
     _mustExist: If True, the file must exist (otherwise a missing
       file is treated as an empty configuration).
     _deleteEmpty: If True, the `persist` method will delete the file
       if this Configuration is empty.
     _currsection, _currsecname, _currkey, _currvalue: State variables
       for the XML parser.
+    _parsed: The contents of each configuration file read by this
+      process, indexed by file name, with the identity, size, and
+      modification time of the file when it was read; a long-lived
+      process such as vdod rereads a file only when it has changed.
   """
   log = Logger.getLogger(Logger.myname + '.Configuration')
   supportedSchemaVersions = ["1.0"]
+  _parsed = {}
 
   def __init__(self, filename, readonly=True, mustExist=False,
                deleteEmpty=False):
@@ -72,6 +84,8 @@ class Configuration(object):
     self._readonly = readonly
     self._fh = None
     self._dirty = False
+    self._changedVdos = set()
+    self._changedAlbservers = set()
     self._mustExist = mustExist
     self._deleteEmpty = deleteEmpty
     self._schemaVersion = "1.0"
@@ -90,7 +104,7 @@ class Configuration(object):
     try:
       if os.path.exists(self._filename):
         self._fh = open(self._filename, mode)
-        if os.path.getsize(self._filename) != 0:
+        if os.fstat(self._fh.fileno()).st_size != 0:
           self._read()
       elif not self._readonly:
         self._fh = open(self._filename, mode)
@@ -166,6 +180,16 @@ class Configuration(object):
   def _read(self):
     """Reads in a Configuration from a file."""
     assert self._fh, "Configuration._read called without an open file"
+    st = os.fstat(self._fh.fileno())
+    fileKey = (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+    parsed = self._parsed.get(self._filename)
+    if parsed and parsed[0] == fileKey:
+      self.log.debug("Using configuration already read from {0}".format(
+          self._filename))
+      (self._schemaVersion, self._vdos,
+       self._albservers) = copy.deepcopy(parsed[1])
+      self._dirty = False
+      return 0
     self.log.debug("Reading configuration from {0}".format(self._filename))
     self._fh.seek(0)
     self._currsection = ''
@@ -180,6 +204,8 @@ class Configuration(object):
     p.buffer_text = True
     p.ParseFile(self._fh)
     self._dirty = False
+    self._parsed[self._filename] = (fileKey, copy.deepcopy(
+        (self._schemaVersion, self._vdos, self._albservers)))
     return 0
 
   @classmethod
@@ -204,6 +230,11 @@ class Configuration(object):
     method will silently return. If Command.noRunMode is True, any
     new Configuration will be printed to stdout instead of the file.
 
+    Commands working on different volumes may run at once, so the
+    file is read again under the configuration lock and only the
+    VDOs and albservers changed through this object are replaced in
+    it before it is written.
+
     This method will generate an assertion failure if the configuration
     file is not open.
     """
@@ -213,6 +244,33 @@ class Configuration(object):
     if not self._dirty:
       self.log.debug("Configuration is clean, not persisting")
       return
+    with CommandLock.forConfiguration():
+      self._merge()
+      self._write()
+    self._changedVdos.clear()
+    self._changedAlbservers.clear()
+
+  def _merge(self):
+    """Replaces the contents of this object with the current contents
+    of the file plus the changes made through this object."""
+    current = Configuration(self._filename)
+    with current:
+      pass
+    for name in self._changedVdos:
+      if name in self._vdos:
+        current._vdos[name] = self._vdos[name]
+      else:
+        current._vdos.pop(name, None)
+    for name in self._changedAlbservers:
+      if name in self._albservers:
+        current._albservers[name] = self._albservers[name]
+      else:
+        current._albservers.pop(name, None)
+    self._vdos = current._vdos
+    self._albservers = current._albservers
+
+  def _write(self):
+    """Writes out the contents of this object."""
     self.log.debug("Writing configuration to {0}".format(self._filename))
     if (os.path.isfile(self._filename)):
       cpCmd = Command(["cp", self._filename, self._filename + ".bak"])
@@ -238,16 +296,31 @@ class Configuration(object):
     conf.append("")
     s = os.linesep.join(conf)
     if not Command.noRunMode():
-      self._fh.seek(0)
-      self._fh.truncate()
-      self._fh.write(s)
-      self._fh.flush()
-      os.fsync(self._fh)
+      self._replace(s)
+      self._parsed.pop(self._filename, None)
     else:
       print(_("New configuration (not written):"))
       print(s)
     self._dirty = False
 
+  def _replace(self, s):
+    """Replaces the file with one holding a string, and reopens it."""
+    directory, base = os.path.split(os.path.abspath(self._filename))
+    fd, tmpName = tempfile.mkstemp(prefix=base + '.', dir=directory)
+    try:
+      try:
+        os.fchmod(fd, os.fstat(self._fh.fileno()).st_mode & 07777)
+        os.write(fd, s)
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+      os.rename(tmpName, self._filename)
+    except OSError:
+      os.unlink(tmpName)
+      raise
+    self._fh.close()
+    self._fh = open(self._filename, 'a+')
+
   def _assertCanModify(self):
     """Asserts that mutative operations are allowed on this object."""
     assert self._fh, "Configuration not open"
@@ -269,6 +342,7 @@ class Configuration(object):
     if not replace and self.haveVdo(name):
       return False
     self._vdos[name] = vdo
+    self._changedVdos.add(name)
     self._dirty = True
     return True
 
@@ -288,6 +362,7 @@ class Configuration(object):
     if not replace and self.haveAlbserver(name):
       return False
     self._albservers[name] = albserver
+    self._changedAlbservers.add(name)
     self._dirty = True
     return True
 
@@ -323,12 +398,14 @@ class Configuration(object):
     """Removes a VDO by name."""
     self._assertCanModify()
     del self._vdos[name]
+    self._changedVdos.add(name)
     self._dirty = True
 
   def removeAlbserver(self, name):
     """Removes an albserver by name."""
     self._assertCanModify()
     del self._albservers[name]
+    self._changedAlbservers.add(name)
     self._dirty = True
 
   def listAllVdos(self):
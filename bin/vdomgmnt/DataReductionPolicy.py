@@ -0,0 +1,308 @@
+"""
+  DataReductionPolicy - turns compression and deduplication on and off
+  by the benefit they bring
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/DataReductionPolicy.py#1 $
+
+"""
+from . import ArgumentError, CommandError, Configuration, DeviceMapper
+from . import KernelModuleService, Logger, Utils, VdoStatistics
+import os
+import time
+
+
+class DataReductionPolicy(object):
+  """DataReductionPolicy measures, window by window, what compression
+  and deduplication save on each of a set of running VDO volumes, and
+  pauses either one on a volume where it is not worth its cost.
+
+  Over each window the policy works out, as shares of the blocks
+  written to a volume:
+
+    - the compression savings: compressed fragments written less the
+      blocks they were packed into;
+    - the deduplication hits: writes for which the index gave valid
+      advice; and
+    - the deduplication timeouts: writes which waited for advice which
+      never came.
+
+  It also measures the CPU used by all the kvdo kernel threads, as a
+  share of all the CPUs; the kernel does not say which volume a thread
+  is working for, so this is shared by all the volumes.
+
+  A feature is worth keeping if it saves at least its minimum share of
+  the writes, or three times that while the kvdo threads use more than
+  the CPU budget. Deduplication is also not worth keeping while more
+  writes time out waiting for advice than get it. A feature which is
+  not worth keeping for several windows in a row is paused, with the
+  'compression off' or 'disconnect' message to the device. A paused
+  feature saves nothing and so cannot be measured, so after a number of
+  windows it is resumed, with 'compression on' or 'reconnect', to see
+  whether the workload has changed.
+
+  Only features which are enabled in a volume's configuration and are
+  on when the policy starts are managed, and the policy resumes any it
+  paused when it stops, so it never leaves a volume with less than its
+  configuration calls for. The configuration is read again before a
+  feature is resumed, and a feature which has been disabled since is
+  left alone from then on. A volume which is stopped or restarted comes
+  up with the features its configuration calls for, so any the policy
+  had paused are counted as on again. Every change is logged.
+
+  Attributes:
+    volumes (list of VdoService): the volumes being managed
+    confFile (str): the configuration file holding the volumes
+    cpuBudget (float): the share of all CPUs the kvdo threads may use
+      before the features must save more to be kept
+    _kms (KernelModuleService): the kernel module
+    _features (dict): for each (volume name, feature) pair managed, a
+      list of whether it is on, the windows in a row it has not been
+      worth keeping while on, or the windows it has been paused
+    _previous (dict): the last statistics read for each volume
+    _previousCpu (tuple): the time and the kvdo CPU seconds at the last
+      window
+  """
+  log = Logger.getLogger(Logger.myname + '.DataReductionPolicy')
+
+  COMPRESSION = 'compression'
+  DEDUPLICATION = 'deduplication'
+
+  # The least share of writes each feature must save to be kept.
+  minimumSavings = {COMPRESSION: 0.05, DEDUPLICATION: 0.02}
+  # How much more a feature must save while CPU is over budget.
+  cpuPressureFactor = 3
+  # Windows with fewer writes than this say nothing about the workload.
+  minWrites = 1000
+  # The windows in a row a feature must not be worth keeping before it
+  # is paused, and the windows it stays paused before being retried.
+  hysteresis = 3
+  retryWindows = 30
+
+  # The messages which resume and pause each feature.
+  _messages = {COMPRESSION: (['compression', 'on'], ['compression', 'off']),
+               DEDUPLICATION: (['reconnect'], ['disconnect'])}
+
+  def __init__(self, volumes, confFile, cpuBudget):
+    """Constructs a DataReductionPolicy.
+
+    Arguments:
+      volumes (list of VdoService): the volumes to manage
+      confFile (str): the configuration file holding the volumes
+      cpuBudget (float): the share of all CPUs the kvdo threads may use
+        before the features must save more to be kept
+    """
+    self.volumes = list(volumes)
+    self.confFile = confFile
+    self.cpuBudget = cpuBudget
+    self._kms = KernelModuleService()
+    self._features = {}
+    for vdo in self.volumes:
+      compressing = self._kms.getPoolAttribute(vdo.getName(), 'compressing')
+      if vdo.enableCompression and compressing != '0':
+        self._features[(vdo.getName(), self.COMPRESSION)] = [True, 0]
+      if vdo.enableDeduplication:
+        self._features[(vdo.getName(), self.DEDUPLICATION)] = [True, 0]
+    self._previous = {}
+    self._previousCpu = None
+
+  def __str__(self):
+    return "DataReductionPolicy({0})".format(
+        ",".join(vdo.getName() for vdo in self.volumes))
+
+  def run(self, interval):
+    """Applies the policy every interval seconds until interrupted,
+    then resumes every paused feature.
+
+    Arguments:
+      interval (float): the seconds in each window
+    """
+    try:
+      while True:
+        start = time.time()
+        self.step()
+        time.sleep(max(0, start + interval - time.time()))
+    finally:
+      self.resumeAll()
+
+  def step(self):
+    """Measures the window since the last step and pauses or resumes
+    features as the measurements call for.
+
+    Returns:
+      A list of the changes made, each a (volume name, feature, on)
+      tuple.
+    """
+    cpu = self._cpuShare()
+    changes = []
+    for vdo in self.volumes:
+      name = vdo.getName()
+      savings = self._measure(name)
+      if name not in self._previous:
+        # The volume is not running.
+        continue
+      for feature in [self.COMPRESSION, self.DEDUPLICATION]:
+        state = self._features.get((name, feature))
+        if state is None:
+          continue
+        if not state[0]:
+          state[1] += 1
+          if state[1] >= self.retryWindows:
+            reason = _("retrying after {0} windows").format(state[1])
+            if self._set(name, feature, True, reason):
+              changes.append((name, feature, True))
+          continue
+        if savings is None:
+          continue
+        reason = self._notWorthIt(feature, savings, cpu)
+        if reason is None:
+          state[1] = 0
+          continue
+        state[1] += 1
+        if state[1] >= self.hysteresis:
+          if self._set(name, feature, False, reason):
+            changes.append((name, feature, False))
+    return changes
+
+  def resumeAll(self):
+    """Resumes every feature the policy has paused."""
+    for (name, feature), state in sorted(self._features.items()):
+      if not state[0]:
+        self._set(name, feature, True, _("policy stopped"))
+
+  def _notWorthIt(self, feature, savings, cpu):
+    """Decides whether a feature is worth keeping on a volume.
+
+    Arguments:
+      feature (str): the feature
+      savings (dict): the shares of writes measured on the volume, as
+        returned by _measure
+      cpu (float): the share of all CPUs the kvdo threads used, or None
+        if not known
+    Returns:
+      Why the feature is not worth keeping, or None if it is.
+    """
+    required = self.minimumSavings[feature]
+    overBudget = cpu is not None and cpu > self.cpuBudget
+    if overBudget:
+      required *= self.cpuPressureFactor
+    saved = savings[feature]
+    if feature == self.DEDUPLICATION and savings['timeouts'] > saved:
+      return _("{0:.1%} of writes timed out waiting for advice, more than"
+               " the {1:.1%} deduplicated").format(savings['timeouts'],
+                                                   saved)
+    if saved >= required:
+      return None
+    if overBudget:
+      return _("saves {0:.1%} of writes, less than {1:.1%} while kvdo uses"
+               " {2:.0%} of CPU").format(saved, required, cpu)
+    return _("saves {0:.1%} of writes, less than {1:.1%}").format(saved,
+                                                                  required)
+
+  def _measure(self, name):
+    """Reads the statistics of a volume and works out what each feature
+    saved since the last window.
+
+    Returns:
+      A dictionary of the shares of writes saved by compression and
+      deduplication and timed out waiting for advice, or None if the
+      volume is not running, was only just seen, or wrote too little.
+    """
+    reader = VdoStatistics(name)
+    try:
+      stats = reader.dedupe()
+      kernel = reader.kernel()
+    except CommandError as ex:
+      self.log.debug(str(ex))
+      self._previous.pop(name, None)
+      self._restarted(name)
+      return None
+    current = (kernel.biosIn.write, stats.compressedFragmentsWritten,
+               stats.compressedBlocksWritten, kernel.dedupeAdviceValid,
+               kernel.dedupeAdviceTimeouts)
+    previous = self._previous.get(name)
+    self._previous[name] = current
+    if previous is None:
+      return None
+    writes, fragments, blocks, valid, timeouts = [
+        now - then for now, then in zip(current, previous)]
+    if any(now < then for now, then in zip(current, previous)):
+      # The counters started again, so the volume was restarted.
+      self._restarted(name)
+      return None
+    if writes < self.minWrites:
+      return None
+    savings = {self.COMPRESSION: float(fragments - blocks) / writes,
+               self.DEDUPLICATION: float(valid) / writes,
+               'timeouts': float(timeouts) / writes}
+    self.log.debug("{0}: {1} writes, compression {2:.3f}, deduplication"
+                   " {3:.3f}, timeouts {4:.3f}".format(
+                     name, writes, savings[self.COMPRESSION],
+                     savings[self.DEDUPLICATION], savings['timeouts']))
+    return savings
+
+  def _restarted(self, name):
+    """Notes that a volume has stopped, and will have the features its
+    configuration calls for if it is started again."""
+    for feature in [self.COMPRESSION, self.DEDUPLICATION]:
+      state = self._features.get((name, feature))
+      if state is not None and not state[0]:
+        self.log.info(_("{0} was stopped; {1} is no longer paused").format(
+            name, feature))
+        self._features[(name, feature)] = [True, 0]
+
+  def _enabled(self, name, feature):
+    """Returns True iff a feature is still enabled in the configuration
+    of a volume."""
+    try:
+      with Configuration(self.confFile, mustExist=True) as conf:
+        vdo = conf.getVdo(name)
+    except (ArgumentError, KeyError) as ex:
+      self.log.debug("Cannot read {0}: {1}".format(name, ex))
+      return False
+    if feature == self.COMPRESSION:
+      return vdo.enableCompression
+    return vdo.enableDeduplication
+
+  def _set(self, name, feature, on, reason):
+    """Pauses or resumes a feature on a volume.
+
+    Arguments:
+      name (str): the volume
+      feature (str): the feature
+      on (bool): True to resume the feature, False to pause it
+      reason (str): why, for the log
+    Returns:
+      True iff the feature was changed.
+    """
+    if on and not self._enabled(name, feature):
+      self.log.announce(_("Leaving {0} off on {1}: it has been disabled"
+                          ).format(feature, name))
+      del self._features[(name, feature)]
+      return False
+    message = self._messages[feature][0 if on else 1]
+    try:
+      DeviceMapper.message(name, 0, *message)
+    except CommandError as ex:
+      self.log.warn(_("Could not {0} {1} on {2}: {3}").format(
+          _("resume") if on else _("pause"), feature, name, ex))
+      return False
+    self.log.announce(_("{0} {1} on {2}: {3}").format(
+        _("Resumed") if on else _("Paused"), feature, name, reason))
+    self._features[(name, feature)] = [on, 0]
+    # The window after a change measures neither setting.
+    self._previous.pop(name, None)
+    return True
+
+  def _cpuShare(self):
+    """Returns the share of all CPUs the kvdo kernel threads used since
+    the last call, or None on the first call."""
+    now = time.time()
+    seconds = sum(Utils.threadCpuSeconds(self._kms.getName()).values())
+    previous = self._previousCpu
+    self._previousCpu = (now, seconds)
+    if previous is None or now <= previous[0]:
+      return None
+    return ((seconds - previous[1])
+            / ((now - previous[0]) * os.sysconf('SC_NPROCESSORS_ONLN')))
@@ -25,30 +25,53 @@ class Defaults(object):
   """Defaults manages default values for arguments."""
 
   NOTSET = -1
+  adaptInterval = 10
   address = 'localhost'
   albireoIndexDir = '/mnt/dedupe-index'
   albireoMem = 0
+  albireoSaveTimeout = 300
   albireoSparse = False
   blockMapCacheSize = SizeString("128M")
   blockMapPageSize = 32768
   cfreq = 0
   confFile = os.getenv('VDO_CONF_DIR', '/etc') + '/vdoconf.xml'
+  cpuBudget = 50
+  daemonSocket = os.getenv('VDO_DAEMON_SOCKET', '/var/run/vdod.sock')
+  daemonRequestTimeout = 2
+  daemonTimeout = 10
+  dataReductionWindow = 60
+  deduplicationTimeoutInterval = 5000
+  deduplicationTimeoutIntervalBounds = (1000, 30000)
   customFile = os.getenv('VDO_CONF_DIR', '/etc') + '/vdocustom.xml'
   enable512e = False
   enabled = True
   enableCompression = False
   enableDeduplication = True
+  jobs = 1
+  lockDir = '/var/lock/vdo.d'
+  lockFile = '/var/lock/vdo'
+  lockTimeout = 20
   log = Logger.getLogger(Logger.myname + '.Defaults')
+  maxRequestsActive = 2000
+  maxRequestsActiveBounds = (1000, 8000)
   mdRaid5Mode = 'on'
+  memoryWaitTimeout = 600
+  minDeduplicationTimerInterval = 100
+  metricsAddress = 'localhost'
+  metricsInterval = 15
+  metricsPort = 9286
   port = 8000
   readCacheSize = SizeString("0")
   recoveryScanRate = 640
   recoverySweepRate = 40
   reserveSize = SizeString("0")
+  sampleDuration = 30
   udsParallelFactor = 0
   vdoPhysicalBlockSize = 4096
   vdoLogLevel = 'info'
   volumeGroup = 'dedupevg'
+  watchdogInterval = 10
+  watchdogPolicy = 'alert'
   # Default write policy for configuration; handles missing external
   # configuration scenarios.
   configuredWritePolicy = 'read_from_superblock'
@@ -56,6 +79,16 @@ class Defaults(object):
   # value used within base code at initialization if no external configuration
   # information is available.
   externalWritePolicy = 'sync'
+  historyDir = '/var/lib/vdo/history'
+  historySince = 3600
+  # The limits the kernel module sets on its tunables, by option name.
+  # The intervals are in milliseconds; the kernel further requires the
+  # deduplication timeout to be at least two clock ticks.
+  tunableLimits = {
+    'vdoDeduplicationTimeoutInterval': (1, 120000),
+    'vdoMaxRequestsActive': (1, (2 ** 31 - 1) // 2),
+    'vdoMinDeduplicationTimerInterval': (1, 1000),
+  }
 
   def __init__(self):
     pass
@@ -167,6 +200,54 @@ class Defaults(object):
     raise optparse.OptionValueError(
       _("option %s: must be an Albireo memory value") % (opt))
 
+  @classmethod
+  def checkBounds(cls, option, opt, value):
+    """Checks that an option is a pair of bounds on a tunable, given
+    as <low>:<high>, each within the limits the kernel module sets on
+    the tunable. The option's destination is the tunable's option name
+    followed by 'Bounds'.
+
+    Arguments:
+      option (Option): The option being checked.
+      opt (str): Name of the option being checked.
+      value (str): Value provided as an argument to the option.
+    Returns:
+      The bounds as a tuple of two integers.
+    Raises:
+      OptionValueError
+    """
+    low, high = cls.tunableLimits[option.dest[:-len('Bounds')]]
+    m = re.match(r"^(\d+):(\d+)$", value)
+    if m:
+      bounds = (int(m.group(1)), int(m.group(2)))
+      if low <= bounds[0] <= bounds[1] <= high:
+        return bounds
+    raise optparse.OptionValueError(
+      _("option %s: must be <low>:<high>, integers from %d to %d")
+      % (opt, low, high))
+
+  @staticmethod
+  def checkDuration(unused_option, opt, value):
+    """Checks that an option is a length of time: a positive integer
+    with an optional s(econds), m(inutes), h(ours), d(ays), or w(eeks)
+    suffix; seconds are assumed if there is no suffix.
+
+    Arguments:
+      opt (str): Name of the option being checked.
+      value (str): Value provided as an argument to the option.
+    Returns:
+      The length of time in seconds.
+    Raises:
+      OptionValueError
+    """
+    multipliers = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    m = re.match(r"^(\d+)([smhdw]?)$", value.lower())
+    if m and int(m.group(1)) > 0:
+      return int(m.group(1)) * multipliers.get(m.group(2), 1)
+    raise optparse.OptionValueError(
+      _("option %s: must be a length of time, s/m/h/d/w suffix optional")
+      % (opt))
+
   @staticmethod
   def checkLv(unused_option, opt, value):
     """Checks that an option is a valid name for a logical volume.
@@ -216,6 +297,27 @@ class Defaults(object):
     raise optparse.OptionValueError(
       _("option %s: must be a power of 2, K/M suffix optional") % (opt))
 
+  @staticmethod
+  def checkPosint(unused_option, opt, value):
+    """Checks that an option is a positive integer.
+
+    Arguments:
+      opt (str): Name of the option being checked.
+      value (str): Value provided as an argument to the option.
+    Returns:
+      The value converted to an integer.
+    Raises:
+      OptionValueError
+    """
+    try:
+      n = int(value)
+      if n > 0:
+        return n
+    except ValueError:
+      pass
+    raise optparse.OptionValueError(
+      _("option %s: must be a positive integer") % (opt))
+
   @staticmethod
   def checkPow2(unused_option, opt, value):
     """Checks that an option is an integer power of two.
@@ -257,6 +359,30 @@ class Defaults(object):
     raise optparse.OptionValueError(
       _("option %s: must be an LVM-style size string") % (opt))
 
+  @classmethod
+  def checkTunable(cls, option, opt, value):
+    """Checks that an option is an integer within the limits the
+    kernel module sets on the tunable it sets.
+
+    Arguments:
+      option (Option): The option being checked.
+      opt (str): Name of the option being checked.
+      value (str): Value provided as an argument to the option.
+    Returns:
+      The value converted to an integer.
+    Raises:
+      OptionValueError
+    """
+    low, high = cls.tunableLimits[option.dest]
+    try:
+      n = int(value)
+      if low <= n <= high:
+        return n
+    except ValueError:
+      pass
+    raise optparse.OptionValueError(
+      _("option %s: must be an integer from %d to %d") % (opt, low, high))
+
   @staticmethod
   def checkVg(unused_option, opt, value):
     """Checks that an option is a valid name for a volume group.
@@ -276,3 +402,29 @@ class Defaults(object):
       return value
     raise optparse.OptionValueError(
       _("option %s: volume group names cannot contain slashes") % (opt))
+
+  @staticmethod
+  def checkWindow(unused_option, opt, value):
+    """Checks that an option is a daily time window, given as
+    <HH:MM>-<HH:MM> in local time; a window whose end is before its
+    start runs past midnight.
+
+    Arguments:
+      opt (str): Name of the option being checked.
+      value (str): Value provided as an argument to the option.
+    Returns:
+      The start and end of the window as a tuple of minutes after
+      midnight.
+    Raises:
+      OptionValueError
+    """
+    m = re.match(r"^(\d{1,2}):(\d\d)-(\d{1,2}):(\d\d)$", value)
+    if m:
+      hours = [int(m.group(1)), int(m.group(3))]
+      minutes = [int(m.group(2)), int(m.group(4))]
+      if max(hours) < 24 and max(minutes) < 60:
+        window = (hours[0] * 60 + minutes[0], hours[1] * 60 + minutes[1])
+        if window[0] != window[1]:
+          return window
+    raise optparse.OptionValueError(
+      _("option %s: must be a time window, <HH:MM>-<HH:MM>") % (opt))
@@ -0,0 +1,333 @@
+"""
+  DeviceMapper - talks to the device mapper without running dmsetup
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/DeviceMapper.py#1 $
+
+"""
+from . import Command, CommandError, Logger
+import array
+import fcntl
+import os
+import re
+import struct
+import threading
+
+
+class DeviceMapper(object):
+  """DeviceMapper queries and controls device mapper devices by issuing
+  ioctls on /dev/mapper/control directly, which avoids a fork and exec
+  of dmsetup for every operation.
+
+  If the control device cannot be opened (for instance when not
+  running as root, or when the device mapper is not available) or
+  Command.noRunMode is True, every method falls back to running the
+  equivalent dmsetup command. Operations which change state and are
+  performed with an ioctl print and log the equivalent dmsetup command
+  as a Command would, and notify the Command listeners as though it
+  had been run, so that cached state stays consistent.
+
+  Attributes:
+    controlPath (str): the device mapper control device
+    _fd (int): the open control device, None if not yet opened, or -1
+      if it could not be opened
+    _lock (threading.Lock): protects _fd
+  """
+  log = Logger.getLogger(Logger.myname + '.DeviceMapper')
+  controlPath = '/dev/mapper/control'
+  _fd = None
+  _lock = threading.Lock()
+
+  # Definitions from <linux/dm-ioctl.h>. The header is struct dm_ioctl;
+  # the version is the oldest interface providing what we use.
+  _version = (4, 0, 0)
+  _headerFormat = '=3IIIIiIIIQ128s129s7s'
+  _headerSize = struct.calcsize(_headerFormat)
+  _nameListFormat = '=QI'
+  _targetSpecFormat = '=QQiI16s'
+  _DM_LIST_DEVICES = 2
+  _DM_DEV_SUSPEND = 6
+  _DM_TABLE_STATUS = 12
+  _DM_TARGET_MSG = 14
+  _DM_SUSPEND_FLAG = 1 << 1
+  _DM_STATUS_TABLE_FLAG = 1 << 4
+  _DM_BUFFER_FULL_FLAG = 1 << 8
+  _DM_DATA_OUT_FLAG = 1 << 16
+  _initialBufferSize = 16384
+
+  def __init__(self):
+    pass
+
+  @classmethod
+  def available(cls):
+    """Returns True iff operations will be done with ioctls rather than
+    by running dmsetup."""
+    return cls._control() >= 0
+
+  @classmethod
+  def statusAll(cls):
+    """Returns the status of every device mapper device.
+
+    Returns:
+      A dictionary mapping each device name to its status as reported
+      by 'dmsetup status', one line per target.
+    """
+    if not cls.available():
+      return cls._parseStatusOutput(
+          Command(['dmsetup', 'status']).runOutput() or '')
+    devices = {}
+    for name in cls.listDevices():
+      try:
+        devices[name] = "\n".join(cls._formatTarget(target)
+                                  for target in cls.status(name))
+      except CommandError:
+        # The device went away after we listed it.
+        pass
+    return devices
+
+  @classmethod
+  def listDevices(cls):
+    """Returns a list of the names of all device mapper devices."""
+    if not cls.available():
+      return sorted(cls.statusAll().keys())
+    header, buf = cls._ioctl(cls._DM_LIST_DEVICES, 'dmsetup ls')
+    names = []
+    offset = header['dataStart']
+    while True:
+      dev, nextOffset = struct.unpack_from(cls._nameListFormat, buf, offset)
+      if dev == 0:
+        break
+      names.append(cls._cString(buf, offset
+                                + struct.calcsize(cls._nameListFormat)))
+      if nextOffset == 0:
+        break
+      offset += nextOffset
+    return names
+
+  @classmethod
+  def status(cls, name):
+    """Returns the status of a device.
+
+    Arguments:
+      name (str): the device name
+    Returns:
+      A list of (start, length, target type, status) tuples, one per
+      target.
+    Exceptions:
+      CommandError: there is no such device, or the status could not
+        be read
+    """
+    if not cls.available():
+      cmd = Command(['dmsetup', 'status', name])
+      cmd()
+      return [cls._parseTarget(line)
+              for line in (cmd.stdout or '').splitlines() if line]
+    header, buf = cls._ioctl(cls._DM_TABLE_STATUS, 'dmsetup status', name)
+    targets = []
+    specSize = struct.calcsize(cls._targetSpecFormat)
+    offset = header['dataStart']
+    for unused_count in range(header['targetCount']):
+      start, length, unused_status, nextOffset, targetType = (
+          struct.unpack_from(cls._targetSpecFormat, buf, offset))
+      targets.append((start, length, targetType.rstrip('\0'),
+                      cls._cString(buf, offset + specSize)))
+      offset = header['dataStart'] + nextOffset
+    return targets
+
+  @classmethod
+  def table(cls, name):
+    """Returns the table a device was loaded with.
+
+    Arguments:
+      name (str): the device name
+    Returns:
+      A list of (start, length, target type, parameters) tuples, one
+      per target.
+    Exceptions:
+      CommandError: there is no such device, or the table could not
+        be read
+    """
+    if not cls.available():
+      cmd = Command(['dmsetup', 'table', name])
+      cmd()
+      return [cls._parseTarget(line)
+              for line in (cmd.stdout or '').splitlines() if line]
+    header, buf = cls._ioctl(cls._DM_TABLE_STATUS, 'dmsetup table', name,
+                             cls._DM_STATUS_TABLE_FLAG)
+    targets = []
+    specSize = struct.calcsize(cls._targetSpecFormat)
+    offset = header['dataStart']
+    for unused_count in range(header['targetCount']):
+      start, length, unused_status, nextOffset, targetType = (
+          struct.unpack_from(cls._targetSpecFormat, buf, offset))
+      targets.append((start, length, targetType.rstrip('\0'),
+                      cls._cString(buf, offset + specSize)))
+      offset = header['dataStart'] + nextOffset
+    return targets
+
+  @classmethod
+  def suspend(cls, name):
+    """Suspends a device.
+
+    Exceptions:
+      CommandError: the device could not be suspended
+    """
+    cls._run(['suspend', name], cls._DM_DEV_SUSPEND, name,
+             cls._DM_SUSPEND_FLAG)
+
+  @classmethod
+  def resume(cls, name):
+    """Resumes a suspended device.
+
+    Exceptions:
+      CommandError: the device could not be resumed
+    """
+    cls._run(['resume', name], cls._DM_DEV_SUSPEND, name)
+
+  @classmethod
+  def message(cls, name, sector, *args):
+    """Sends a message to a device's target.
+
+    Arguments:
+      name (str): the device name
+      sector (int): the sector identifying the target
+      args (str): the words of the message
+    Returns:
+      Any response from the target, as a string.
+    Exceptions:
+      CommandError: the message could not be delivered or was rejected
+    """
+    text = ' '.join(str(arg) for arg in args)
+    payload = struct.pack('=Q', sector) + text + '\0'
+    header, buf = cls._run(['message', name, str(sector)] + list(args),
+                           cls._DM_TARGET_MSG, name, payload=payload)
+    if header is None:
+      return ''
+    if header['flags'] & cls._DM_DATA_OUT_FLAG:
+      return cls._cString(buf, header['dataStart'])
+    return ''
+
+  @classmethod
+  def _run(cls, dmsetupArgs, command, name, flags=0, payload=''):
+    """Performs a device mapper operation that changes state, using an
+    ioctl if possible and dmsetup otherwise.
+
+    Arguments:
+      dmsetupArgs (list): the arguments to the equivalent dmsetup command
+      command (int): the ioctl number
+      name (str): the device name
+      flags (int): ioctl flags
+      payload (str): data following the ioctl header
+    Returns:
+      The (header, buffer) result of the ioctl, or (None, None) if
+      dmsetup was used.
+    Exceptions:
+      CommandError: the operation failed
+    """
+    cmdList = ['dmsetup'] + [str(arg) for arg in dmsetupArgs]
+    if not cls.available():
+      Command(cmdList)()
+      return None, None
+    cmdLine = ' '.join(cmdList)
+    if Command.defaultVerbose > 0:
+      print('    ' + cmdLine)
+    cls.log.info(cmdLine)
+    try:
+      return cls._ioctl(command, cmdLine, name, flags, payload)
+    finally:
+      Command.notifyListeners(cmdList)
+
+  @classmethod
+  def _ioctl(cls, command, description, name='', flags=0, payload=''):
+    """Issues a device mapper ioctl, enlarging the buffer and retrying
+    if the kernel reports that the result did not fit.
+
+    Arguments:
+      command (int): the ioctl number
+      description (str): the equivalent dmsetup command, for logging
+        and error messages
+      name (str): the device name, if any
+      flags (int): ioctl flags
+      payload (str): data following the ioctl header
+    Returns:
+      A tuple of a dictionary of the interesting header fields and the
+      array of bytes holding the result.
+    Exceptions:
+      CommandError: the ioctl failed
+    """
+    cls.log.debug(description + " (ioctl)")
+    request = (3 << 30) | (cls._headerSize << 16) | (0xfd << 8) | command
+    if request > 0x7fffffff:
+      # fcntl.ioctl takes a signed int.
+      request -= 1 << 32
+    size = max(cls._initialBufferSize, cls._headerSize + len(payload))
+    while True:
+      # fcntl.ioctl only fills in a mutable buffer it can write to
+      # directly, which a bytearray is not in Python 2.
+      buf = array.array('B', '\0' * size)
+      struct.pack_into(cls._headerFormat, buf, 0, cls._version[0],
+                       cls._version[1], cls._version[2], size,
+                       cls._headerSize, 0, 0, flags, 0, 0, 0, name, '', '')
+      buf[cls._headerSize:cls._headerSize + len(payload)] = array.array(
+          'B', payload)
+      try:
+        fcntl.ioctl(cls._control(), request, buf, True)
+      except IOError as ex:
+        raise CommandError(_("{cmd}: {err}").format(cmd=description,
+                                                     err=ex.strerror))
+      fields = struct.unpack_from(cls._headerFormat, buf, 0)
+      header = {'dataStart': fields[4], 'targetCount': fields[5],
+                'flags': fields[7]}
+      if not header['flags'] & cls._DM_BUFFER_FULL_FLAG:
+        return header, buf
+      size *= 4
+
+  @classmethod
+  def _control(cls):
+    """Returns the file descriptor of the control device, opening it
+    if necessary, or -1 if it is unavailable or noRun mode is set."""
+    if Command.noRunMode():
+      return -1
+    with cls._lock:
+      if cls._fd is None:
+        try:
+          cls._fd = os.open(cls.controlPath, os.O_RDWR)
+        except OSError as ex:
+          cls.log.debug("Using dmsetup, cannot open {0}: {1}".format(
+              cls.controlPath, ex.strerror))
+          cls._fd = -1
+      return cls._fd
+
+  @staticmethod
+  def _cString(buf, offset):
+    """Returns the NUL-terminated string starting at an offset in a
+    array of bytes."""
+    return buf[offset:].tostring().split('\0', 1)[0]
+
+  @staticmethod
+  def _formatTarget(target):
+    """Formats a target status tuple as dmsetup does."""
+    return "{0} {1} {2} {3}".format(*target)
+
+  @staticmethod
+  def _parseTarget(line):
+    """Parses one target line of dmsetup status output into a tuple."""
+    fields = line.split(' ', 3)
+    fields.extend([''] * (4 - len(fields)))
+    return (int(fields[0]), int(fields[1]), fields[2], fields[3])
+
+  @classmethod
+  def _parseStatusOutput(cls, output):
+    """Parses the output of 'dmsetup status' for all devices into a
+    dictionary mapping device names to status."""
+    devices = {}
+    matcher = re.compile(r"(.+?): (\d+ \d+ .*)$")
+    for line in output.splitlines():
+      m = matcher.match(line)
+      if m:
+        if m.group(1) in devices:
+          devices[m.group(1)] += "\n" + m.group(2)
+        else:
+          devices[m.group(1)] = m.group(2)
+    return devices
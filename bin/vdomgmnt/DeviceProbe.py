@@ -0,0 +1,233 @@
+"""
+  DeviceProbe - chooses VDO settings to suit the storage under a volume
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/DeviceProbe.py#1 $
+
+"""
+from . import Command, Logger, StorageGeometry
+import os
+import time
+
+
+class DeviceProbe(object):
+  """DeviceProbe inspects the stack of block devices under a VDO volume
+  and chooses the mdRaid5Mode and writePolicy settings which suit it.
+
+  The stack is found by following the slaves directories in sysfs from
+  the backing device down through any device mapper and MD devices to
+  the disks. On every device in the stack, the probe reads the MD RAID
+  level, whether the queue has a volatile write cache
+  (queue/write_cache), whether it supports FUA writes (queue/fua), and
+  whether it is rotational.
+
+  The probe may also time a few small writes, each followed by a
+  flush, at the start of the backing device. This overwrites whatever
+  is there, so it is only done while creating a volume, before the
+  device is formatted.
+
+  The choices are:
+    mdRaid5Mode: 'on' iff there is a RAID4, RAID5, or RAID6 MD array
+      in the stack, since the optimization only helps parity RAID.
+    writePolicy: 'sync' iff every device in the stack reports a write
+      through cache and, if measured, flushes take as long as a real
+      write to the media, so that writes are stable once complete;
+      otherwise 'async', so that VDO flushes the volatile cache when
+      asked to make data stable. The cache type the kernel reports is
+      followed; FUA support is only consulted for a device whose cache
+      type is unknown, where it shows that the device has a cache to
+      bypass.
+
+  In noRun mode, or for a device which cannot be inspected, nothing is
+  known, so the choices are 'off' and 'async'.
+
+  Attributes:
+    path (str): the backing device
+    stack (list of str): the kernel names of the devices found, from
+      the backing device down
+    raidLevels (dict): the RAID level of each MD array in the stack
+    writeCaches (dict): the write cache type of each device which
+      reports one, either 'write back' or 'write through'
+    fua (dict): whether each device which reports it supports FUA
+    rotational (bool): True if any device in the stack is rotational
+    flushLatency (float): the median seconds for a write and a flush,
+      or None if not measured
+    mdRaid5Mode (str): the chosen mdRaid5Mode
+    writePolicy (str): the chosen writePolicy
+    reasons (list of str): why each choice was made
+  """
+  log = Logger.getLogger(Logger.myname + '.DeviceProbe')
+  # The number of flushes timed, and the size of the write before each.
+  flushSamples = 16
+  flushWriteSize = 4096
+  # A flush quicker than this cannot have reached rotating media, so a
+  # rotational device which reports a write through cache but flushes
+  # this fast has a volatile cache after all.
+  fastFlush = 0.0005
+
+  def __init__(self, path):
+    self.path = path
+    self.stack = []
+    self.raidLevels = {}
+    self.writeCaches = {}
+    self.fua = {}
+    self.rotational = False
+    self.flushLatency = None
+    self.mdRaid5Mode = None
+    self.writePolicy = None
+    self.reasons = []
+
+  def __str__(self):
+    return "DeviceProbe({0})".format(self.path)
+
+  def probe(self, benchmark=False):
+    """Inspects the device stack and makes the choices.
+
+    Arguments:
+      benchmark (bool): if True, also time flushes, overwriting the
+        start of the device
+    Returns:
+      This probe.
+    """
+    if not Command.noRunMode():
+      self._inspect(os.path.basename(os.path.realpath(self.path)))
+      if benchmark:
+        self.flushLatency = self._timeFlushes()
+    self._choose()
+    return self
+
+  def notes(self):
+    """Returns the reasons for the choices as one line, as recorded in
+    the configuration file."""
+    return "; ".join(self.reasons)
+
+  def report(self):
+    """Returns a list of lines describing what was found and chosen."""
+    lines = [_("Device stack: {0}").format(
+        " -> ".join(self.stack) if self.stack else _("unknown"))]
+    for name in self.stack:
+      facts = []
+      if name in self.raidLevels:
+        facts.append(self.raidLevels[name])
+      facts.append(self.writeCaches.get(name, _("cache unknown")))
+      if name in self.fua:
+        facts.append(_("FUA") if self.fua[name] else _("no FUA"))
+      lines.append("  {0}: {1}".format(name, ", ".join(facts)))
+    if self.flushLatency is not None:
+      lines.append(_("Flush latency: {0:.3f} ms").format(
+          self.flushLatency * 1000))
+    lines.append(_("MD RAID5 mode: {0}").format(self.mdRaid5Mode))
+    lines.append(_("Write policy: {0}").format(self.writePolicy))
+    lines.extend("  " + reason for reason in self.reasons)
+    return lines
+
+  def _inspect(self, name):
+    """Records the facts about a device and everything under it.
+
+    Arguments:
+      name (str): the kernel name of the device
+    """
+    if name in self.stack:
+      return
+    sysDir = os.path.join(StorageGeometry.sysBlockDir, name)
+    if not os.path.isdir(sysDir):
+      self.log.debug("No sysfs entry for {0}".format(name))
+      return
+    self.stack.append(name)
+    readSysfs = StorageGeometry.readSysfs
+    level = readSysfs(os.path.join(sysDir, 'md', 'level'))
+    if level:
+      self.raidLevels[name] = level
+    queueDir = os.path.join(sysDir, 'queue')
+    if not os.path.isdir(queueDir):
+      # A partition uses the queue of the disk containing it.
+      queueDir = os.path.join(sysDir, '..', 'queue')
+    cache = readSysfs(os.path.join(queueDir, 'write_cache'))
+    if cache:
+      self.writeCaches[name] = cache
+    fua = readSysfs(os.path.join(queueDir, 'fua'))
+    if fua:
+      self.fua[name] = fua == '1'
+    if readSysfs(os.path.join(queueDir, 'rotational')) == '1':
+      self.rotational = True
+    slavesDir = os.path.join(sysDir, 'slaves')
+    if os.path.isdir(slavesDir):
+      for slave in sorted(os.listdir(slavesDir)):
+        self._inspect(slave)
+
+  def _timeFlushes(self):
+    """Times small writes to the start of the device, each followed by
+    a flush.
+
+    Returns:
+      The median seconds for a write and flush, or None if the device
+      could not be written.
+    """
+    samples = []
+    block = '\0' * self.flushWriteSize
+    try:
+      fd = os.open(self.path, os.O_WRONLY)
+    except OSError as ex:
+      self.log.warn(_("Cannot time flushes on {0}: {1}").format(
+          self.path, ex.strerror))
+      return None
+    try:
+      for unused_i in range(self.flushSamples):
+        os.lseek(fd, 0, os.SEEK_SET)
+        start = time.time()
+        os.write(fd, block)
+        os.fsync(fd)
+        samples.append(time.time() - start)
+    except OSError as ex:
+      self.log.warn(_("Cannot time flushes on {0}: {1}").format(
+          self.path, ex.strerror))
+      return None
+    finally:
+      os.close(fd)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+  def _choose(self):
+    """Chooses mdRaid5Mode and writePolicy from the facts found."""
+    self.reasons = []
+    parity = sorted(name for name, level in self.raidLevels.items()
+                    if level in ['raid4', 'raid5', 'raid6'])
+    if parity:
+      self.mdRaid5Mode = 'on'
+      self.reasons.append(_("mdRaid5Mode on: parity RAID on {0}").format(
+          ",".join(parity)))
+    else:
+      self.mdRaid5Mode = 'off'
+      self.reasons.append(_("mdRaid5Mode off: no parity RAID found"))
+
+    volatile = sorted(name for name, cache in self.writeCaches.items()
+                      if cache != 'write through')
+    unknown = [name for name in self.stack if name not in self.writeCaches]
+    fua = [name for name in unknown if self.fua.get(name)]
+    if volatile:
+      self.writePolicy = 'async'
+      self.reasons.append(_("writePolicy async: volatile write cache on"
+                            " {0}").format(",".join(volatile)))
+    elif fua:
+      self.writePolicy = 'async'
+      self.reasons.append(_("writePolicy async: {0} honours FUA, so has a"
+                            " write cache").format(",".join(fua)))
+    elif unknown or not self.stack:
+      self.writePolicy = 'async'
+      self.reasons.append(_("writePolicy async: write cache of {0}"
+                            " unknown").format(",".join(unknown)
+                                               or self.path))
+    elif (self.rotational and self.flushLatency is not None
+          and self.flushLatency < self.fastFlush):
+      self.writePolicy = 'async'
+      self.reasons.append(_("writePolicy async: flushes take {0:.3f} ms,"
+                            " too fast for rotating media with no write"
+                            " cache").format(self.flushLatency * 1000))
+    else:
+      self.writePolicy = 'sync'
+      reason = _("writePolicy sync: no volatile write cache")
+      if self.flushLatency is not None:
+        reason += _(", flushes take {0:.3f} ms").format(
+            self.flushLatency * 1000)
+      self.reasons.append(reason)
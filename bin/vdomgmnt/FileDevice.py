@@ -0,0 +1,218 @@
+"""
+  FileDevice - uses a file on a loop device for storage
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/FileDevice.py#1 $
+
+"""
+from . import ArgumentError, Command, CommandError, Logger, SizeString
+from . import StorageDevice
+import os
+
+
+class FileDevice(StorageDevice):
+  """FileDevice is storage in a sparse file, attached to a loop device.
+  It needs no spare disk, volume group, or partition, so it is meant
+  for trying VDO out and for testing; it is not meant for production
+  use. Since a file has no natural size, it must be created with an
+  explicit size.
+
+  Attributes:
+    _path (str): the file
+  """
+  log = Logger.getLogger(Logger.myname + '.FileDevice')
+
+  def __init__(self, path):
+    """Constructs a FileDevice.
+
+    Arguments:
+      path (str): the path of the file
+    Exceptions:
+      ArgumentError: invalid path
+    """
+    super(FileDevice, self).__init__()
+    if not os.path.isabs(path):
+      raise ArgumentError(_("Invalid backing file path {path}").format(
+          path=path))
+    self._path = path
+
+  def __str__(self):
+    """Returns the specification of this file, as persisted in the
+    configuration file."""
+    return 'file:' + self._path
+
+  def __repr__(self):
+    return "FileDevice(" + self._path + ")"
+
+  def canCreate(self):
+    """Tests whether this file can be created. Its directory must exist
+    and the file must not.
+
+    Exceptions:
+      ArgumentError: this file cannot be created
+    """
+    directory = os.path.dirname(self._path)
+    if not os.path.isdir(directory):
+      raise ArgumentError(_("Directory {dir} does not exist").format(
+          dir=directory))
+    if self.exists():
+      raise ArgumentError(_("Backing file {path} already exists").format(
+          path=self._path))
+
+  def create(self, blockSize, physicalSize=None, devices=None):
+    """Creates this file and attaches it to a loop device.
+
+    Arguments:
+      blockSize (int): the block size in bytes
+      physicalSize (SizeString): the size of the file
+      devices (list of str): not meaningful for a file
+    Returns:
+      The size of the file as a SizeString.
+    Exceptions:
+      ArgumentError: no size or devices were given
+      CommandError: a command failed
+    """
+    if not physicalSize:
+      raise ArgumentError(_("A size is required for backing file"
+                            " {path}").format(path=self._path))
+    if devices:
+      raise ArgumentError(_("Cannot choose devices for backing file"
+                            " {path}").format(path=self._path))
+    self._maximumSizeCheck(physicalSize)
+    physicalSize = self._roundDown(blockSize, physicalSize)
+    self._truncate(physicalSize)
+    try:
+      self.setAvailable(True)
+    except CommandError:
+      self.remove(noThrow=True)
+      raise
+    return physicalSize
+
+  def extend(self, blockSize, physicalSize=None):
+    """Grows this file and its loop device.
+
+    Arguments:
+      blockSize (int): the block size in bytes
+      physicalSize (SizeString): the new size of the file
+    Returns:
+      The size of the file as a SizeString.
+    Exceptions:
+      ArgumentError: no size was given
+      CommandError: a command failed
+    """
+    if not physicalSize:
+      raise ArgumentError(_("A size is required to grow backing file"
+                            " {path}").format(path=self._path))
+    self._maximumSizeCheck(physicalSize)
+    physicalSize = self._roundDown(blockSize, physicalSize)
+    self._truncate(physicalSize)
+    self._refresh()
+    return physicalSize
+
+  def reduce(self, physicalSize):
+    """Shrinks this file back after a failed extend. Swallows
+    exceptions.
+
+    Arguments:
+      physicalSize (SizeString): the desired size
+    """
+    try:
+      self._truncate(physicalSize)
+      self._refresh()
+    except CommandError as ex:
+      self.log.warn(_("Could not shrink {path}: {ex}").format(
+          path=self._path, ex=ex))
+
+  def remove(self, noThrow=False):
+    """Detaches this file from its loop device and removes it.
+
+    Arguments:
+      noThrow (bool): if True, swallow exceptions
+    Exceptions:
+      CommandError: a command failed
+    """
+    try:
+      self.setAvailable(False)
+      Command(['rm', '-f', self._path])()
+      self._physicalSize = SizeString('')
+    except CommandError as ex:
+      if noThrow:
+        self.log.warn(_("Could not remove {path}: {ex}").format(
+            path=self._path, ex=ex))
+      else:
+        raise
+
+  def exists(self):
+    """Tests whether this file exists."""
+    return os.path.isfile(self._path)
+
+  def getSize(self):
+    """Returns the size of this file as a SizeString, or the size set
+    at create or extend in noRun mode. Returns a zero-byte size if the
+    size cannot be read."""
+    if Command.noRunMode():
+      return self._physicalSize
+    try:
+      return SizeString(str(os.path.getsize(self._path)) + 'B')
+    except OSError:
+      return SizeString('')
+
+  def fullpath(self):
+    """Returns the loop device this file is attached to, or the file
+    itself if it is not attached."""
+    return self._loopDevice() or self._path
+
+  def status(self):
+    """Returns the status of this file."""
+    if not self.exists():
+      return _("(not available)")
+    loop = self._loopDevice()
+    return _("file, size {size}, {loop}").format(
+        size=self.getSize().asDisplay(),
+        loop=loop if loop else _("not attached"))
+
+  def setAvailable(self, yorn):
+    """Attaches this file to a loop device or detaches it.
+
+    Arguments:
+      yorn (bool): if True, attach the file, if False, detach it
+    Exceptions:
+      CommandError: losetup failed
+    """
+    loop = self._loopDevice()
+    if yorn and not loop:
+      Command(['losetup', '--find', '--show', self._path])()
+    elif not yorn and loop:
+      Command(['losetup', '--detach', loop])()
+
+  def _loopDevice(self):
+    """Returns the loop device this file is attached to, or None."""
+    if Command.noRunMode() and not self.exists():
+      return None
+    try:
+      output = Command(['losetup', '--associated', self._path]).runOutput()
+    except CommandError:
+      return None
+    for line in output.splitlines():
+      # Lines look like "/dev/loop0: [2049]:1234 (/var/tmp/vdo.img)".
+      if line.startswith('/dev/'):
+        return line.split(':', 1)[0]
+    return None
+
+  def _refresh(self):
+    """Makes the loop device pick up a change in the size of the
+    file."""
+    loop = self._loopDevice()
+    if loop:
+      Command(['losetup', '--set-capacity', loop])()
+
+  def _truncate(self, physicalSize):
+    """Sets the size of this file, creating it if need be.
+
+    Arguments:
+      physicalSize (SizeString): the size
+    """
+    Command(['truncate', '--size', str(physicalSize.toBytes()),
+             self._path])()
+    self._physicalSize = physicalSize
@@ -0,0 +1,306 @@
+"""
+  HistoryStore - keeps a history of the statistics of a VDO volume
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/HistoryStore.py#1 $
+
+"""
+from . import CommandError, Logger
+from array import array
+import fcntl
+import mmap
+import os
+import struct
+
+
+def _uint64Typecode():
+  """Returns the array typecode for unsigned 64-bit integers."""
+  for typecode in ['L', 'Q']:
+    try:
+      if array(typecode).itemsize == 8:
+        return typecode
+    except ValueError:
+      pass
+  raise ImportError("no 64-bit array type")
+
+
+class HistoryStore(object):
+  """HistoryStore records samples of the statistics of one VDO volume
+  in a memory-mapped file of fixed-width binary records.
+
+  The file holds several ring buffers ("archives") of decreasing
+  resolution, each covering a longer period than the one before. A
+  sample is written to every archive: it replaces the archive's newest
+  record if that record is in the same step (for instance, the same
+  five minutes) and otherwise overwrites the archive's oldest record.
+  Since the statistics are running totals or levels, the newest sample
+  in each step is all that needs to be kept. With the default archives
+  a file covers a day at 10 seconds, a month at 5 minutes, and a year
+  at an hour in under 4MB, whatever the sampling rate.
+
+  A record is an unsigned 64-bit timestamp followed by one unsigned
+  64-bit value per metric, so queries read records straight out of the
+  mapped file into arrays without parsing anything.
+
+  The file starts with a header of one page:
+    magic (8 bytes), version, metric count, archive count (32 bits each)
+    the metric names, NUL separated (1024 bytes)
+    for each archive: step in seconds, slot count, next slot to write,
+      record count (32 bits each)
+
+  Attributes:
+    path (str): the history file
+    metrics (list of str): the statistics recorded, named as by
+      VdoStatistics.counterNames()
+    archives (list of tuple): the (step, slot count) of each archive,
+      finest first
+    _fd (int): the open history file, or -1
+    _map (mmap): the mapped history file, or None
+    _writable (bool): True iff the file is open for writing
+  """
+  log = Logger.getLogger(Logger.myname + '.HistoryStore')
+
+  defaultMetrics = ['dataBlocksUsed', 'overheadBlocksUsed',
+                    'logicalBlocksUsed', 'compressedFragmentsWritten',
+                    'compressedBlocksWritten', 'compressedFragmentsInPacker',
+                    'journal.entries.committed', 'journal.blocks.committed',
+                    'dedupeAdviceValid', 'dedupeAdviceStale',
+                    'dedupeAdviceTimeouts', 'biosIn.read', 'biosIn.write',
+                    'biosIn.discard', 'readCache.accesses', 'readCache.hits']
+  defaultArchives = [(10, 8640), (300, 8928), (3600, 8784)]
+
+  _typecode = _uint64Typecode()
+  _magic = 'VDOHIST\0'
+  _version = 1
+  _headerFormat = '=8sIII1024s'
+  _archiveFormat = '=IIII'
+  _headerSize = mmap.PAGESIZE
+
+  def __init__(self, path, metrics=None, archives=None):
+    self.path = path
+    self.metrics = list(metrics or self.defaultMetrics)
+    self.archives = list(archives or self.defaultArchives)
+    self._fd = -1
+    self._map = None
+    self._writable = False
+
+  def __str__(self):
+    return "HistoryStore(\"{0}\")".format(self.path)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.close()
+
+  def __del__(self):
+    self.close()
+
+  @classmethod
+  def pathFor(cls, directory, name):
+    """Returns the path of the history file of a VDO volume."""
+    return os.path.join(directory, name + '.history')
+
+  def record(self, when, values):
+    """Adds a sample to every archive.
+
+    Arguments:
+      when (int): the time of the sample, in seconds since the epoch
+      values (list): the value of each metric, in the order of metrics
+    Exceptions:
+      CommandError: the history file could not be written
+    """
+    self._open(True)
+    when = int(when)
+    recordBytes = array(self._typecode, [when] + [int(value) for value in values])
+    recordBytes = recordBytes.tostring()
+    for index, (step, slots) in enumerate(self.archives):
+      nextSlot, count = self._archiveState(index)
+      if count > 0:
+        newest = (nextSlot - 1) % slots
+        newestTime = self._timeAt(index, newest)
+        if when < newestTime:
+          # The clock went backwards; keep the records in order.
+          continue
+        if when // step == newestTime // step:
+          self._writeRecord(index, newest, recordBytes)
+          continue
+      self._writeRecord(index, nextSlot, recordBytes)
+      self._setArchiveState(index, (nextSlot + 1) % slots,
+                            min(count + 1, slots))
+
+  def query(self, since, until=None):
+    """Returns the recorded samples in a range of time, from the finest
+    archive reaching back to the start of the range.
+
+    Arguments:
+      since (int): the start of the range, in seconds since the epoch
+      until (int): the end of the range, or None for no end
+    Returns:
+      A list of (time, values) tuples in time order, where values is an
+      array indexed like metrics.
+    Exceptions:
+      CommandError: the history file could not be read
+    """
+    if not os.path.exists(self.path):
+      return []
+    self._open(False)
+    choice = None
+    for index in range(len(self.archives)):
+      nextSlot, count = self._archiveState(index)
+      if count == 0:
+        continue
+      choice = index
+      oldest = (nextSlot - count) % self.archives[index][1]
+      if self._timeAt(index, oldest) <= since:
+        break
+    if choice is None:
+      return []
+
+    # Binary search for the first record at or after since.
+    nextSlot, count = self._archiveState(choice)
+    slots = self.archives[choice][1]
+    first = nextSlot - count
+    low, high = 0, count
+    while low < high:
+      middle = (low + high) // 2
+      if self._timeAt(choice, (first + middle) % slots) < since:
+        low = middle + 1
+      else:
+        high = middle
+    # The records wanted are contiguous in the file, except that they
+    # may wrap around the end of the archive.
+    width = 1 + len(self.metrics)
+    startSlot = (first + low) % slots
+    remaining = count - low
+    data = array(self._typecode)
+    for slot, length in [(startSlot, min(remaining, slots - startSlot)),
+                         (0, max(0, remaining - (slots - startSlot)))]:
+      offset = self._recordOffset(choice, slot)
+      data.fromstring(self._map[offset:offset + length * width * 8])
+    result = []
+    for start in range(0, len(data), width):
+      if until is not None and data[start] > until:
+        break
+      result.append((data[start], data[start + 1:start + width]))
+    return result
+
+  def close(self):
+    """Unmaps and closes the history file."""
+    if self._map is not None:
+      self._map.close()
+      self._map = None
+    if self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
+
+  def _open(self, writable):
+    """Opens and maps the history file, creating it if it is being
+    written and does not exist or has a different layout.
+
+    Arguments:
+      writable (bool): if True, open the file for writing
+    Exceptions:
+      CommandError: the file could not be opened or is not a history file
+    """
+    if self._map is not None and (self._writable or not writable):
+      return
+    self.close()
+    size = self._fileSize()
+    try:
+      if writable:
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+          os.makedirs(directory)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        if (os.fstat(self._fd).st_size != size
+            or not self._headerMatches(os.read(self._fd, self._headerSize))):
+          self.log.info(_("Initializing history file {0}").format(self.path))
+          os.ftruncate(self._fd, 0)
+          os.ftruncate(self._fd, size)
+          self._map = mmap.mmap(self._fd, size)
+          self._writeHeader()
+        else:
+          self._map = mmap.mmap(self._fd, size)
+      else:
+        self._fd = os.open(self.path, os.O_RDONLY)
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        if (os.fstat(self._fd).st_size != size
+            or not self._headerMatches(os.read(self._fd, self._headerSize))):
+          raise CommandError(_("{0} is not a history file in the expected"
+                               " format").format(self.path))
+        self._map = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+    except (IOError, OSError, mmap.error) as ex:
+      self.close()
+      raise CommandError(_("Could not open history file {0}: {1}").format(
+          self.path, ex))
+    except CommandError:
+      self.close()
+      raise
+    self._writable = writable
+
+  def _fileSize(self):
+    """Returns the size of a history file with this layout."""
+    recordSize = 8 * (1 + len(self.metrics))
+    return self._headerSize + recordSize * sum(slots for unused_step, slots
+                                               in self.archives)
+
+  def _headerMatches(self, header):
+    """Returns True iff a file header describes this layout."""
+    if len(header) < self._archiveOffset(len(self.archives)):
+      return False
+    magic, version, metricCount, archiveCount, names = struct.unpack_from(
+        self._headerFormat, header)
+    if ((magic, version, metricCount, archiveCount)
+        != (self._magic, self._version, len(self.metrics),
+            len(self.archives))
+        or names.rstrip('\0').split('\0') != self.metrics):
+      return False
+    for index, archive in enumerate(self.archives):
+      if struct.unpack_from('=II', header,
+                            self._archiveOffset(index)) != archive:
+        return False
+    return True
+
+  def _writeHeader(self):
+    """Writes the header of a new, empty history file."""
+    struct.pack_into(self._headerFormat, self._map, 0, self._magic,
+                     self._version, len(self.metrics), len(self.archives),
+                     '\0'.join(self.metrics))
+    for index, (step, slots) in enumerate(self.archives):
+      struct.pack_into(self._archiveFormat, self._map,
+                       self._archiveOffset(index), step, slots, 0, 0)
+
+  def _archiveOffset(self, index):
+    """Returns the offset in the header of an archive's description."""
+    return (struct.calcsize(self._headerFormat)
+            + index * struct.calcsize(self._archiveFormat))
+
+  def _archiveState(self, index):
+    """Returns the next slot to write and the record count of an
+    archive."""
+    return struct.unpack_from('=II', self._map,
+                              self._archiveOffset(index) + 8)
+
+  def _setArchiveState(self, index, nextSlot, count):
+    """Sets the next slot to write and the record count of an archive."""
+    struct.pack_into('=II', self._map, self._archiveOffset(index) + 8,
+                     nextSlot, count)
+
+  def _recordOffset(self, index, slot):
+    """Returns the file offset of a record."""
+    recordSize = 8 * (1 + len(self.metrics))
+    before = sum(slots for unused_step, slots in self.archives[:index])
+    return self._headerSize + recordSize * (before + slot)
+
+  def _timeAt(self, index, slot):
+    """Returns the timestamp of a record."""
+    return struct.unpack_from('=Q', self._map,
+                              self._recordOffset(index, slot))[0]
+
+  def _writeRecord(self, index, slot, recordBytes):
+    """Writes a record."""
+    offset = self._recordOffset(index, slot)
+    self._map[offset:offset + len(recordBytes)] = recordBytes
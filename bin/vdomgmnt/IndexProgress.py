@@ -0,0 +1,94 @@
+"""
+  IndexProgress - the state of the index of an Albireo server
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/IndexProgress.py#1 $
+
+"""
+import time
+
+
+class IndexProgress(object):
+  """The state of the index of an Albireo server at one moment.
+
+  While the server is rebuilding its index it does not answer pings,
+  and it reads the whole of the index from its logical volume. The
+  progress of a rebuild is therefore estimated from the bytes the
+  server has read, as counted in /proc/<pid>/io, against the size of
+  the index files; the rate and the time remaining are estimated from
+  the change since an earlier IndexProgress of the same server.
+
+  A server which does not answer may also just be busy, so it is only
+  taken to be rebuilding while it is reading its index: it has read
+  less than the whole index, and more than at the earlier observation,
+  if there is one. Otherwise it is NOT_RESPONDING.
+
+  Attributes:
+    state (str): ONLINE, REBUILDING, NOT_RESPONDING, or STOPPED
+    pid (int): the server process, or 0
+    time (float): when the state was observed
+    bytesRead (int): the bytes read by the server so far, or None if
+      that is not known
+    indexBytes (int): the size of the index files
+    percent (float): the estimated percentage of the rebuild done, or
+      None if not rebuilding or not known
+    rate (float): the bytes read per second since the earlier
+      observation, or None
+    remaining (float): the estimated seconds until the rebuild is done,
+      or None
+  """
+  ONLINE = 'online'
+  REBUILDING = 'rebuilding'
+  NOT_RESPONDING = 'not responding'
+  STOPPED = 'stopped'
+
+  def __init__(self, state, pid=0, bytesRead=None, indexBytes=0,
+               previous=None):
+    self.state = state
+    self.pid = pid
+    self.time = time.time()
+    self.bytesRead = bytesRead
+    self.indexBytes = indexBytes
+    self.percent = None
+    self.rate = None
+    self.remaining = None
+    if state != self.REBUILDING or bytesRead is None or indexBytes <= 0:
+      return
+    # Never claim to be done while the server is still rebuilding.
+    self.percent = min(99.9, 100.0 * bytesRead / indexBytes)
+    if (previous is not None and previous.pid == pid
+        and previous.bytesRead is not None and self.time > previous.time):
+      self.rate = (bytesRead - previous.bytesRead) / (self.time
+                                                      - previous.time)
+      if self.rate > 0:
+        self.remaining = max(0, indexBytes - bytesRead) / self.rate
+
+  def __str__(self):
+    if self.state != self.REBUILDING or self.percent is None:
+      return self.state
+    parts = [_("rebuilding, {0:.1f}% done").format(self.percent)]
+    if self.rate is not None:
+      parts.append(_("{0:.1f} MB/s").format(self.rate / 1048576))
+    if self.remaining is not None:
+      parts.append(_("about {0} remaining").format(
+          self.formatSeconds(self.remaining)))
+    return ", ".join(parts)
+
+  def asDict(self):
+    """Returns the attributes of this object which are meaningful to
+    report, as a dictionary."""
+    return dict((key, getattr(self, key))
+                for key in ['state', 'pid', 'time', 'bytesRead',
+                            'indexBytes', 'percent', 'rate', 'remaining'])
+
+  @staticmethod
+  def formatSeconds(seconds):
+    """Formats a number of seconds as hours, minutes, and seconds."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+      return "{0}h{1:02d}m".format(hours, minutes)
+    if minutes:
+      return "{0}m{1:02d}s".format(minutes, seconds)
+    return "{0}s".format(seconds)
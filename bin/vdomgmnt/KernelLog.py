@@ -0,0 +1,133 @@
+"""
+  KernelLog - reads the messages the kvdo module writes to the kernel log
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/KernelLog.py#1 $
+
+"""
+from . import Brand, CommandError, Logger
+import errno
+import os
+import select
+import time
+
+
+class KernelLog(object):
+  """KernelLog reads the kernel log through /dev/kmsg, starting from
+  the end of the log when it is opened, and returns the messages
+  written by the kvdo module since then with the module name the
+  module puts in front of each message removed.
+
+  /dev/kmsg returns one log record per read, so messages are read one
+  at a time as they arrive and nothing is kept but the message being
+  returned; a caller which processes the messages as it gets them can
+  follow the log for as long as it likes in bounded memory. Records
+  which the kernel overwrites before they are read are counted in
+  lost.
+
+  Attributes:
+    path (str): the kernel log device
+    prefix (str): what the module puts in front of its messages
+    lost (int): the number of times records were overwritten before
+      they could be read
+    _fd (int): the open log device, or -1
+  """
+  log = Logger.getLogger(Logger.myname + '.KernelLog')
+  path = '/dev/kmsg'
+  # /dev/kmsg fails a read into a buffer too small for the record.
+  _recordSize = 8192
+
+  def __init__(self):
+    self.prefix = Brand.map('kvdo') + ': '
+    self.lost = 0
+    self._fd = -1
+
+  def __str__(self):
+    return "KernelLog(\"{0}\")".format(self.path)
+
+  def __enter__(self):
+    self.open()
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.close()
+
+  def open(self):
+    """Opens the kernel log, positioned after the last record written.
+
+    Exceptions:
+      CommandError: the log could not be opened
+    """
+    try:
+      self._fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+      os.lseek(self._fd, 0, os.SEEK_END)
+    except OSError as ex:
+      self.close()
+      raise CommandError(_("Cannot read {0}: {1}").format(self.path,
+                                                          ex.strerror))
+
+  def close(self):
+    """Closes the kernel log."""
+    if self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
+
+  def messages(self, timeout, until=None):
+    """Returns the module's messages as they arrive.
+
+    Arguments:
+      timeout (float): the seconds to wait for a message before giving
+        up; each message starts the wait afresh
+      until (float): the time at which to stop however recently a
+        message arrived, or None to go on while messages arrive
+    Returns:
+      A generator of messages, which ends when no message has arrived
+      for timeout seconds, or at the until time.
+    """
+    deadline = time.time() + timeout
+    poller = select.poll()
+    poller.register(self._fd, select.POLLIN)
+    while until is None or time.time() < until:
+      record = self._read()
+      if record is None:
+        remaining = deadline - time.time()
+        if until is not None:
+          remaining = min(remaining, until - time.time())
+        if remaining <= 0:
+          return
+        poller.poll(remaining * 1000)
+        continue
+      message = self._message(record)
+      if message is not None:
+        deadline = time.time() + timeout
+        yield message
+
+  def _read(self):
+    """Returns the next record in the log, or None if there is none
+    yet."""
+    while True:
+      try:
+        return os.read(self._fd, self._recordSize)
+      except OSError as ex:
+        if ex.errno == errno.EAGAIN:
+          return None
+        if ex.errno == errno.EPIPE:
+          # Records were overwritten; the next read gets the oldest left.
+          self.lost += 1
+          self.log.debug("kernel log records lost")
+          continue
+        raise CommandError(_("Cannot read {0}: {1}").format(self.path,
+                                                            ex.strerror))
+
+  def _message(self, record):
+    """Returns the text of a record if the module wrote it, without the
+    module name in front, or None otherwise.
+
+    A record looks like "6,1234,5678901,-;kvdo: text", possibly
+    followed by lines of device properties.
+    """
+    text = record.split('\n', 1)[0].split(';', 1)[-1]
+    if not text.startswith(self.prefix):
+      return None
+    return text[len(self.prefix):]
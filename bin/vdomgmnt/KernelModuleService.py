@@ -6,7 +6,7 @@
   $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/KernelModuleService.py#2 $
 
 """
-from . import Brand, Command, CommandError, Defaults, Service
+from . import Brand, Command, CommandError, Defaults, Service, SystemState
 import string
 
 
@@ -44,18 +44,20 @@ class KernelModuleService(Service):
       return self.ERROR
 
   def running(self, wait=True):
-    """Returns True if the module is loaded and DM target is available."""
+    """Returns True if the module is loaded and DM target is available.
+    If wait is True and they are not yet available, polls for them."""
+    if (SystemState.moduleLoaded(self._name)
+        and SystemState.haveTarget('dedupe')):
+      return True
+    if not wait:
+      return Command.noRunMode()
     lsmodCmd = Command(string.split("lsmod | grep -q '" + self._name + "'"))
     lsmodCmd.shell = True
     dmsetupCmd = Command(string.split("dmsetup targets | grep -q dedupe"))
     dmsetupCmd.shell = True
     try:
-      if wait:
-        lsmodCmd.waitFor()
-        dmsetupCmd.waitFor()
-      else:
-        lsmodCmd()
-        dmsetupCmd()
+      lsmodCmd.waitFor()
+      dmsetupCmd.waitFor()
       return True
     except CommandError:
       return False
@@ -68,6 +70,47 @@ class KernelModuleService(Service):
       cmd.shell = True
       cmd.noThrowCall()
 
+  def getTunable(self, name):
+    """Returns the value of a module tunable in sysfs as a string, or
+    None if it cannot be read.
+
+    Arguments:
+      name (str): the name of the tunable, e.g. max_requests_active
+    """
+    try:
+      with open(self._tunablePath(name)) as f:
+        return f.read().strip()
+    except IOError:
+      return None
+
+  def setTunable(self, name, value):
+    """Sets a module tunable in sysfs.
+
+    Arguments:
+      name (str): the name of the tunable, e.g. max_requests_active
+      value (int): the new value
+    Exceptions:
+      CommandError: the kernel rejected the value
+    """
+    cmd = Command(['echo', str(value), '>', self._tunablePath(name)])
+    cmd.shell = True
+    cmd()
+
+  def getPoolAttribute(self, pool, name):
+    """Returns the value of an attribute of one VDO device in sysfs as
+    a string, or None if it cannot be read.
+
+    Arguments:
+      pool (str): the pool name of the device, which is the name of
+        the VDO volume
+      name (str): the name of the attribute, e.g. compressing
+    """
+    return self.getTunable(pool + "/" + name)
+
+  def _tunablePath(self, name):
+    """Returns the sysfs path of a module tunable."""
+    return "/sys/" + self._name + "/" + name
+
   def version(self):
     """Returns the module version as a string."""
     s = self._name + " "
@@ -0,0 +1,226 @@
+"""
+  LatencyHistogram - the latency histograms kept by the kvdo module
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/LatencyHistogram.py#1 $
+
+"""
+from . import CommandError, DeviceMapper, KernelLog, Logger
+import gzip
+import os
+import re
+
+
+class LatencyHistogram(object):
+  """LatencyHistogram is one of the histograms the kvdo module keeps of
+  how long operations take, such as acknowledging writes or getting
+  advice from the index, as written to the kernel log by the 'dump
+  histograms' message.
+
+  The module logs a histogram as a label line, then one line per
+  bucket up to the last bucket holding anything, then the total:
+
+    Acknowledge External Write Request Histogram (number of writes ...)
+         0 -       0 :          113 =====
+         1 -       1 :          824 ===============================
+    ...
+    Bigger           :            2
+    total 1093
+
+  The buckets of the latency histograms grow logarithmically and count
+  jiffies. Which histograms there are depends on how the module was
+  built; a module built without them logs none.
+
+  Attributes:
+    label (str): the label the module gives the histogram
+    buckets (list of tuple): the (low, high, count) of each bucket, in
+      order, where high is None for the last bucket, which has no
+      upper bound
+  """
+  log = Logger.getLogger(Logger.myname + '.LatencyHistogram')
+
+  # The seconds to wait for the dump to reach the kernel log.
+  dumpTimeout = 10.0
+
+  _rangeBucket = re.compile(r"^\s*(\d+)\s*-\s*(\d+)\s*:\s*(\d+)")
+  _linearBucket = re.compile(r"^\s*(\d+)\s*:\s*(\d+)")
+  _biggerBucket = re.compile(r"^\s*Bigger\s*:\s*(\d+)")
+  _total = re.compile(r"^total (\d+)$")
+
+  def __init__(self, label, buckets=None):
+    self.label = label
+    self.buckets = buckets or []
+
+  def __str__(self):
+    return "LatencyHistogram(\"{0}\")".format(self.name())
+
+  def name(self):
+    """Returns the label without any parenthesized explanation."""
+    return self.label.split(' (', 1)[0]
+
+  def count(self):
+    """Returns the number of samples in the histogram."""
+    return sum(count for unused_low, unused_high, count in self.buckets)
+
+  def percentile(self, fraction):
+    """Returns the upper bound of the bucket holding a percentile.
+
+    Arguments:
+      fraction (float): the percentile as a fraction, e.g. 0.99
+    Returns:
+      The upper bound, the lower bound of the last bucket if the
+      percentile is in it, or None if the histogram is empty.
+    """
+    total = self.count()
+    if total == 0:
+      return None
+    # The rank of the sample at the percentile, counting from 1.
+    rank = max(1, fraction * total)
+    seen = 0
+    for low, high, count in self.buckets:
+      seen += count
+      if seen >= rank:
+        return low if high is None else high
+    return self.buckets[-1][1]
+
+  def since(self, earlier):
+    """Returns the histogram of the samples added since an earlier
+    capture of the same histogram.
+
+    Arguments:
+      earlier (LatencyHistogram): the earlier capture, or None
+    """
+    if earlier is None:
+      return self
+    before = dict(((low, high), count)
+                  for low, high, count in earlier.buckets)
+    return LatencyHistogram(self.label,
+                            [(low, high,
+                              max(0, count - before.get((low, high), 0)))
+                             for low, high, count in self.buckets])
+
+  def asDict(self, hz=None):
+    """Returns a summary of the histogram as a dictionary.
+
+    Arguments:
+      hz (int): the jiffies per second, or None if unknown, in which
+        case the percentiles are given in jiffies
+    """
+    result = {'histogram': self.name(), 'count': self.count(),
+              'unit': 'ms' if hz else 'jiffies'}
+    for key, fraction in [('p50', 0.5), ('p99', 0.99), ('p999', 0.999)]:
+      value = self.percentile(fraction)
+      if value is not None and hz:
+        value = value * 1000.0 / hz
+      result[key] = value
+    return result
+
+  @classmethod
+  def parse(cls, lines):
+    """Finds the histograms in a sequence of kernel log messages.
+
+    Arguments:
+      lines (iterable of str): the messages
+    Returns:
+      A list of LatencyHistograms, in the order they were found.
+    """
+    histograms = []
+    current = None
+    previous = None
+    for line in lines:
+      if current is not None:
+        if cls._total.match(line):
+          current = None
+        elif cls._addBucket(current, line):
+          pass
+        else:
+          # The histogram ended without a total.
+          current = None
+      elif cls._isBucket(line) and previous is not None:
+        current = cls(previous.strip())
+        histograms.append(current)
+        cls._addBucket(current, line)
+      previous = line
+    return histograms
+
+  @classmethod
+  def _isBucket(cls, line):
+    """Returns True iff a line is a histogram bucket."""
+    return bool(cls._rangeBucket.match(line) or cls._biggerBucket.match(line)
+                or cls._linearBucket.match(line))
+
+  @classmethod
+  def _addBucket(cls, histogram, line):
+    """Adds a bucket to a histogram if a line is one.
+
+    Returns:
+      True iff the line was a bucket.
+    """
+    m = cls._rangeBucket.match(line)
+    if m:
+      histogram.buckets.append((int(m.group(1)), int(m.group(2)),
+                                int(m.group(3))))
+      return True
+    m = cls._biggerBucket.match(line)
+    if m:
+      low = histogram.buckets[-1][1] + 1 if histogram.buckets else 0
+      histogram.buckets.append((low, None, int(m.group(1))))
+      return True
+    m = cls._linearBucket.match(line)
+    if m:
+      value = int(m.group(1))
+      histogram.buckets.append((value, value, int(m.group(2))))
+      return True
+    return False
+
+  @classmethod
+  def capture(cls, name):
+    """Has the kvdo module dump the histograms of a VDO volume to the
+    kernel log and reads them back.
+
+    Arguments:
+      name (str): the VDO volume
+    Returns:
+      A list of LatencyHistograms.
+    Exceptions:
+      CommandError: the dump could not be requested or read
+    """
+    lines = []
+    with KernelLog() as kernelLog:
+      DeviceMapper.message(name, 0, 'dump', 'histograms')
+      inDump = False
+      for message in kernelLog.messages(cls.dumpTimeout):
+        if message.endswith(" dump triggered via dmsetup message"):
+          inDump = True
+          lines = []
+        elif not inDump:
+          continue
+        elif message.startswith("end of ") and message.endswith(" dump"):
+          break
+        else:
+          lines.append(message)
+      else:
+        raise CommandError(_("Timed out reading the dump of {0} from"
+                             " {1}").format(name, kernelLog.path))
+    pool = "poolName '{0}'".format(name)
+    if lines and not any(line.endswith(pool) for line in lines[:2]):
+      raise CommandError(_("Another dump was written to the kernel log"
+                           " while dumping {0}").format(name))
+    return cls.parse(lines)
+
+  @staticmethod
+  def kernelHz():
+    """Returns the number of jiffies per second of the running kernel,
+    from its build configuration, or None if it cannot be found."""
+    release = os.uname()[2]
+    for path, opener in [('/boot/config-' + release, open),
+                         ('/proc/config.gz', gzip.open)]:
+      try:
+        with opener(path) as f:
+          for line in f:
+            if line.startswith('CONFIG_HZ='):
+              return int(line.split('=', 1)[1])
+      except (IOError, ValueError):
+        pass
+    return None
@@ -7,10 +7,11 @@
 
 """
 from . import Command, CommandError, ArgumentError, Logger, SizeString
+from . import StorageDevice, StorageGeometry, SystemState
 import os
 
 
-class LogicalVolume(object):
+class LogicalVolume(StorageDevice):
   """LogicalVolume manages the storage used for the Albireo index and
   for backing the VDO device. Note that LogicalVolumes may or may not
   correspond to an actual logical volume on the local system; the
@@ -18,17 +19,23 @@ class LogicalVolume(object):
   _volumeGroup are simply for convenience and are set from the
   fullpath constructor argument.
 
+  Logical volumes are laid out to match the stripe geometry of the
+  physical volumes they are allocated from (see StorageGeometry). When
+  a volume may be allocated from several physical volumes of the same
+  size and geometry, it is striped across all of them, with a stripe
+  size matching their RAID chunk. Its size is rounded down to a whole
+  number of full stripes of every physical volume, and of extents on
+  each, so that every volume we create ends on a stripe boundary and
+  the next one starts on one. A volume is extended with the striping
+  it already has, so its new size is rounded to suit the stripes and
+  physical volumes of its last segment.
+
   Attributes:
     _fullpath (str): the full pathname for the logical volume
       (e.g., /dev/vgname/lvname)
     _lvpath (str): the LVM path for the logical volume (vgname/lvname)
     _name (str): the name of the logical volume (lvname)
-    _physicalSize (SizeString): the size set in create or growPhysical;
-      only used to support fake returns in noRun
     _volumeGroup (str): the name of the volume group (vgname)
-    maximumSize (SizeString): if set, attempts to create or extend
-      this volume's physical size past maximumSize will raise an
-      ArgumentError
   """
   log = Logger.getLogger(Logger.myname + '.LogicalVolume')
   lvmFlavor = 'LVM'
@@ -44,6 +51,7 @@ class LogicalVolume(object):
     Exceptions:
       ArgumentError: invalid fullpath
     """
+    super(LogicalVolume, self).__init__()
     if fullpath.count(os.sep) != 3 or fullpath[:5] != '/dev/':
       raise ArgumentError(_("Invalid logical volume path {path}").format(
           path=fullpath))
@@ -51,8 +59,6 @@ class LogicalVolume(object):
     self._volumeGroup, self._name = os.path.split(fullpath)
     self._volumeGroup = os.path.basename(self._volumeGroup)
     self._lvpath = os.sep.join([self._volumeGroup, self._name])
-    self._physicalSize = SizeString('')
-    self.maximumSize = None
 
   def __str__(self):
     """Returns a string representation of this logical volume. This is
@@ -78,39 +84,49 @@ class LogicalVolume(object):
     Exceptions:
       ArgumentError: this LogicalVolume cannot be created
     """
-    vgsCmd = Command(['vgs', self._volumeGroup])
-    try:
-      vgsCmd()
-    except CommandError:
+    if Command.noRunMode():
+      Command(['vgs', self._volumeGroup])()
+    elif SystemState.volumeGroupStatus(self._volumeGroup) is None:
       raise ArgumentError(_("Volume group {vg} does not exist").format(
           vg=self._volumeGroup))
     if self.exists():
       raise ArgumentError(_("Logical volume {lv!s} already exists").format(
           lv=self))
 
-  def create(self, blockSize, physicalSize=None):
+  def create(self, blockSize, physicalSize=None, devices=None):
     """Creates this logical volume.
 
     Arguments:
       blockSize (int): the block size in bytes
       physicalSize (SizeString): the desired size of the volume;
         if None, allocate the remaining space in the volume group
+      devices (list of str): if given, the physical volumes of the
+        volume group to allocate the volume from
     Returns:
       The physical size of the created volume as a SizeString.
     Exceptions:
       CommandError: a logical volume command failed
     """
     self._physicalSizeCheck(physicalSize, False)
+    stripes, stripeSize, unit = self._layout(devices, physicalSize)
+    unit = StorageGeometry.lcm(blockSize, unit)
     cmdList = ["lvcreate", "--name", self._lvpath]
+    if stripes > 1:
+      cmdList.extend(["--stripes", str(stripes)])
+      if stripeSize:
+        cmdList.extend(["--stripesize", str(stripeSize // 1024) + "k"])
     if physicalSize:
+      physicalSize = self._alignSize(unit, physicalSize)
       self._physicalSize = physicalSize
       cmdList.extend(["--size", str(physicalSize)])
     else:
       cmdList.extend(["--extents", "100%FREE"])
     cmdList.append(self._volumeGroup)
+    if devices:
+      cmdList.extend(devices)
     lvcreateCmd = Command(cmdList)
     lvcreateCmd()
-    return self._roundSize(blockSize, physicalSize)
+    return self._roundSize(unit, physicalSize)
 
   def remove(self, noThrow=False):
     """Removes this logical volume.
@@ -123,8 +139,8 @@ class LogicalVolume(object):
     lvchangeCmd = Command(['lvchange', '-an', self._lvpath])
     lvremoveCmd = Command(['lvremove', '-f', self._lvpath])
     try:
-      lvchangeCmd.waitFor(10)
-      lvremoveCmd.waitFor(10)
+      lvchangeCmd.waitFor(10, settle=True)
+      lvremoveCmd.waitFor(10, settle=True)
       self._physicalSize = SizeString('')
     except CommandError as ex:
       if noThrow:
@@ -137,12 +153,9 @@ class LogicalVolume(object):
     """Tests whether this logical volume exists."""
     if not os.path.exists(self._lvpath):
       return False
-    lvsCmd = Command(['lvs', self._lvpath])
-    try:
-      lvsCmd()
+    if Command.noRunMode():
       return True
-    except CommandError:
-      return False
+    return SystemState.logicalVolumeStatus(self._lvpath) is not None
 
   def extend(self, blockSize, physicalSize=None):
     """Extends this logical volume.
@@ -157,8 +170,11 @@ class LogicalVolume(object):
       CommandError: a logical volume command failed
     """
     self._physicalSizeCheck(physicalSize, True)
+    unit = self._extensionUnit()
+    unit = StorageGeometry.lcm(blockSize, unit)
     cmdList = ['lvextend']
     if physicalSize:
+      physicalSize = self._alignSize(unit, physicalSize)
       self._physicalSize = physicalSize
       cmdList.extend(['--size', str(physicalSize)])
     else:
@@ -166,7 +182,7 @@ class LogicalVolume(object):
     cmdList.append(self._lvpath)
     lvextendCmd = Command(cmdList)
     lvextendCmd()
-    return self._roundSize(blockSize, physicalSize)
+    return self._roundSize(unit, physicalSize)
 
   def reduce(self, physicalSize):
     """Reduces the size of this logical volume. Swallows exceptions.
@@ -192,14 +208,12 @@ class LogicalVolume(object):
     Returns:
       The size as a SizeString, zero-byte if an error occurred.
     """
-    lvsCmd = Command(['lvs', '--units', 'k', '--noheadings',
-                      '--nosuffix', '-o', 'lv_size', self._lvpath])
-    if lvsCmd.noRun:
+    if Command.noRunMode():
       return self._physicalSize
-    kbytes = lvsCmd.runOutput().strip()
-    if not kbytes:
+    size = SystemState.logicalVolumeSize(self._lvpath)
+    if size is None:
       return SizeString('')
-    return SizeString(kbytes + 'K')
+    return size
 
   def fullpath(self):
     """Returns the full pathname of this logical volume. This method
@@ -211,8 +225,7 @@ class LogicalVolume(object):
     """Returns the status of this logical volume. This is simply the
     raw information from the lvs command. Returns "(not available)"
     if the information is not available."""
-    lvsCmd = Command(['lvs', '--noheadings', self._lvpath])
-    lvsResult = lvsCmd.runOutput().strip()
+    lvsResult = SystemState.logicalVolumeStatus(self._lvpath)
     if lvsResult:
       return lvsResult
     else:
@@ -223,8 +236,7 @@ class LogicalVolume(object):
     logical volume. This is simply the raw information from the vgs
     command. Returns "(not available)" if the information is not
     available."""
-    vgsCmd = Command(['vgs', '--noheadings', self._volumeGroup])
-    vgsResult = vgsCmd.runOutput().strip()
+    vgsResult = SystemState.volumeGroupStatus(self._volumeGroup)
     if vgsResult:
       return vgsResult
     else:
@@ -246,6 +258,104 @@ class LogicalVolume(object):
       self.log.error(_("Could not activate {0}: {1!s}").format(str(self), ex))
     return
 
+  def _layout(self, devices=None, physicalSize=None):
+    """Works out how to lay out this volume on the physical volumes it
+    may be allocated from. The volume is striped across them only if
+    they are alike and every one has room for its share: an equal
+    share of the requested size, or, when the volume is to take all
+    the free space, the same free space as the others, since a striped
+    volume can only take as much from each as the smallest has. In
+    noRun mode, the volume is not striped.
+
+    Arguments:
+      devices (list of str): if given, the physical volumes to allocate
+        from; otherwise, any in the volume group
+      physicalSize (SizeString): the requested size, or None (or empty)
+        for all the free space
+    Returns:
+      A tuple (stripes, stripeSize, unit): the number of physical
+      volumes to stripe across, the stripe size in bytes (0 to let LVM
+      choose), and the unit in bytes to round the size of the volume
+      to (0 if there is no constraint).
+    """
+    if Command.noRunMode():
+      return 1, 0, 0
+    pvs = SystemState.physicalVolumes(self._volumeGroup)
+    if devices:
+      wanted = set(os.path.realpath(device) for device in devices)
+      pvs = [pv for pv in pvs if os.path.realpath(pv[0]) in wanted]
+    pvs = [pv for pv in pvs if pv[2] > 0]
+    geometries = [StorageGeometry.forDevice(pv[0]) for pv in pvs]
+    extentSize = SystemState.volumeGroupExtentSize(self._volumeGroup) or 0
+
+    unit = extentSize
+    for geometry in geometries:
+      unit = StorageGeometry.lcm(unit, geometry.fullStripe)
+    stripes = 1
+    stripeSize = 0
+    if physicalSize:
+      share = -(-physicalSize.toBytes() // max(1, len(pvs)))
+      roomy = all(pv[2] >= share for pv in pvs)
+    else:
+      roomy = len(set(pv[2] for pv in pvs)) == 1
+    if (len(pvs) > 1 and len(set(pv[1] for pv in pvs)) == 1 and roomy
+        and all(geometry == geometries[0] for geometry in geometries)):
+      stripes = len(pvs)
+      # A stripe of a whole RAID stripe keeps every LVM stripe aligned
+      # to the RAID stripes, but LVM requires a power of two no larger
+      # than an extent, so fall back to the RAID chunk.
+      for size in [geometries[0].fullStripe, geometries[0].chunkSize]:
+        if (StorageGeometry.isPowerOfTwo(size) and size >= 4096
+            and (not extentSize or size <= extentSize)):
+          stripeSize = size
+          break
+    self.log.debug("{0} layout: stripes={1} stripeSize={2} unit={3}".format(
+        self._lvpath, stripes, stripeSize, unit * stripes))
+    return stripes, stripeSize, unit * stripes
+
+  def _extensionUnit(self):
+    """Works out the unit to round the size of this volume to when it
+    is extended. lvextend keeps the striping of the last segment of the
+    volume, whatever the physical volumes of the volume group now look
+    like, so the unit is a whole number of extents and full RAID
+    stripes on each of that segment's physical volumes, times the
+    number of stripes. In noRun mode, there is no constraint.
+
+    Returns:
+      The unit in bytes, or 0 if there is no constraint.
+    """
+    if Command.noRunMode():
+      return 0
+    striping = SystemState.logicalVolumeStriping(self._lvpath)
+    if striping is None:
+      return 0
+    stripes, stripeSize, devices = striping
+    unit = SystemState.volumeGroupExtentSize(self._volumeGroup) or 0
+    for device in devices:
+      unit = StorageGeometry.lcm(unit,
+                                 StorageGeometry.forDevice(device).fullStripe)
+    self.log.debug("{0} extension: stripes={1} stripeSize={2} unit={3}".format(
+        self._lvpath, stripes, stripeSize, unit * stripes))
+    return unit * max(1, stripes)
+
+  def _alignSize(self, unit, physicalSize):
+    """Rounds a requested size down to a multiple of a unit, unless it
+    is smaller than one unit.
+
+    Arguments:
+      unit (int): the unit in bytes
+      physicalSize (SizeString): the requested size
+    Returns:
+      The rounded size, as a SizeString.
+    """
+    size = physicalSize.toBytes()
+    if not unit or size < unit or size % unit == 0:
+      return physicalSize
+    aligned = SizeString(str(size - size % unit) + 'B')
+    self.log.debug(_("Aligned requested size {0!s} to {1!s}").format(
+        physicalSize, aligned))
+    return aligned
+
   def _roundSize(self, blockSize, expected=None):
     """Finishes a create or extend operation by rounding the size of
     the volume down to a multiple of a given block size if necessary.
@@ -253,7 +363,8 @@ class LogicalVolume(object):
     size.
 
     Arguments:
-      blockSize (int): the block size in bytes
+      blockSize (int): the block size in bytes, or a multiple of it
+        such as a full stripe
       expected (SizeString): if provided, check the size of the
         volume before doing anything, and if it's different report
         that. This handles the case where LVM rounds a requested size
@@ -311,9 +422,7 @@ class LogicalVolume(object):
     Returns:
       The size as a SizeString, zero-byte if an error occurred.
     """
-    vgsCmd = Command(['vgs', '-o', 'vg_free', '--noheadings',
-                      '--units', 'k', '--nosuffix', self._volumeGroup])
-    kbytes = vgsCmd.runOutput().strip()
-    if not kbytes:
+    free = SystemState.volumeGroupFree(self._volumeGroup)
+    if free is None:
       return SizeString('')
-    return SizeString(kbytes + 'K')
+    return free
@@ -0,0 +1,215 @@
+"""
+  ManagerDaemon - runs vdo commands in a long-lived process
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/ManagerDaemon.py#1 $
+
+"""
+from . import Defaults, Logger, SystemState
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+
+# From <asm-generic/socket.h>; Python 2 does not define it.
+_SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+
+class _ClientStream(object):
+  """A file-like object which sends everything written to it to a
+  client of the daemon, as messages naming the stream written to.
+
+  Attributes:
+    _conn (socket): the connection to the client
+    _name (str): the stream name, 'stdout' or 'stderr'
+    closed (bool): True iff the client has gone away
+  """
+  def __init__(self, conn, name):
+    self._conn = conn
+    self._name = name
+    self.closed = False
+
+  def write(self, s):
+    """Sends a string to the client."""
+    if s and not self.closed:
+      if isinstance(s, str):
+        s = s.decode('utf-8', 'replace')
+      try:
+        _send(self._conn, {'stream': self._name, 'data': s})
+      except socket.error:
+        self.closed = True
+
+  def flush(self):
+    """Does nothing; every write is sent immediately."""
+    pass
+
+  def isatty(self):
+    """Returns False."""
+    return False
+
+
+def _send(conn, message):
+  """Sends one message to a client."""
+  conn.sendall(json.dumps(message) + "\n")
+
+
+class ManagerDaemon(object):
+  """ManagerDaemon listens on a Unix socket and runs vdo commands on
+  behalf of the vdo program, so that a command does not pay for
+  starting Python, importing the VDO manager, and rereading the
+  configuration file each time it is run.
+
+  A client connects, sends one JSON line holding its argument list,
+  working directory, and environment, and receives JSON lines carrying
+  its standard output and standard error, ending with a line giving the
+  exit status, or else a line asking it to run the command itself,
+  which the handler asks for every command that might take long.
+  Requests are handled one at a time, in the order they arrive, with
+  the process's arguments, environment, working directory, and output
+  streams set to the client's for the duration of the request. A
+  client which does not send its request within
+  Defaults.daemonRequestTimeout, or stops reading its output for
+  Defaults.daemonTimeout, is dropped, so that it does not hold up the
+  others. The daemon only serves root, since it runs every
+  command as root.
+
+  The SystemState snapshot is kept from one request to the next, so
+  that its LVM and module sections are only captured again after a
+  command changes them, or after something else may have (see
+  SystemState.refresh).
+
+  Attributes:
+    socketPath (str): the path of the listening socket
+    handler (Callable): runs a command given the client's context;
+      returns the exit status, or None if the client should run the
+      command itself, and may raise SystemExit
+    _lock (threading.Lock): held while a request runs
+    _sock (socket): the listening socket
+  """
+  log = Logger.getLogger(Logger.myname + '.ManagerDaemon')
+
+  def __init__(self, socketPath, handler):
+    self.socketPath = socketPath
+    self.handler = handler
+    self._lock = threading.Lock()
+    self._sock = None
+
+  def __str__(self):
+    return "ManagerDaemon(\"{0}\")".format(self.socketPath)
+
+  def serve(self):
+    """Accepts and handles requests until interrupted."""
+    if os.path.exists(self.socketPath):
+      os.unlink(self.socketPath)
+    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    oldmask = os.umask(077)
+    try:
+      self._sock.bind(self.socketPath)
+    finally:
+      os.umask(oldmask)
+    self._sock.listen(16)
+    self.log.info(_("Listening on {0}").format(self.socketPath))
+    try:
+      while True:
+        conn, unused_address = self._sock.accept()
+        try:
+          self._handle(conn)
+        except Exception as ex:
+          self.log.error(_("Request failed: {0}").format(ex))
+        finally:
+          conn.close()
+    finally:
+      self._sock.close()
+      os.unlink(self.socketPath)
+
+  def _handle(self, conn):
+    """Handles one request."""
+    conn.settimeout(Defaults.daemonRequestTimeout)
+    if not self._fromRoot(conn):
+      _send(conn, {'direct': True})
+      return
+    request = json.loads(conn.makefile('r').readline())
+    conn.settimeout(Defaults.daemonTimeout)
+    stdout = _ClientStream(conn, 'stdout')
+    stderr = _ClientStream(conn, 'stderr')
+    exitval = 1
+    # A request runs with process-wide state (sys.argv, os.environ, the
+    # working directory, sys.stdout and sys.stderr, and the root
+    # logger's handlers) set to the client's, so only one request may
+    # run at a time. serve handles requests in turn; the lock keeps it
+    # so should requests ever be handled on other threads.
+    with self._lock:
+      saved = self._enter(request, stdout, stderr)
+      try:
+        try:
+          exitval = self.handler()
+        except SystemExit as ex:
+          exitval = ex.code
+        except Exception as ex:
+          self.log.exception(str(ex))
+      finally:
+        self._leave(saved)
+    if stdout.closed:
+      return
+    try:
+      if exitval is None:
+        _send(conn, {'direct': True})
+      else:
+        _send(conn, {'exit': exitval if isinstance(exitval, int) else 1})
+    except socket.error:
+      # The client has gone away.
+      pass
+
+  @staticmethod
+  def _fromRoot(conn):
+    """Returns True iff the process at the other end of a connection is
+    running as root."""
+    credentials = conn.getsockopt(socket.SOL_SOCKET, _SO_PEERCRED,
+                                  struct.calcsize('3i'))
+    unused_pid, uid, unused_gid = struct.unpack('3i', credentials)
+    return uid == 0
+
+  @staticmethod
+  def _enter(request, stdout, stderr):
+    """Sets up the process to run a request.
+
+    Returns:
+      The state to be restored by _leave.
+    """
+    root = logging.getLogger()
+    saved = (list(sys.argv), dict(os.environ), os.getcwd(), sys.stdout,
+             sys.stderr, list(root.handlers), root.level)
+    sys.argv[:] = [arg.encode('utf-8') for arg in request['argv']]
+    os.environ.clear()
+    for key, value in request['environment'].items():
+      os.environ[key.encode('utf-8')] = value.encode('utf-8')
+    os.chdir(request['cwd'].encode('utf-8'))
+    sys.stdout = stdout
+    sys.stderr = stderr
+    # Let the command configure logging to the client's stderr.
+    for handler in root.handlers[:]:
+      root.removeHandler(handler)
+    # Keep what is known about the system unless it may have changed.
+    SystemState.refresh()
+    return saved
+
+  @staticmethod
+  def _leave(saved):
+    """Restores the state saved by _enter."""
+    argv, environment, cwd, stdout, stderr, handlers, level = saved
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+      root.removeHandler(handler)
+    for handler in handlers:
+      root.addHandler(handler)
+    root.setLevel(level)
+    sys.stdout = stdout
+    sys.stderr = stderr
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(environment)
+    sys.argv[:] = argv
@@ -0,0 +1,219 @@
+"""
+  MemoryPlanner - keeps VDO volumes from overcommitting memory
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/MemoryPlanner.py#1 $
+
+"""
+from . import Command, CommandError, Defaults, Logger, SizeString, Waiter
+import os
+import threading
+
+
+class MemoryPlanner(object):
+  """MemoryPlanner decides whether the memory a VDO volume needs is
+  available before the volume is created or started.
+
+  A volume needs its block map cache and read cache in the kernel, and
+  its Albireo server needs its index memory. The kernel allocates the
+  caches when the volume starts, but an Albireo server allocates most
+  of its memory while it loads or rebuilds its index, after it has
+  been started; the memory reported available by /proc/meminfo does
+  not yet reflect what a server which is still loading has yet to
+  allocate. The planner therefore keeps a reservation for each volume
+  it has admitted: all it needs while it is starting, and then what
+  its server has not yet allocated, until the server has finished
+  loading or has stopped. It admits another volume only if its needs
+  fit in the available memory less the outstanding reservations. A volume which does not fit waits for earlier volumes
+  to finish loading, so that starting many volumes at once staggers
+  the index loads, and is refused if it still does not fit once
+  nothing is outstanding or the wait times out.
+
+  In noRun mode, or if /proc/meminfo cannot be read, every volume is
+  admitted.
+
+  Attributes:
+    timeout (int): seconds to wait for memory before refusing a volume
+    _lock (threading.RLock): protects _reservations
+    _reservations (dict): for each admitted volume, a tuple of the
+      bytes reserved and a Callable which returns the bytes of the
+      volume's memory not yet allocated, or None while the volume is
+      still starting
+  """
+  log = Logger.getLogger(Logger.myname + '.MemoryPlanner')
+  meminfoPath = '/proc/meminfo'
+
+  def __init__(self, timeout=None):
+    if timeout is None:
+      timeout = Defaults.memoryWaitTimeout
+    self.timeout = timeout
+    self._lock = threading.RLock()
+    self._reservations = {}
+
+  def __str__(self):
+    return "MemoryPlanner({0})".format(",".join(sorted(self._reservations)))
+
+  @classmethod
+  def available(cls):
+    """Returns the bytes of memory available for new allocations, or
+    None if that cannot be found out."""
+    values = {}
+    try:
+      with open(cls.meminfoPath) as f:
+        for line in f:
+          fields = line.split()
+          if len(fields) >= 2:
+            values[fields[0].rstrip(':')] = int(fields[1]) * 1024
+    except (IOError, ValueError) as ex:
+      cls.log.debug("Cannot read {0}: {1}".format(cls.meminfoPath, ex))
+      return None
+    if 'MemAvailable' in values:
+      return values['MemAvailable']
+    # Kernels before 3.14 do not estimate the available memory.
+    if 'MemFree' in values:
+      return (values['MemFree'] + values.get('Buffers', 0)
+              + values.get('Cached', 0))
+    return None
+
+  @staticmethod
+  def footprint(vdo, alb):
+    """Returns the bytes of memory a VDO volume and its Albireo server
+    need.
+
+    Arguments:
+      vdo (VdoService): the VDO volume
+      alb (AlbireoService): its Albireo server, or None if the volume
+        does not deduplicate
+    """
+    total = long(vdo.blockMapCacheSize) + long(vdo.readCacheSize)
+    if alb is not None:
+      total += MemoryPlanner.albireoMemory(alb)
+    return total
+
+  @staticmethod
+  def albireoMemory(alb):
+    """Returns the bytes of memory an Albireo server needs.
+
+    Arguments:
+      alb (AlbireoService): the Albireo server
+    """
+    if not alb.enabled:
+      return 0
+    # As for the default index size, 0 means the server's default of a
+    # gigabyte.
+    memory = float(alb.memory) or 1.0
+    return int(memory * 1024 * 1024 * 1024)
+
+  @classmethod
+  def residentBytes(cls, pid):
+    """Returns the bytes of memory a process has allocated, as counted
+    in /proc/<pid>/statm, or 0 if that cannot be found out."""
+    try:
+      with open('/proc/{0}/statm'.format(pid)) as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, IndexError, ValueError) as ex:
+      cls.log.debug("Cannot read memory use of {0}: {1}".format(pid, ex))
+      return 0
+
+  def check(self, name, needed):
+    """Checks that there is memory for a VDO volume right now, without
+    waiting or reserving it.
+
+    Arguments:
+      name (str): the VDO volume
+      needed (int): the bytes the volume needs
+    Exceptions:
+      CommandError: there is not enough memory
+    """
+    if Command.noRunMode():
+      return
+    free = self._unreserved()
+    if free is not None and needed > free:
+      raise CommandError(self._shortage(name, needed, free))
+
+  def admit(self, name, needed):
+    """Reserves memory for a VDO volume which is about to start,
+    waiting for volumes started earlier to finish loading if there is
+    not enough.
+
+    Arguments:
+      name (str): the VDO volume
+      needed (int): the bytes the volume needs
+    Exceptions:
+      CommandError: there is not enough memory
+    """
+    if Command.noRunMode():
+      return
+
+    def fits():
+      with self._lock:
+        free = self._unreserved()
+        if free is None or needed <= free:
+          self._reservations[name] = (needed, None)
+          return True
+        # _unreserved has just polled the outstanding reservations and
+        # dropped those all allocated; polling again would only ping
+        # each Albireo server a second time.
+        if not self._reservations:
+          # Nothing else will release memory, so waiting is pointless.
+          raise CommandError(self._shortage(name, needed, free))
+        return False
+
+    if not fits():
+      self.log.announce(_("Waiting for memory to start VDO {0}").format(name))
+      message = _("Timed out waiting for memory to start VDO {0}").format(
+          name)
+      with Waiter(self.timeout, message) as waiter:
+        waiter.until(fits)
+
+  def started(self, name, unallocated):
+    """Records that a VDO volume admitted by admit has been started.
+
+    Arguments:
+      name (str): the VDO volume
+      unallocated (Callable): returns the bytes of the volume's memory
+        not yet allocated, which is 0 once its Albireo server has
+        loaded its index or has stopped
+    """
+    with self._lock:
+      if name in self._reservations:
+        self._reservations[name] = (self._reservations[name][0],
+                                    unallocated)
+
+  def release(self, name):
+    """Drops the reservation for a VDO volume which failed to start."""
+    with self._lock:
+      self._reservations.pop(name, None)
+
+  def _outstanding(self):
+    """Returns the bytes reserved and not yet allocated, dropping
+    reservations whose memory is all allocated. Must be called with
+    _lock held."""
+    total = 0
+    for name, (needed, unallocated) in self._reservations.items():
+      if unallocated is None:
+        total += needed
+        continue
+      left = min(needed, unallocated())
+      if left > 0:
+        total += left
+      else:
+        del self._reservations[name]
+    return total
+
+  def _unreserved(self):
+    """Returns the available memory less the outstanding reservations,
+    or None if the available memory is not known."""
+    free = self.available()
+    if free is None:
+      return None
+    with self._lock:
+      return free - self._outstanding()
+
+  @staticmethod
+  def _shortage(name, needed, free):
+    """Returns the message for a volume which does not fit."""
+    return _("Not enough memory for VDO {0}: needs {1}, {2} available").format(
+        name, SizeString(str(needed) + 'B').asDisplay(),
+        SizeString(str(max(0, free)) + 'B').asDisplay())
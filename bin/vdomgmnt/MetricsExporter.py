@@ -0,0 +1,233 @@
+"""
+  MetricsExporter - publishes VDO metrics for Prometheus
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/MetricsExporter.py#1 $
+
+"""
+from . import CommandError, CommandLock, Configuration, KernelModuleService
+from . import Defaults, Logger, SystemState, VdoStatistics
+import BaseHTTPServer
+import os
+import re
+import threading
+import time
+
+
+class MetricsExporter(object):
+  """MetricsExporter collects the statistics of every configured VDO
+  volume, the state of the kernel module, and the liveness of every
+  Albireo server, and formats them in the Prometheus text exposition
+  format.
+
+  A collection reads the statistics of each volume with VdoStatistics,
+  checks the kernel module with one lsmod and one 'dmsetup targets',
+  and checks each Albireo server through its pid file; nothing is run
+  per volume. The configuration file is parsed again only when it
+  changes. The result of a collection is kept until the next one, so
+  serving a scrape never waits for a collection.
+
+  Attributes:
+    confFile (str): the configuration file
+    interval (float): seconds between collections when serving
+    _lock (threading.Lock): protects _text
+    _text (str): the result of the latest collection
+    _config (tuple): the modification time of the configuration file
+      when last read, the VDO names, and the AlbireoServices
+  """
+  log = Logger.getLogger(Logger.myname + '.MetricsExporter')
+  contentType = 'text/plain; version=0.0.4; charset=utf-8'
+
+  # Statistics which are levels rather than running totals.
+  _gauges = set(['blockSize', 'compressedFragmentsInPacker',
+                 'currDedupeQueries', 'currIORequests', 'dataBlocksUsed',
+                 'inRecoveryMode', 'logicalBlockSize', 'logicalBlocksUsed',
+                 'maxDedupeQueries', 'maxIORequests', 'overheadBlocksUsed',
+                 'recoveryPercentage', 'reservedBlocks'])
+
+  def __init__(self, confFile, interval=15):
+    self.confFile = confFile
+    self.interval = interval
+    self._lock = threading.Lock()
+    self._text = None
+    self._config = (None, [], [])
+
+  def __str__(self):
+    return "MetricsExporter(\"{0}\")".format(self.confFile)
+
+  def text(self):
+    """Returns the metrics from the latest collection, collecting them
+    first if there has been no collection yet."""
+    with self._lock:
+      text = self._text
+    if text is None:
+      text = self.collect()
+    return text
+
+  def collect(self):
+    """Collects all the metrics and saves the result for text().
+
+    Returns:
+      The metrics, as a string.
+    """
+    start = time.time()
+    samples = []
+    self._collectModule(samples)
+    vdos, albservers = self._readConfiguration()
+    for name in vdos:
+      self._collectVdo(name, samples)
+    for albserver in albservers:
+      samples.append(('vdo_albserver_up', 'gauge',
+                      {'server': albserver.getName()},
+                      int(albserver.running())))
+    samples.append(('vdo_exporter_collect_seconds', 'gauge', {},
+                    time.time() - start))
+    text = self._format(samples)
+    with self._lock:
+      self._text = text
+    return text
+
+  def writeTextfile(self, path):
+    """Collects the metrics and writes them to a file for the node
+    exporter's textfile collector. The file is replaced atomically.
+
+    Arguments:
+      path (str): the file to write
+    """
+    text = self.collect()
+    tmpPath = "{0}.{1}.tmp".format(path, os.getpid())
+    try:
+      with open(tmpPath, 'w') as f:
+        f.write(text)
+      os.rename(tmpPath, path)
+    except (IOError, OSError) as ex:
+      raise CommandError(_("Could not write {0}: {1}").format(path,
+                                                              ex.strerror))
+
+  def serve(self, address, port):
+    """Serves the metrics over HTTP until interrupted, collecting them
+    again every interval seconds in a background thread.
+
+    Arguments:
+      address (str): the address to listen on
+      port (int): the port to listen on
+    """
+    exporter = self
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+      """Answers requests for the metrics."""
+      def do_GET(self):
+        """Sends the metrics."""
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+          self.send_error(404)
+          return
+        body = exporter.text()
+        self.send_response(200)
+        self.send_header('Content-Type', exporter.contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, fmt, *args):
+        exporter.log.debug(fmt % args)
+
+    self.collect()
+    collector = threading.Thread(target=self._collectLoop)
+    collector.daemon = True
+    collector.start()
+    server = BaseHTTPServer.HTTPServer((address, port), Handler)
+    self.log.info(_("Serving metrics on {0}:{1}").format(address, port))
+    server.serve_forever()
+
+  def _collectLoop(self):
+    """Collects the metrics every interval seconds, forever."""
+    while True:
+      time.sleep(self.interval)
+      try:
+        self.collect()
+      except Exception as ex:
+        self.log.error(_("Metrics collection failed: {0}").format(ex))
+
+  def _readConfiguration(self):
+    """Returns the names of the configured VDOs and the configured
+    AlbireoServices, reading the configuration file only if it has
+    changed since it was last read."""
+    try:
+      mtime = os.stat(self.confFile).st_mtime
+    except OSError:
+      return [], []
+    if mtime != self._config[0]:
+      with CommandLock(Defaults.lockFile):
+        with Configuration(self.confFile) as conf:
+          self._config = (mtime, sorted(conf.getAllVdos()),
+                          [conf.getAlbserver(name)
+                           for name in sorted(conf.getAllAlbservers())])
+    return self._config[1], self._config[2]
+
+  def _collectModule(self, samples):
+    """Adds the state of the kernel module to a list of samples."""
+    SystemState.invalidate(['modules', 'targets'])
+    loaded = KernelModuleService().running(False)
+    samples.append(('vdo_kernel_module_loaded', 'gauge', {}, int(loaded)))
+
+  def _collectVdo(self, name, samples):
+    """Adds the statistics of a VDO volume to a list of samples."""
+    labels = {'volume': name}
+    reader = VdoStatistics(name)
+    try:
+      stats = reader.dedupe()
+      kernel = reader.kernel()
+    except CommandError as ex:
+      self.log.debug(str(ex))
+      samples.append(('vdo_up', 'gauge', labels, 0))
+      return
+    samples.append(('vdo_up', 'gauge', labels, 1))
+    samples.append(('vdo_operating_mode', 'gauge',
+                    dict(labels, mode=stats.mode), 1))
+    samples.append(('vdo_write_policy', 'gauge',
+                    dict(labels, policy=stats.writePolicy), 1))
+    for statName, value in stats.items() + kernel.items():
+      metric, metricType, extra = self._describe(statName)
+      samples.append((metric, metricType, dict(labels, **extra), value))
+
+  @classmethod
+  def _describe(cls, statName):
+    """Returns the metric name, metric type, and any extra labels for a
+    statistic named as by VdoStatistics.counterNames()."""
+    parts = statName.split('.')
+    extra = {}
+    if parts[0].startswith('bios') and len(parts) == 2:
+      # 'biosIn.read' becomes vdo_bios_in_total{type="read"}
+      extra['type'] = parts.pop()
+    metric = 'vdo_' + '_'.join(cls._snakeCase(part) for part in parts)
+    if parts[0] == 'config' or statName in cls._gauges:
+      return metric, 'gauge', extra
+    return metric + '_total', 'counter', extra
+
+  @staticmethod
+  def _snakeCase(name):
+    """Converts a camelCase name to snake_case."""
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name)
+    return re.sub(r'([A-Z]+)([A-Z][a-z])', r'\1_\2', name).lower()
+
+  @staticmethod
+  def _format(samples):
+    """Formats a list of (metric, type, labels, value) samples in the
+    Prometheus text format, grouping the samples of each metric."""
+    order = []
+    metrics = {}
+    for metric, metricType, labels, value in samples:
+      if metric not in metrics:
+        order.append(metric)
+        metrics[metric] = ["# TYPE {0} {1}".format(metric, metricType)]
+      labelText = ",".join('{0}="{1}"'.format(
+          key, str(labels[key]).replace('\\', r'\\').replace('"', r'\"'))
+                           for key in sorted(labels))
+      if labelText:
+        labelText = "{" + labelText + "}"
+      metrics[metric].append("{0}{1} {2}".format(metric, labelText,
+                                                 repr(value)
+                                                 if isinstance(value, float)
+                                                 else value))
+    return "".join("\n".join(metrics[metric]) + "\n" for metric in order)
@@ -0,0 +1,165 @@
+"""
+  ParallelExecutor - runs per-volume operations concurrently
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/ParallelExecutor.py#1 $
+
+"""
+from . import Logger
+import logging
+import Queue
+import sys
+import threading
+
+
+class _ThreadOutput(object):
+  """A file-like object standing in for stdout or stderr while jobs are
+  running. Writes from a thread that has a capture buffer are saved in
+  that buffer; writes from any other thread go straight to the real
+  stream.
+
+  Attributes:
+    _local (threading.local): holds the capture buffer of each thread
+    _stream (file): the real output stream
+  """
+  def __init__(self, stream, local):
+    self._local = local
+    self._stream = stream
+
+  def write(self, s):
+    """Writes a string, capturing it if the calling thread has a buffer."""
+    buf = getattr(self._local, 'buffer', None)
+    if buf is None:
+      self._stream.write(s)
+    else:
+      buf.append((self._stream, s))
+
+  def flush(self):
+    """Flushes the real stream unless the calling thread is capturing."""
+    if getattr(self._local, 'buffer', None) is None:
+      self._stream.flush()
+
+  def __getattr__(self, name):
+    return getattr(self._stream, name)
+
+
+class ParallelExecutor(object):
+  """ParallelExecutor runs a function over a list of items using a
+  bounded number of worker threads.
+
+  Everything a job prints to stdout or stderr, including messages
+  from the logging module, is held back until the job finishes and is
+  then written out as one block, so the output for each item is never
+  interleaved with the output for another. With a single job the
+  function is simply called for each item in turn.
+
+  An exception raised by the function is raised again by map whatever
+  the number of jobs: no further items are started, and once the items
+  already started have finished, the exception for the earliest of the
+  failed items is raised.
+
+  Attributes:
+    jobs (int): the maximum number of items to work on at once
+    _lock (threading.Lock): serializes writing out captured output
+    _local (threading.local): per-thread capture buffers
+  """
+  log = Logger.getLogger(Logger.myname + '.ParallelExecutor')
+
+  def __init__(self, jobs=1):
+    self.jobs = max(1, int(jobs))
+    self._lock = threading.Lock()
+    self._local = threading.local()
+
+  def __str__(self):
+    return "ParallelExecutor({0})".format(self.jobs)
+
+  def map(self, func, items):
+    """Calls func on every item and returns the list of results in the
+    same order as items.
+
+    Arguments:
+      func (Callable): the function to call; takes a single item
+      items (list): the items to operate on
+    Returns:
+      A list of the values returned by func.
+    Exceptions:
+      any exception raised by func
+    """
+    items = list(items)
+    if self.jobs == 1 or len(items) < 2:
+      return [func(item) for item in items]
+
+    results = [None] * len(items)
+    errors = {}
+    work = Queue.Queue()
+    for index, item in enumerate(items):
+      work.put((index, item))
+
+    def worker():
+      while not errors:
+        try:
+          index, item = work.get_nowait()
+        except Queue.Empty:
+          return
+        self._local.buffer = []
+        try:
+          try:
+            results[index] = func(item)
+          except Exception:
+            errors[index] = sys.exc_info()
+        finally:
+          self._emit(self._local.buffer)
+          self._local.buffer = None
+
+    self.log.debug("Running {0} items with {1} jobs".format(len(items),
+                                                             self.jobs))
+    threads = [threading.Thread(target=worker)
+               for unused_count in range(min(self.jobs, len(items)))]
+    redirects = self._redirect()
+    try:
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+    finally:
+      self._restore(redirects)
+    if errors:
+      excType, excValue, excTraceback = errors[min(errors)]
+      raise excType, excValue, excTraceback
+    return results
+
+  def _emit(self, buf):
+    """Writes the output captured from one job to the real streams."""
+    with self._lock:
+      for stream, s in buf:
+        stream.write(s)
+      for stream in set(stream for stream, unused_s in buf):
+        stream.flush()
+
+  def _redirect(self):
+    """Replaces stdout, stderr, and the streams of any logging handlers
+    writing to them with capturing wrappers.
+
+    Returns:
+      A list of (object, attribute, original value) to be restored.
+    """
+    saved = []
+    wrappers = {}
+    for attr in ['stdout', 'stderr']:
+      stream = getattr(sys, attr)
+      wrappers[id(stream)] = _ThreadOutput(stream, self._local)
+      saved.append((sys, attr, stream))
+      setattr(sys, attr, wrappers[id(stream)])
+    for handler in logging.getLogger().handlers:
+      stream = getattr(handler, 'stream', None)
+      if id(stream) in wrappers:
+        saved.append((handler, 'stream', stream))
+        handler.stream = wrappers[id(stream)]
+    return saved
+
+  @staticmethod
+  def _restore(saved):
+    """Undoes the work of _redirect."""
+    for obj, attr, value in reversed(saved):
+      setattr(obj, attr, value)
@@ -0,0 +1,213 @@
+"""
+  QueueAnalyzer - finds which kvdo work queue is holding up a VDO volume
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/QueueAnalyzer.py#1 $
+
+"""
+from . import KernelModuleService, Logger, Utils, VdoStatistics
+import time
+
+
+class QueueAnalyzer(object):
+  """QueueAnalyzer samples the work queue statistics of a VDO volume
+  and the CPU used by the threads serving each queue, and works out
+  which stage of the I/O path is the bottleneck.
+
+  The kvdo module has a work queue, each served by its own threads, for
+  each stage:
+
+    - ReqQ: the VDO zones (hash, logical, and physical zones, the
+      journals, and the block map), all on one thread;
+    - CpuQ: hashing, compression, and comparing blocks;
+    - BioQ: submitting bios to the underlying storage; and
+    - DedupeQ: queries to the deduplication index.
+
+  For each queue it reports the share of the time its busiest thread
+  was running, the percentiles of the number of work items waiting, the
+  items processed per second, and how fast the backlog grew. A queue
+  whose thread is nearly always running is CPU-bound; one with a
+  backlog while its thread is mostly not running is waiting on
+  something else, the storage or the index. Depths are kept as counts
+  of each depth seen, so memory does not grow with the samples taken.
+
+  The threads are named by the module, not the volume, so when several
+  volumes are running, the CPU used by their threads is added together.
+
+  Attributes:
+    name (str): the volume
+    samples (int): the samples taken
+    _module (str): the kernel module name, which starts every queue name
+    _first (tuple): the time, queue counters, and thread CPU seconds of
+      the first sample
+    _last (tuple): the same for the latest sample
+    _depths (dict): for each queue, the number of samples which saw
+      each depth
+  """
+  log = Logger.getLogger(Logger.myname + '.QueueAnalyzer')
+
+  # The stage served by each queue, by the queue name after the module
+  # name, in the order they are reported.
+  stages = [('ReqQ', 'VDO zones'),
+            ('CpuQ', 'hashing and compression'),
+            ('BioQ', 'bio submission'),
+            ('DedupeQ', 'dedupe index')]
+  # A thread running this share of the time is saturated.
+  busyShare = 0.9
+  # The seconds between samples.
+  sampleInterval = 0.1
+
+  def __init__(self, name):
+    self.name = name
+    self.samples = 0
+    self._module = KernelModuleService().getName()
+    self._first = None
+    self._last = None
+    self._depths = {}
+
+  def __str__(self):
+    return "QueueAnalyzer({0})".format(self.name)
+
+  def run(self, duration):
+    """Samples the volume's queues for a length of time.
+
+    Arguments:
+      duration (float): the seconds to sample for
+    Exceptions:
+      CommandError: the statistics could not be read
+    """
+    end = time.time() + duration
+    while True:
+      self.sample()
+      remaining = end - time.time()
+      if remaining <= 0:
+        return
+      time.sleep(min(self.sampleInterval, remaining))
+
+  def sample(self):
+    """Takes one sample of the volume's queues and their threads.
+
+    Exceptions:
+      CommandError: the statistics could not be read
+    """
+    queues = {}
+    for queue in VdoStatistics(self.name).queues().queueStats:
+      if not queue.name:
+        # The volume has no index, so has one queue fewer.
+        continue
+      work = dict((item.work, item.processed) for item in queue.workStats
+                  if item.work)
+      queues[queue.name] = (queue.pending, queue.processed, queue.timedOut,
+                            work)
+      depths = self._depths.setdefault(queue.name, {})
+      depths[queue.pending] = depths.get(queue.pending, 0) + 1
+    self._last = (time.time(), queues, Utils.threadCpuSeconds(self._module))
+    if self._first is None:
+      self._first = self._last
+    self.samples += 1
+
+  def report(self):
+    """Returns what the samples show about each queue.
+
+    Returns:
+      A list of dictionaries, one for each queue sampled, in the order
+      of stages, giving the queue, its stage, the share of the time
+      each of its threads was running and the highest of these
+      ('utilisation'), the 50th, 90th, and 99th percentile and the
+      maximum of its depth, the items it processed per second, the
+      items per second by which its backlog grew, the items which
+      timed out, and the kind of work it processed most.
+    """
+    if self._first is None:
+      return []
+    start, firstQueues, firstCpu = self._first
+    end, lastQueues, lastCpu = self._last
+    elapsed = end - start
+    order = dict((self._module + suffix, index)
+                 for index, (suffix, unused_stage) in enumerate(self.stages))
+    result = []
+    for queue in sorted(lastQueues, key=lambda q: (order.get(q, len(order)),
+                                                   q)):
+      pending, processed, timedOut, work = lastQueues[queue]
+      firstPending, firstProcessed, firstTimedOut, firstWork = (
+          firstQueues.get(queue, (pending, processed, timedOut, work)))
+      threads = {}
+      for thread, seconds in lastCpu.items():
+        if self._serves(thread, queue):
+          used = seconds - firstCpu.get(thread, seconds)
+          threads[thread] = used / elapsed if elapsed > 0 else 0.0
+      busiest = sorted(work, key=lambda w: firstWork.get(w, 0) - work[w])
+      depths = self._depths[queue]
+      result.append({
+        'queue': queue,
+        'stage': self.stageOf(queue),
+        'threads': threads,
+        'utilisation': max(threads.values()) if threads else None,
+        'depthP50': self._percentile(depths, 0.5),
+        'depthP90': self._percentile(depths, 0.9),
+        'depthP99': self._percentile(depths, 0.99),
+        'depthMax': max(depths),
+        'throughput': ((processed - firstProcessed) / elapsed
+                       if elapsed > 0 else 0.0),
+        'backlogGrowth': ((pending - firstPending) / elapsed
+                          if elapsed > 0 else 0.0),
+        'timedOut': timedOut - firstTimedOut,
+        'topWork': busiest[0] if busiest else None,
+      })
+    return result
+
+  def bottleneck(self, report):
+    """Picks the bottleneck from a report.
+
+    Arguments:
+      report (list): the report, as returned by report()
+    Returns:
+      The entry of the report for the bottleneck queue and what would
+      help it, or (None, None) if no queue is saturated.
+    """
+    busy = [entry for entry in report
+            if (entry['utilisation'] or 0) >= self.busyShare]
+    if busy:
+      entry = max(busy, key=lambda e: e['utilisation'])
+      if len(entry['threads']) > 1:
+        return entry, _("its threads are CPU-bound; more or faster CPUs"
+                        " would help")
+      return entry, _("its thread is CPU-bound; a faster CPU would help,"
+                      " more CPUs would not")
+    waiting = [entry for entry in report
+               if entry['depthP50'] > 0 or entry['backlogGrowth'] > 0]
+    if not waiting:
+      return None, None
+    entry = max(waiting, key=lambda e: (e['depthP90'], e['backlogGrowth']))
+    if entry['queue'].endswith('DedupeQ'):
+      return entry, _("queries wait on the index; faster index storage"
+                      " or more index memory would help")
+    return entry, _("work waits while its threads are not running; faster"
+                    " storage would help more than CPU")
+
+  def stageOf(self, queue):
+    """Returns the stage a queue serves."""
+    for suffix, stage in self.stages:
+      if queue == self._module + suffix:
+        return stage
+    return queue
+
+  @staticmethod
+  def _serves(thread, queue):
+    """Returns True iff a thread serves a queue; a queue with several
+    threads numbers them after its name."""
+    return thread == queue or (thread.startswith(queue)
+                               and thread[len(queue):].isdigit())
+
+  @staticmethod
+  def _percentile(counts, fraction):
+    """Returns a percentile of the values counted in a dictionary from
+    value to count."""
+    rank = max(1, fraction * sum(counts.values()))
+    seen = 0
+    for value in sorted(counts):
+      seen += counts[value]
+      if seen >= rank:
+        return value
+    return max(counts)
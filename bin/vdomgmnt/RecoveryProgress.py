@@ -0,0 +1,91 @@
+"""
+  RecoveryProgress - the state of the recovery of a VDO volume
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/RecoveryProgress.py#1 $
+
+"""
+from . import IndexProgress
+import time
+
+
+class RecoveryProgress(object):
+  """The state of the recovery of a VDO volume at one moment.
+
+  After an unclean shutdown a VDO volume comes up in recovery mode and
+  rebuilds its reference counts in the background, scanning the block
+  map at the scan rate and sweeping the slabs at the sweep rate given
+  in its device mapper table, while it serves I/O. The kvdo module
+  reports how far along it is as a whole percentage. The rate and the
+  time remaining are estimated from the change since the recovery was
+  first observed, since a whole percentage changes too rarely for the
+  change between two close observations to mean much.
+
+  The rates in the table are fixed when the device is started: kvdo
+  starts a new VDO on a table reload rather than updating the running
+  one, so they cannot be changed while the volume runs.
+
+  Attributes:
+    state (str): RECOVERING, NORMAL, or STOPPED
+    time (float): when the state was observed
+    percent (int): the percentage of the recovery done, or None if not
+      recovering
+    scanRate (int): the block map scan rate the device is using, or
+      None if not known
+    sweepRate (int): the slab sweep rate the device is using, or None
+      if not known
+    rate (float): the percentage done per minute since the recovery
+      was first observed, or None
+    remaining (float): the estimated seconds until the recovery is
+      done, or None
+    since (tuple): the time and percentage when the recovery was first
+      observed, or None if not recovering
+  """
+  RECOVERING = 'recovering'
+  NORMAL = 'normal'
+  STOPPED = 'stopped'
+
+  def __init__(self, state, percent=None, scanRate=None, sweepRate=None,
+               previous=None):
+    self.state = state
+    self.time = time.time()
+    self.percent = percent
+    self.scanRate = scanRate
+    self.sweepRate = sweepRate
+    self.rate = None
+    self.remaining = None
+    self.since = None
+    if state != self.RECOVERING:
+      return
+    if (previous is not None and previous.since is not None
+        and previous.percent <= percent):
+      self.since = previous.since
+    else:
+      self.since = (self.time, percent)
+    elapsed = self.time - self.since[0]
+    done = percent - self.since[1]
+    if elapsed > 0 and done > 0:
+      self.rate = 60.0 * done / elapsed
+      self.remaining = max(0, 100 - percent) * elapsed / done
+
+  def __str__(self):
+    if self.state != self.RECOVERING:
+      return self.state
+    parts = [_("recovering, {0}% done").format(self.percent)]
+    if self.rate is not None:
+      parts.append(_("{0:.2f}%/min").format(self.rate))
+    if self.remaining is not None:
+      parts.append(_("about {0} remaining").format(
+          IndexProgress.formatSeconds(self.remaining)))
+    if self.scanRate is not None:
+      parts.append(_("scan rate {0}, sweep rate {1}").format(self.scanRate,
+                                                            self.sweepRate))
+    return ", ".join(parts)
+
+  def asDict(self):
+    """Returns the attributes of this object which are meaningful to
+    report, as a dictionary."""
+    return dict((key, getattr(self, key))
+                for key in ['state', 'time', 'percent', 'scanRate',
+                            'sweepRate', 'rate', 'remaining'])
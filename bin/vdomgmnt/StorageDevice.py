@@ -0,0 +1,139 @@
+"""
+  StorageDevice - interface to the storage under VDO volumes and indexes
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/StorageDevice.py#1 $
+
+"""
+from . import ArgumentError, Command, Logger, SizeString
+import os
+
+
+class StorageDevice(object):
+  """Superclass for the kinds of storage which can back a VDO volume or
+  hold an Albireo index.
+
+  A StorageDevice is named by a specification string, which is what is
+  persisted in the configuration file (as logicalVolumePath, for
+  compatibility with files written when only logical volumes were
+  supported). The kinds of storage are:
+
+    /dev/<vg>/<lv> or lvm:/dev/<vg>/<lv>
+                     an LVM logical volume (LogicalVolume)
+    block:<device>   a block device such as a disk, partition, NVMe
+                     namespace, or MD array, used as it is (BlockDevice)
+    file:<path>      a file attached to a loop device, for testing
+                     (FileDevice)
+
+  As with LogicalVolume, constructing a StorageDevice only checks the
+  syntax of its specification.
+
+  Methods:
+    canCreate    raises an ArgumentError if the storage cannot be created
+    create       creates the storage, returning its size
+    extend       grows the storage, returning its new size
+    reduce       shrinks the storage back after a failed extend
+    remove       removes the storage
+    exists       returns True if the storage exists
+    getSize      returns the size of the storage
+    fullpath     returns the block device to use
+    setAvailable makes the block device available or unavailable
+    status       returns a description of the storage
+    vgStatus     returns a description of the storage pool it is in
+
+  Attributes:
+    maximumSize (SizeString): if set, attempts to create or extend
+      this storage past maximumSize will raise an ArgumentError
+    _physicalSize (SizeString): the size set in create or extend; only
+      used to support fake returns in noRun
+  """
+  log = Logger.getLogger(Logger.myname + '.StorageDevice')
+
+  def __init__(self):
+    self._physicalSize = SizeString('')
+    self.maximumSize = None
+
+  @staticmethod
+  def fromSpec(spec):
+    """Returns the StorageDevice for a specification string.
+
+    Arguments:
+      spec (str): the specification
+    Exceptions:
+      ArgumentError: invalid specification
+    """
+    from . import BlockDevice, FileDevice, LogicalVolume
+    kind, sep, path = spec.partition(':')
+    if not sep:
+      return LogicalVolume(spec)
+    if kind == 'lvm':
+      return LogicalVolume(path)
+    if kind == 'block':
+      return BlockDevice(path)
+    if kind == 'file':
+      return FileDevice(path)
+    raise ArgumentError(_("Unknown kind of storage {kind} in {spec}").format(
+        kind=kind, spec=spec))
+
+  @staticmethod
+  def realpath(spec):
+    """Returns the canonical path of the device or file a specification
+    names, so that two specifications of the same storage compare
+    equal.
+
+    Arguments:
+      spec (str): the specification
+    """
+    kind, sep, path = spec.partition(':')
+    return os.path.realpath(path if sep else spec)
+
+  def vgStatus(self):
+    """Returns the status of the pool of storage this storage is
+    allocated from."""
+    return _("(not applicable)")
+
+  def setAvailable(self, yorn):
+    """Makes the storage available or unavailable; does nothing unless
+    overridden."""
+    pass
+
+  def reduce(self, physicalSize):
+    """Records the size of the storage after a failed extend; does
+    nothing else unless overridden."""
+    self._physicalSize = physicalSize
+
+  def _roundDown(self, blockSize, size):
+    """Rounds a size down to a multiple of a block size.
+
+    Returns:
+      The rounded size, as a SizeString.
+    """
+    slop = size.toBytes() % blockSize
+    if slop:
+      size = SizeString(str(size.toBytes() - slop) + 'B')
+      self.log.debug(_("Rounded physical size to {0!s}").format(size))
+    return size
+
+  def _maximumSizeCheck(self, physicalSize):
+    """Checks a size requested for a create or extend operation against
+    maximumSize, if set. In noRun mode, no check is made.
+
+    Exceptions:
+      ArgumentError: requested size is not supported
+    """
+    if Command.noRunMode() or not self.maximumSize or not physicalSize:
+      return
+    if physicalSize > self.maximumSize:
+      raise ArgumentError(_(
+          "Requested physical size {sz} too large (maximum {mx})").format(
+          sz=physicalSize, mx=self.maximumSize))
+
+  @staticmethod
+  def _deviceSize(path):
+    """Returns the size of a block device or file in bytes."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+      return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+      os.close(fd)
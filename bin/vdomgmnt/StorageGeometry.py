@@ -0,0 +1,136 @@
+"""
+  StorageGeometry - the stripe geometry of block devices
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/StorageGeometry.py#1 $
+
+"""
+from . import Logger
+import fractions
+import os
+
+
+class StorageGeometry(object):
+  """StorageGeometry describes how a block device stripes its data, as
+  reported by the kernel: for an MD array, its chunk size and the
+  number of disks holding data in each stripe, and for other devices,
+  the minimum and optimal I/O sizes they advertise, which is how
+  hardware RAID controllers and device mapper stacks report their
+  chunk and full stripe sizes.
+
+  A device with no striping has a chunk size and full stripe of 0.
+
+  Attributes:
+    chunkSize (int): the bytes written to one disk before moving on to
+      the next
+    fullStripe (int): the bytes in one full stripe across the data
+      disks; writes of whole, aligned full stripes need no
+      read-modify-write on parity RAID
+  """
+  log = Logger.getLogger(Logger.myname + '.StorageGeometry')
+  sysBlockDir = '/sys/class/block'
+
+  # The number of disks in an MD array which hold no data for a stripe.
+  _mdParityDisks = {'raid4': 1, 'raid5': 1, 'raid6': 2}
+
+  def __init__(self, chunkSize=0, fullStripe=0):
+    self.chunkSize = chunkSize
+    self.fullStripe = fullStripe
+
+  def __str__(self):
+    return "StorageGeometry(chunk={0},stripe={1})".format(self.chunkSize,
+                                                          self.fullStripe)
+
+  def __eq__(self, rhs):
+    return (self.chunkSize, self.fullStripe) == (rhs.chunkSize,
+                                                 rhs.fullStripe)
+
+  def __ne__(self, rhs):
+    return not self == rhs
+
+  @classmethod
+  def forDevice(cls, path):
+    """Returns the geometry of a block device, which has no striping if
+    it cannot be read.
+
+    Arguments:
+      path (str): the device, or a symbolic link to it
+    """
+    name = os.path.basename(os.path.realpath(path))
+    sysDir = os.path.join(cls.sysBlockDir, name)
+    if os.path.isdir(os.path.join(sysDir, 'md')):
+      geometry = cls._mdGeometry(sysDir)
+    else:
+      geometry = cls._queueGeometry(sysDir)
+    cls.log.debug("{0} has {1}".format(path, geometry))
+    return geometry
+
+  @staticmethod
+  def lcm(a, b):
+    """Returns the least common multiple of two sizes, where a size of
+    0 means no constraint."""
+    if not a or not b:
+      return a or b
+    return a * b // fractions.gcd(a, b)
+
+  @staticmethod
+  def isPowerOfTwo(n):
+    """Returns True iff n is a positive power of two."""
+    return n > 0 and not n & (n - 1)
+
+  @classmethod
+  def _mdGeometry(cls, sysDir):
+    """Returns the geometry of an MD array from its md directory."""
+    mdDir = os.path.join(sysDir, 'md')
+    level = cls.readSysfs(os.path.join(mdDir, 'level'))
+    disks = cls._readSysfsInt(os.path.join(mdDir, 'raid_disks'))
+    chunkSize = cls._readSysfsInt(os.path.join(mdDir, 'chunk_size'))
+    if level == 'raid0':
+      dataDisks = disks
+    elif level == 'raid10':
+      # The default near-2 layout keeps two copies of each chunk.
+      dataDisks = disks // 2
+    elif level in cls._mdParityDisks:
+      dataDisks = disks - cls._mdParityDisks[level]
+    else:
+      # linear and raid1 arrays do not stripe.
+      dataDisks = 0
+    if chunkSize <= 0 or dataDisks <= 0:
+      return cls()
+    return cls(chunkSize, chunkSize * dataDisks)
+
+  @classmethod
+  def _queueGeometry(cls, sysDir):
+    """Returns the geometry a device advertises in its queue directory.
+    A partition has no queue directory of its own, so the one of the
+    disk containing it is used."""
+    queueDir = os.path.join(sysDir, 'queue')
+    if not os.path.isdir(queueDir):
+      queueDir = os.path.join(sysDir, '..', 'queue')
+    minimum = cls._readSysfsInt(os.path.join(queueDir, 'minimum_io_size'))
+    optimal = cls._readSysfsInt(os.path.join(queueDir, 'optimal_io_size'))
+    if optimal <= 0 or minimum <= 0 or optimal % minimum:
+      return cls()
+    if optimal == minimum:
+      # The device wants writes of a given size but is not striped.
+      return cls(0, optimal)
+    return cls(minimum, optimal)
+
+  @staticmethod
+  def readSysfs(path):
+    """Returns the contents of a sysfs file, or '' if it cannot be
+    read."""
+    try:
+      with open(path) as f:
+        return f.read().strip()
+    except IOError:
+      return ''
+
+  @classmethod
+  def _readSysfsInt(cls, path):
+    """Returns the integer in a sysfs file, or 0 if there is none."""
+    try:
+      return int(cls.readSysfs(path))
+    except ValueError:
+      return 0
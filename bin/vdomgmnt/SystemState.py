@@ -0,0 +1,363 @@
+"""
+  SystemState - cached snapshot of device mapper, LVM, and module state
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/SystemState.py#1 $
+
+"""
+from . import Command, CommandError, DeviceMapper, Logger, SizeString
+import os
+import threading
+
+
+class SystemState(object):
+  """SystemState answers questions about the device mapper devices,
+  logical volumes, volume groups, and kernel modules on the local node
+  from a snapshot taken with one command per kind of object, instead
+  of running a separate command for every object queried. Device
+  mapper state is read with DeviceMapper, which uses ioctls when it
+  can.
+
+  The snapshot is divided into sections, each filled in by a single
+  command the first time it is needed. Whenever a Command that changes
+  the state recorded in a section runs (lvcreate, dmsetup create, and
+  so forth), that section is discarded and will be captured again on
+  the next query.
+
+  A process which outlives many commands, such as vdod, calls refresh()
+  before each one instead of discarding the whole snapshot. The device
+  mapper status reports what the kernel is doing now, so it is always
+  discarded; the rest is only discarded if something else may have
+  changed it: LVM sections when the LVM metadata backup directory or
+  /dev/mapper has changed, and module sections when the set of loaded
+  modules has.
+
+  None of the queries are meaningful in noRun mode, since the commands
+  are not actually run; callers must handle that case themselves.
+
+  Attributes:
+    _cache (dict): the captured sections, indexed by section name
+    _lock (threading.RLock): protects _cache
+    _stamps (dict): for each group of sections checked by refresh(),
+      what it saw last time
+    _invalidates (dict): for each command name, either a list of the
+      sections it invalidates, or a dictionary mapping its first
+      argument to such a list
+  """
+  log = Logger.getLogger(Logger.myname + '.SystemState')
+  _cache = {}
+  _lock = threading.RLock()
+  _stamps = {}
+
+  # LVM replaces a volume group's backup here whenever its metadata
+  # changes, and udev the nodes here whenever a device is added.
+  lvmBackupDir = '/etc/lvm/backup'
+  mapperDir = '/dev/mapper'
+  sysModuleDir = '/sys/module'
+
+  _lvmSections = ['devices', 'extentSizes', 'logicalVolumes',
+                  'physicalVolumes', 'segments', 'volumeGroups']
+  _dmSections = ['devices']
+  _moduleSections = ['devices', 'modules', 'targets']
+  # The sections which change without any command being run.
+  _liveSections = ['devices']
+  _invalidates = {
+    'dmsetup': {'clear': _dmSections, 'create': _dmSections,
+                'load': _dmSections, 'message': _dmSections,
+                'reload': _dmSections, 'remove': _dmSections,
+                'remove_all': _dmSections, 'rename': _dmSections,
+                'resume': _dmSections, 'suspend': _dmSections},
+    'insmod': _moduleSections,
+    'lvchange': _lvmSections,
+    'lvcreate': _lvmSections,
+    'lvextend': _lvmSections,
+    'lvreduce': _lvmSections,
+    'lvremove': _lvmSections,
+    'lvrename': _lvmSections,
+    'lvresize': _lvmSections,
+    'modprobe': _moduleSections,
+    'rmmod': _moduleSections,
+    'vgchange': _lvmSections,
+    'vgextend': _lvmSections,
+    'vgreduce': _lvmSections,
+  }
+
+  def __init__(self):
+    pass
+
+  @classmethod
+  def commandRun(cls, cmdList):
+    """Discards the sections made stale by a command. This method is
+    registered as a Command listener and is called after every command.
+
+    Arguments:
+      cmdList (list): the command and its arguments
+    """
+    sections = cls._invalidates.get(cmdList[0])
+    if isinstance(sections, dict):
+      sections = sections.get(cmdList[1] if len(cmdList) > 1 else None)
+    if sections:
+      cls.invalidate(sections)
+
+  @classmethod
+  def invalidate(cls, sections=None):
+    """Discards part or all of the snapshot.
+
+    Arguments:
+      sections (list of str): the sections to discard; if None,
+        discard everything
+    """
+    with cls._lock:
+      if sections is None:
+        cls._cache.clear()
+      for section in sections or []:
+        if section in cls._cache:
+          cls.log.debug("Discarding {0} snapshot".format(section))
+          del cls._cache[section]
+
+  @classmethod
+  def refresh(cls):
+    """Discards the sections which may have changed since they were
+    captured other than by a Command run by this process."""
+    with cls._lock:
+      stale = set(cls._liveSections)
+      for group, sections in [('lvm', cls._lvmSections),
+                              ('modules', ['modules', 'targets'])]:
+        stamp = getattr(cls, '_stamp_' + group)()
+        if stamp is None or stamp != cls._stamps.get(group):
+          stale.update(sections)
+        cls._stamps[group] = stamp
+      cls.invalidate(sorted(stale))
+
+  @classmethod
+  def _stamp_lvm(cls):
+    """Returns what changes whenever LVM metadata changes or a device
+    is activated, or None if it cannot be read."""
+    try:
+      return (os.stat(cls.lvmBackupDir).st_mtime,
+              os.stat(cls.mapperDir).st_mtime)
+    except OSError:
+      return None
+
+  @classmethod
+  def _stamp_modules(cls):
+    """Returns the names of the loaded kernel modules, or None if they
+    cannot be read."""
+    try:
+      return frozenset(os.listdir(cls.sysModuleDir))
+    except OSError:
+      return None
+
+  @classmethod
+  def deviceNames(cls):
+    """Returns a sorted list of the names of all device mapper devices."""
+    return sorted(cls._get('devices').keys())
+
+  @classmethod
+  def deviceStatus(cls, name):
+    """Returns the device mapper status of a device, as reported by
+    'dmsetup status <name>', or None if there is no such device."""
+    return cls._get('devices').get(name)
+
+  @classmethod
+  def haveTarget(cls, target):
+    """Returns True iff a device mapper target type is registered."""
+    return target in cls._get('targets')
+
+  @classmethod
+  def moduleLoaded(cls, module):
+    """Returns True iff a kernel module is loaded."""
+    return module in cls._get('modules')
+
+  @classmethod
+  def logicalVolumeStatus(cls, lvpath):
+    """Returns the lvs line for a logical volume, or None if there is no
+    such logical volume.
+
+    Arguments:
+      lvpath (str): the LVM path of the volume (vgname/lvname)
+    """
+    lv = cls._get('logicalVolumes').get(lvpath)
+    if lv is None:
+      return None
+    return lv[0]
+
+  @classmethod
+  def logicalVolumeSize(cls, lvpath):
+    """Returns the size of a logical volume as a SizeString, or None if
+    there is no such logical volume.
+
+    Arguments:
+      lvpath (str): the LVM path of the volume (vgname/lvname)
+    """
+    lv = cls._get('logicalVolumes').get(lvpath)
+    if lv is None:
+      return None
+    return lv[1]
+
+  @classmethod
+  def logicalVolumeStriping(cls, lvpath):
+    """Returns how the last segment of a logical volume, the one an
+    lvextend adds to, is striped, or None if there is no such logical
+    volume.
+
+    Arguments:
+      lvpath (str): the LVM path of the volume (vgname/lvname)
+    Returns:
+      A tuple (stripes, stripeSize, devices): the number of stripes,
+      the stripe size in bytes, and the physical volumes the segment
+      is on.
+    """
+    return cls._get('segments').get(lvpath)
+
+  @classmethod
+  def volumeGroupStatus(cls, vg):
+    """Returns the vgs line for a volume group, or None if there is no
+    such volume group."""
+    group = cls._get('volumeGroups').get(vg)
+    if group is None:
+      return None
+    return group[0]
+
+  @classmethod
+  def volumeGroupFree(cls, vg):
+    """Returns the free space in a volume group as a SizeString, or None
+    if there is no such volume group."""
+    group = cls._get('volumeGroups').get(vg)
+    if group is None:
+      return None
+    return group[1]
+
+  @classmethod
+  def volumeGroupExtentSize(cls, vg):
+    """Returns the extent size of a volume group in bytes, or None if
+    there is no such volume group."""
+    return cls._get('extentSizes').get(vg)
+
+  @classmethod
+  def physicalVolumes(cls, vg):
+    """Returns a sorted list of (path, size, free) tuples describing the
+    physical volumes in a volume group, with the sizes in bytes."""
+    return sorted(cls._get('physicalVolumes').get(vg, []))
+
+  @classmethod
+  def _get(cls, section):
+    """Returns a section of the snapshot, capturing it if necessary."""
+    with cls._lock:
+      if section not in cls._cache:
+        cls.log.debug("Capturing {0} snapshot".format(section))
+        cls._cache[section] = getattr(cls, '_capture_' + section)()
+      return cls._cache[section]
+
+  @staticmethod
+  def _run(cmdList):
+    """Runs a command and returns its output, or an empty string if
+    it fails or is not run."""
+    return Command(cmdList).runOutput() or ''
+
+  @classmethod
+  def _capture_devices(cls):
+    """Returns a dictionary mapping each device mapper device name to
+    its status, which is empty if the devices cannot be listed."""
+    try:
+      return DeviceMapper.statusAll()
+    except CommandError as ex:
+      cls.log.debug(str(ex))
+      return {}
+
+  @classmethod
+  def _capture_logicalVolumes(cls):
+    """Returns a dictionary mapping each logical volume's LVM path to a
+    tuple of its lvs line and size."""
+    volumes = {}
+    for line in cls._run(['lvs', '--noheadings', '--units', 'k']).splitlines():
+      fields = line.split()
+      if len(fields) < 4:
+        continue
+      try:
+        size = SizeString(fields[3].rstrip('kK') + 'K')
+      except ValueError:
+        size = SizeString('')
+      volumes[fields[1] + '/' + fields[0]] = (line.strip(), size)
+    return volumes
+
+  @classmethod
+  def _capture_segments(cls):
+    """Returns a dictionary mapping each logical volume's LVM path to a
+    tuple of the stripes, stripe size, and physical volumes of its last
+    segment."""
+    segments = {}
+    for line in cls._run(['lvs', '--segments', '--noheadings', '--units', 'b',
+                          '--nosuffix', '-o',
+                          'vg_name,lv_name,stripes,stripe_size,devices']
+                         ).splitlines():
+      fields = line.split()
+      if len(fields) != 5 or not (fields[2].isdigit()
+                                  and fields[3].isdigit()):
+        continue
+      # The devices are listed as <path>(<first extent>),...
+      devices = [device.partition('(')[0]
+                 for device in fields[4].split(',') if device]
+      segments[fields[0] + '/' + fields[1]] = (int(fields[2]),
+                                               int(fields[3]), devices)
+    return segments
+
+  @classmethod
+  def _capture_volumeGroups(cls):
+    """Returns a dictionary mapping each volume group name to a tuple of
+    its vgs line and free space."""
+    groups = {}
+    for line in cls._run(['vgs', '--noheadings', '--units', 'k']).splitlines():
+      fields = line.split()
+      if len(fields) < 7:
+        continue
+      try:
+        free = SizeString(fields[6].rstrip('kK') + 'K')
+      except ValueError:
+        free = SizeString('')
+      groups[fields[0]] = (line.strip(), free)
+    return groups
+
+  @classmethod
+  def _capture_extentSizes(cls):
+    """Returns a dictionary mapping each volume group name to its
+    extent size in bytes."""
+    sizes = {}
+    for line in cls._run(['vgs', '--noheadings', '--units', 'b', '--nosuffix',
+                          '-o', 'vg_name,vg_extent_size']).splitlines():
+      fields = line.split()
+      if len(fields) == 2 and fields[1].isdigit():
+        sizes[fields[0]] = int(fields[1])
+    return sizes
+
+  @classmethod
+  def _capture_physicalVolumes(cls):
+    """Returns a dictionary mapping each volume group name to a list of
+    (path, size, free) tuples for its physical volumes."""
+    volumes = {}
+    for line in cls._run(['pvs', '--noheadings', '--units', 'b', '--nosuffix',
+                          '-o', 'pv_name,vg_name,pv_size,pv_free']
+                         ).splitlines():
+      fields = line.split()
+      if len(fields) != 4 or not (fields[2].isdigit()
+                                  and fields[3].isdigit()):
+        continue
+      volumes.setdefault(fields[1], []).append((fields[0], int(fields[2]),
+                                                int(fields[3])))
+    return volumes
+
+  @classmethod
+  def _capture_modules(cls):
+    """Returns the set of loaded kernel module names."""
+    lines = cls._run(['lsmod']).splitlines()
+    return set(line.split()[0] for line in lines[1:] if line.strip())
+
+  @classmethod
+  def _capture_targets(cls):
+    """Returns the set of registered device mapper target types."""
+    lines = cls._run(['dmsetup', 'targets']).splitlines()
+    return set(line.split()[0] for line in lines if line.strip())
+
+
+Command.addListener(SystemState.commandRun)
@@ -0,0 +1,153 @@
+"""
+  TraceAnalyzer - breaks down where traced kvdo I/O spends its time
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/TraceAnalyzer.py#1 $
+
+"""
+from . import Logger
+import re
+
+
+class TraceAnalyzer(object):
+  """TraceAnalyzer adds up the time spent in each stage of the I/O
+  traces the kvdo module writes to the kernel log.
+
+  A kvdo module with trace_recording on when a volume is started keeps
+  a trace of the places a sample of the volume's I/O passes through and
+  when. While the volume's tracing is on (the 'trace-on' message), a
+  small fraction of those traces are logged as the I/O finishes, as:
+
+    finishing kvio write data new @<kvio> parent <extent>/<count>
+      Trace[<n>!<function>:<line>@<sec>.<usec>,...]
+
+  The time from one place in a trace to the next is charged to the
+  first place, and so to the stage its function belongs to, judged by
+  the words of the function name: a stage claims a function if the
+  name contains one of the stage's phrases as whole words, so that
+  kvdoMapBio, for instance, is not taken for bio submission. Only
+  totals are kept, so any number of traces can be added in bounded
+  memory; the places in the code are a fixed set.
+
+  Attributes:
+    traces (int): the traces added
+    operations (dict): the traces added of each kind of I/O
+    stageTimes (dict): the microseconds charged to each stage
+    locationTimes (dict): the microseconds charged to each place, as
+      "function:line"
+    totalTime (int): the microseconds from the first to the last place
+      of every trace added
+  """
+  log = Logger.getLogger(Logger.myname + '.TraceAnalyzer')
+
+  # The stages, in the order they are reported and tried, with the
+  # phrases in the names of the functions belonging to each.
+  stages = [('hash', [('hash',)]),
+            ('dedupe query', [('albireo',), ('duplication',),
+                              ('dedupe', 'advice'), ('compare',),
+                              ('verify',), ('verified',)]),
+            ('compression', [('compress',), ('compression',), ('packer',),
+                             ('input', 'bin')]),
+            ('journal', [('journal',)]),
+            ('block map', [('block', 'map'), ('mapping',)]),
+            ('bio submission', [('submit',), ('read', 'vio'),
+                                ('write', 'vio'), ('flush', 'vio'),
+                                ('metadata', 'vio'), ('async', 'bio'),
+                                ('flush', 'bio'), ('bio', 'completion')]),
+            ('other', [])]
+
+  # A word of a camelCase name: an acronym, a capitalized or lower case
+  # word, or a number.
+  _word = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+  _finishing = re.compile(r"^finishing kvio (\w+) (\w+) (?:(\w+) )?.*Trace\[")
+  _record = re.compile(r"(\w+):(\d+)@(\d+)\.(\d{6})")
+
+  def __init__(self):
+    self.traces = 0
+    self.operations = {}
+    self.stageTimes = dict((stage, 0) for stage, unused_words in self.stages)
+    self.locationTimes = {}
+    self.totalTime = 0
+
+  def __str__(self):
+    return "TraceAnalyzer({0} traces)".format(self.traces)
+
+  def add(self, message):
+    """Adds the trace in a kernel log message, if there is one.
+
+    Arguments:
+      message (str): the message, without the module name in front
+    Returns:
+      True iff the message held a trace.
+    """
+    m = self._finishing.match(message)
+    if not m:
+      return False
+    records = [(function, int(line), int(sec) * 1000000 + int(usec))
+               for function, line, sec, usec
+               in self._record.findall(message[m.end():])]
+    if not records:
+      return False
+    # kvdo 1.4.2 logs writes as "read" and reads as "write".
+    operation = {'read': 'write', 'write': 'read'}.get(m.group(1),
+                                                        m.group(1))
+    operation += " " + m.group(2)
+    self.operations[operation] = self.operations.get(operation, 0) + 1
+    self.traces += 1
+    for (function, line, start), (unused_f, unused_l, end) in zip(records,
+                                                                  records[1:]):
+      elapsed = max(0, end - start)
+      self.stageTimes[self.stageOf(function)] += elapsed
+      location = "{0}:{1}".format(function, line)
+      self.locationTimes[location] = (self.locationTimes.get(location, 0)
+                                      + elapsed)
+    self.totalTime += max(0, records[-1][2] - records[0][2])
+    return True
+
+  @classmethod
+  def stageOf(cls, function):
+    """Returns the stage a function belongs to."""
+    words = tuple(word.lower() for word in cls._word.findall(function))
+    for stage, phrases in cls.stages:
+      for phrase in phrases:
+        if any(words[i:i + len(phrase)] == phrase
+               for i in range(len(words) - len(phrase) + 1)):
+          return stage
+    return 'other'
+
+  def breakdown(self):
+    """Returns the time charged to each stage.
+
+    Returns:
+      A list of (stage, milliseconds, share of all the time, mean
+      milliseconds per trace) tuples, in the order of stages.
+    """
+    result = []
+    for stage, unused_words in self.stages:
+      usec = self.stageTimes[stage]
+      result.append((stage, usec / 1000.0,
+                     float(usec) / self.totalTime if self.totalTime else 0.0,
+                     usec / 1000.0 / self.traces if self.traces else 0.0))
+    return result
+
+  def hotSpots(self, count=10):
+    """Returns the places in the code charged the most time.
+
+    Returns:
+      A list of up to count (place, milliseconds) tuples, the most
+      time first.
+    """
+    spots = sorted(self.locationTimes.items(), key=lambda item: -item[1])
+    return [(location, usec / 1000.0) for location, usec in spots[:count]]
+
+  def asDict(self):
+    """Returns the analysis as a dictionary."""
+    return {'traces': self.traces,
+            'operations': dict(self.operations),
+            'totalMs': self.totalTime / 1000.0,
+            'stages': dict((stage, {'ms': ms, 'share': share,
+                                    'meanMs': mean})
+                           for stage, ms, share, mean in self.breakdown()),
+            'hotSpots': [{'location': location, 'ms': ms}
+                         for location, ms in self.hotSpots()]}
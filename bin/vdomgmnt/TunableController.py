@@ -0,0 +1,365 @@
+"""
+  TunableController - adapts the kvdo tunables to the load on VDO volumes
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/TunableController.py#1 $
+
+"""
+from . import ArgumentError, CommandError, CommandLock, CommandLockTimeout
+from . import Configuration, Defaults, KernelModuleService, Logger
+from . import VdoStatistics
+import time
+
+
+class TunableController(object):
+  """TunableController is a feedback loop which adjusts the kvdo
+  tunables deduplication_timeout_interval and max_requests_active to
+  suit the load on a set of VDO volumes, keeping each within the bounds
+  it is given.
+
+  Each step reads the kernel statistics of every volume and looks at
+  the requests in progress against the volume's max_requests_active,
+  the deduplication queries outstanding, and the share of the
+  deduplication advice received since the last step which timed out:
+
+    - When many queries time out while a volume's requests are nearly
+      all in use, writes are stalled waiting for a slow index, so the
+      deduplication timeout is shortened to release them sooner.
+    - When many queries time out but no volume is short of requests,
+      the index is merely slow, so the timeout is lengthened to get
+      more of its advice.
+    - When almost no queries time out, the timeout is moved back
+      toward the value it had when the controller started.
+    - When a volume's requests are nearly all in use and its queries
+      are not timing out, it is short of requests, so its
+      max_requests_active is raised; when a volume has used less than
+      half of its requests for a whole window of steps, it is lowered
+      to save memory.
+
+  A change is made only after the same change has been called for on
+  several steps in a row, so that a brief burst does not swing the
+  settings back and forth, and every change is logged.
+
+  The kernel shares deduplication_timeout_interval among all volumes
+  and applies it at once. It reads max_requests_active only when a
+  volume is started, so new values are saved in the volume's
+  configuration and take effect the next time it is started. Until
+  then, a volume is judged against the limit it is actually running
+  with, which is the value in its configuration when it was started,
+  and its max_requests_active is not changed again.
+
+  Attributes:
+    names (list of str): the volumes being controlled
+    confFile (str): the configuration file holding the volumes
+    maxRequestsBounds (tuple of int): the lowest and highest
+      max_requests_active to set
+    timeoutBounds (tuple of int): the lowest and highest
+      deduplication_timeout_interval to set, in milliseconds
+    timeout (int): the current deduplication_timeout_interval
+    baseline (int): the deduplication_timeout_interval to return to
+      when queries are not timing out
+    maxRequests (dict): the max_requests_active each running volume
+      was started with
+    pending (dict): the max_requests_active saved for each volume which
+      will take effect when it is next started
+    _kms (KernelModuleService): the kernel module
+    _previous (dict): the last kernel statistics read for each volume
+    _windows (dict): for each volume, the steps taken in its current
+      window and the most requests seen in progress during it
+    _votes (dict): for each setting, the last change called for and
+      the number of steps in a row it has been called for
+  """
+  log = Logger.getLogger(Logger.myname + '.TunableController')
+
+  # A volume with this share of its requests in progress is saturated.
+  saturatedShare = 0.9
+  # A volume which never uses this share of its requests is oversized.
+  idleShare = 0.5
+  # The share of advice timing out which is too much, and which is
+  # little enough to stop compensating for.
+  highTimeouts = 0.05
+  lowTimeouts = 0.005
+  # Fewer queries than this in a step say nothing about the index.
+  minQueries = 100
+  # The factors by which a setting is raised or lowered in one change.
+  raiseFactor = 1.25
+  lowerFactor = 0.8
+  # The steps in a row a change must be called for before it is made.
+  hysteresis = 2
+  # The steps over which a volume must stay idle before it is shrunk.
+  idleWindow = 30
+
+  _timeoutTunable = 'deduplication_timeout_interval'
+
+  def __init__(self, names, confFile, maxRequestsBounds=None,
+               timeoutBounds=None):
+    """Constructs a TunableController.
+
+    Arguments:
+      names (list of str): the volumes to control
+      confFile (str): the configuration file holding the volumes
+      maxRequestsBounds (tuple of int): the bounds on
+        max_requests_active; the default is Defaults.maxRequestsActiveBounds
+      timeoutBounds (tuple of int): the bounds on
+        deduplication_timeout_interval; the default is
+        Defaults.deduplicationTimeoutIntervalBounds
+    """
+    self.names = list(names)
+    self.confFile = confFile
+    self.maxRequestsBounds = self._clamp(
+        'vdoMaxRequestsActive',
+        maxRequestsBounds or Defaults.maxRequestsActiveBounds)
+    self.timeoutBounds = self._clamp(
+        'vdoDeduplicationTimeoutInterval',
+        timeoutBounds or Defaults.deduplicationTimeoutIntervalBounds)
+    self._kms = KernelModuleService()
+    self.timeout = self._readTimeout()
+    self.baseline = self._bound(self.timeout, self.timeoutBounds)
+    # A volume already running is taken to have been started with its
+    # configuration as it is now.
+    self.maxRequests = {}
+    with Configuration(self.confFile, mustExist=True) as conf:
+      for name in self.names:
+        self.maxRequests[name] = conf.getVdo(name).maxRequestsActive
+    self.pending = {}
+    self._previous = {}
+    self._windows = {}
+    self._votes = {}
+
+  def __str__(self):
+    return "TunableController({0})".format(",".join(self.names))
+
+  def run(self, interval):
+    """Adjusts the tunables every interval seconds until interrupted.
+
+    Arguments:
+      interval (float): the seconds between steps
+    """
+    while True:
+      start = time.time()
+      self.step()
+      time.sleep(max(0, start + interval - time.time()))
+
+  def step(self):
+    """Reads the statistics of every volume and makes any changes they
+    call for.
+
+    Returns:
+      A list of the changes made, each a (setting, old, new) tuple
+      where the setting is either the timeout tunable name or a volume
+      name.
+    """
+    changes = []
+    # Someone may have changed the timeout since the last step.
+    self.timeout = self._readTimeout()
+    timeouts = 0
+    queries = 0
+    saturated = []
+    for name in self.names:
+      try:
+        stats = VdoStatistics(name).kernel()
+      except CommandError as ex:
+        # The volume is not running, so nothing is known about it.
+        self.log.debug(str(ex))
+        self._previous.pop(name, None)
+        self._windows.pop(name, None)
+        continue
+      previous = self._previous.get(name)
+      self._previous[name] = stats
+      restarted = (previous is None
+                   or stats.dedupeAdviceTimeouts
+                   < previous.dedupeAdviceTimeouts
+                   or stats.maxIORequests < previous.maxIORequests)
+      if restarted and name in self.pending:
+        # The volume has been started with the saved value.
+        self.maxRequests[name] = self.pending.pop(name)
+      # The kernel never has more requests in progress than its limit.
+      self.maxRequests[name] = max(self.maxRequests[name],
+                                   stats.maxIORequests)
+      steps, peak = self._windows.get(name, (0, 0))
+      self._windows[name] = (steps + 1, max(peak, stats.currIORequests))
+      if stats.currIORequests >= self.saturatedShare * self.maxRequests[name]:
+        saturated.append(name)
+      if restarted:
+        # The volume has just started, or has been restarted since the
+        # last step.
+        continue
+      answered = (stats.dedupeAdviceValid + stats.dedupeAdviceStale
+                  - previous.dedupeAdviceValid - previous.dedupeAdviceStale)
+      timedOut = stats.dedupeAdviceTimeouts - previous.dedupeAdviceTimeouts
+      timeouts += timedOut
+      queries += answered + timedOut
+      self.log.debug("{0}: {1} requests, {2} queries, {3}/{4} timed out"
+                     .format(name, stats.currIORequests,
+                             stats.currDedupeQueries, timedOut,
+                             answered + timedOut))
+
+    ratio = None
+    if queries >= self.minQueries:
+      ratio = float(timeouts) / queries
+    change = self._adjustTimeout(ratio, saturated)
+    if change:
+      changes.append(change)
+    for name in self.names:
+      change = self._adjustMaxRequests(name, ratio, name in saturated)
+      if change:
+        changes.append(change)
+    return changes
+
+  def _adjustTimeout(self, ratio, saturated):
+    """Changes the deduplication timeout if the advice timing out calls
+    for it.
+
+    Arguments:
+      ratio (float): the share of advice which timed out, or None if
+        there were too few queries to tell
+      saturated (list of str): the volumes short of requests
+    Returns:
+      The change made, or None.
+    """
+    target = None
+    if ratio is None:
+      pass
+    elif ratio > self.highTimeouts:
+      if saturated:
+        target = int(self.timeout * self.lowerFactor)
+        reason = _("{0:.1%} of deduplication advice timed out with {1}"
+                   " short of requests").format(ratio, ",".join(saturated))
+      else:
+        target = int(self.timeout * self.raiseFactor)
+        reason = _("{0:.1%} of deduplication advice timed out").format(ratio)
+    elif ratio < self.lowTimeouts and self.timeout != self.baseline:
+      if self.timeout > self.baseline:
+        target = max(self.baseline, int(self.timeout * self.lowerFactor))
+      else:
+        target = min(self.baseline, int(self.timeout * self.raiseFactor))
+      reason = _("deduplication advice is no longer timing out")
+    if target is not None:
+      target = self._bound(target, self.timeoutBounds)
+    if not self._vote(self._timeoutTunable, target, self.timeout):
+      return None
+    try:
+      self._kms.setTunable(self._timeoutTunable, target)
+    except CommandError as ex:
+      self.log.warn(_("Could not set {0} to {1}: {2}").format(
+          self._timeoutTunable, target, ex))
+      return None
+    self.log.announce(_("Changed {0} from {1} to {2} for all VDO volumes:"
+                        " {3}").format(self._timeoutTunable, self.timeout,
+                                       target, reason))
+    change = (self._timeoutTunable, self.timeout, target)
+    self.timeout = target
+    return change
+
+  def _adjustMaxRequests(self, name, ratio, saturated):
+    """Changes the max_requests_active of a volume if its use of its
+    requests calls for it.
+
+    Arguments:
+      name (str): the volume
+      ratio (float): the share of advice which timed out, or None if
+        there were too few queries to tell
+      saturated (bool): whether the volume is short of requests
+    Returns:
+      The change made, or None.
+    """
+    if name in self.pending:
+      # Nothing can be learned until the volume runs with the new value.
+      return None
+    current = self.maxRequests[name]
+    target = None
+    steps, peak = self._windows.get(name, (0, 0))
+    if steps >= self.idleWindow and peak >= self.idleShare * current:
+      # The volume was not idle; start watching it afresh.
+      del self._windows[name]
+    if name not in self._previous:
+      pass
+    elif saturated and (ratio is None or ratio < self.highTimeouts):
+      target = int(current * self.raiseFactor)
+      reason = _("nearly all requests are in use")
+    elif steps >= self.idleWindow and peak < self.idleShare * current:
+      target = int(current * self.lowerFactor)
+      reason = _("at most {0} requests were in use").format(peak)
+    if target is not None:
+      target = self._bound(target, self.maxRequestsBounds)
+    if not self._vote(name, target, current):
+      return None
+    try:
+      self._persist(name, target)
+    except (ArgumentError, CommandLockTimeout) as ex:
+      self.log.warn(_("Could not save max_requests_active of {0} for {1}:"
+                      " {2}").format(target, name, ex))
+      return None
+    self.log.announce(_("Changed max_requests_active of {0} from {1} to {2},"
+                        " effective when it is next started: {3}").format(
+        name, current, target, reason))
+    self.pending[name] = target
+    self._windows.pop(name, None)
+    return (name, current, target)
+
+  def _vote(self, setting, target, current):
+    """Records the change a step calls for to a setting, and decides
+    whether to make it.
+
+    Arguments:
+      setting (str): the setting
+      target (int): the value called for, or None
+      current (int): the current value
+    Returns:
+      True iff the setting should be changed to the target now.
+    """
+    if target is None or target == current:
+      self._votes.pop(setting, None)
+      return False
+    direction = target > current
+    lastDirection, count = self._votes.get(setting, (None, 0))
+    count = count + 1 if direction == lastDirection else 1
+    if count < self.hysteresis:
+      self._votes[setting] = (direction, count)
+      return False
+    self._votes.pop(setting, None)
+    return True
+
+  def _persist(self, name, maxRequests):
+    """Saves the max_requests_active of a volume in the configuration.
+
+    Exceptions:
+      ArgumentError: the configuration could not be read
+      CommandLockTimeout: the configuration could not be locked
+    """
+    with CommandLock(Defaults.lockFile):
+      with CommandLock.forVolume(name):
+        with Configuration(self.confFile, readonly=False) as conf:
+          vdo = conf.getVdo(name)
+          vdo.maxRequestsActive = maxRequests
+          conf.addVdo(name, vdo, True)
+          conf.persist()
+
+  def _readTimeout(self):
+    """Returns the deduplication_timeout_interval the kernel module is
+    using, or the default if it cannot be read."""
+    value = self._kms.getTunable(self._timeoutTunable)
+    try:
+      return int(value)
+    except (TypeError, ValueError):
+      return Defaults.deduplicationTimeoutInterval
+
+  @staticmethod
+  def _bound(value, bounds):
+    """Returns a value moved within a pair of bounds."""
+    low, high = bounds
+    return min(high, max(low, value))
+
+  @staticmethod
+  def _clamp(option, bounds):
+    """Returns a pair of bounds moved within the limits the kernel
+    module sets on a tunable.
+
+    Arguments:
+      option (str): the option setting the tunable, as in
+        Defaults.tunableLimits
+      bounds (tuple of int): the bounds
+    """
+    low, high = Defaults.tunableLimits[option]
+    return (min(high, max(low, bounds[0])), min(high, max(low, bounds[1])))
@@ -6,9 +6,8 @@
   $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/Utils.py#1 $
 
 """
-from . import Command, CommandError
+from . import Command, CommandError, Waiter
 import os
-import time
 
 
 class Utils(object):
@@ -27,34 +26,39 @@ class Utils(object):
   @classmethod
   def statusHelper(cls, commandList, tag):
     """Helper function for printing status summaries."""
-    cmd = Command(commandList)
-    s = cmd.runOutput()
+    cls.printStatus(Command(commandList).runOutput(), tag)
+
+  @staticmethod
+  def printStatus(s, tag):
+    """Prints the output of a status command, already run, as
+    statusHelper does."""
     if s:
       print(tag + s.strip().translate(None, "\""))
     else:
       print(tag + _("not available"))
 
   @classmethod
-  def killProcess(cls, pid, retries=20):
-    """Kills a process, trying kill -9 as a last resort."""
+  def killProcess(cls, pid, timeout=20):
+    """Kills a process, trying kill -9 as a last resort if it has not
+    exited within the timeout.
+
+    Returns:
+      True iff the process exited on its own after being asked to,
+      False if it had to be killed with kill -9.
+    Exceptions:
+      CommandError: the process could not be signalled
+    """
     cmd = Command(['kill', str(pid)])
-    try:
-      cmd()
-      if cmd.noRun:
-        return
-    except CommandError:
-      return
-
-    cmd = Command(['kill', '-0', str(pid)])
-    for unused_count in range(retries):
-      try:
-        cmd()
-        time.sleep(1)
-      except CommandError:
-        return
+    cmd()
+    if cmd.noRun:
+      return True
+
+    if Waiter.forExit(pid, timeout):
+      return True
 
     cmd = Command(['kill', '-9', str(pid)])
     cmd.noThrowCall()
+    return False
 
   @staticmethod
   def powerOfTwo(i):
@@ -85,6 +89,36 @@ class Utils(object):
         return testpath
     return None
 
+  @staticmethod
+  def threadCpuSeconds(prefix):
+    """Returns the CPU seconds used by each thread whose name starts
+    with a prefix, as counted in /proc.
+
+    Arguments:
+      prefix (str): The start of the thread names.
+    Returns:
+      A dictionary from thread name to seconds; the seconds of threads
+      sharing a name are added together.
+    """
+    ticks = {}
+    for pid in os.listdir('/proc'):
+      if not pid.isdigit():
+        continue
+      try:
+        with open(os.path.join('/proc', pid, 'stat')) as f:
+          stat = f.read()
+      except IOError:
+        # The process has exited.
+        continue
+      # The name is in parentheses and may itself contain spaces.
+      comm = stat[stat.find('(') + 1:stat.rfind(')')]
+      if comm.startswith(prefix):
+        fields = stat[stat.rfind(')') + 2:].split()
+        # utime and stime are fields 14 and 15 of the whole line.
+        ticks[comm] = ticks.get(comm, 0) + int(fields[11]) + int(fields[12])
+    clockTicks = float(os.sysconf('SC_CLK_TCK'))
+    return dict((comm, count / clockTicks) for comm, count in ticks.items())
+
   @staticmethod
   def abspathPath(path):
     """Takes a path or a colon-separated list of paths and makes
@@ -0,0 +1,157 @@
+"""
+  VdoMonitor - samples the statistics of a set of VDO volumes
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/VdoMonitor.py#1 $
+
+"""
+from . import CommandError, Logger, VdoStatistics
+from array import array
+import json
+import operator
+import time
+
+
+class VdoSample(object):
+  """The statistics of a set of VDO volumes at one moment.
+
+  Attributes:
+    available (list of bool): for each volume, True iff its statistics
+      could be read
+    time (float): when the sample was taken
+    values (array): the counters of every volume, one volume after
+      another in the order the volumes were given to the VdoMonitor;
+      the counters of unavailable volumes are zero
+  """
+  def __init__(self, available, when, values):
+    self.available = available
+    self.time = when
+    self.values = values
+
+
+class VdoMonitor(object):
+  """VdoMonitor reads the statistics of a set of VDO volumes and works
+  out how every counter changed between two samples.
+
+  The counters of all the volumes in a sample are kept in a single
+  flat array of doubles, so the deltas and per-second rates of every
+  counter of every volume are each computed in one pass over a pair of
+  arrays, and the cost of a sample grows only with the two ioctls
+  issued per volume.
+
+  Attributes:
+    names (list of str): the volumes being monitored
+    counterNames (list of str): the names of the counters kept for each
+      volume, as returned by VdoStatistics.counterNames()
+    _readers (list of VdoStatistics): the statistics reader of each volume
+  """
+  log = Logger.getLogger(Logger.myname + '.VdoMonitor')
+
+  # The (heading, counter) pairs shown by printTable.
+  tableColumns = [('read/s', 'biosIn.read'),
+                  ('write/s', 'biosIn.write'),
+                  ('discard/s', 'biosIn.discard'),
+                  ('valid/s', 'dedupeAdviceValid'),
+                  ('stale/s', 'dedupeAdviceStale'),
+                  ('timeout/s', 'dedupeAdviceTimeouts'),
+                  ('compress/s', 'compressedFragmentsWritten'),
+                  ('hits/s', 'readCache.hits')]
+
+  def __init__(self, names):
+    self.names = list(names)
+    self.counterNames = VdoStatistics.counterNames()
+    self._readers = [VdoStatistics(name) for name in self.names]
+
+  def __str__(self):
+    return "VdoMonitor({0})".format(",".join(self.names))
+
+  def sample(self):
+    """Reads the statistics of every volume.
+
+    Returns:
+      A VdoSample.
+    """
+    width = len(self.counterNames)
+    values = array('d')
+    available = []
+    for reader in self._readers:
+      try:
+        values.extend([value for unused_name, value in reader.counters()])
+        available.append(True)
+      except CommandError as ex:
+        self.log.debug(str(ex))
+        values.extend(array('d', [0]) * width)
+        available.append(False)
+    return VdoSample(available, time.time(), values)
+
+  def changes(self, previous, current):
+    """Computes the change in every counter between two samples.
+
+    Arguments:
+      previous (VdoSample): the earlier sample
+      current (VdoSample): the later sample
+    Returns:
+      A list with one entry per volume, in order, which is None if the
+      volume was not available in both samples and otherwise a tuple of
+      the volume's counter deltas and per-second rates as arrays
+      indexed like counterNames.
+    """
+    elapsed = current.time - previous.time
+    deltas = array('d', map(operator.sub, current.values, previous.values))
+    rates = array('d', map((1.0 / elapsed if elapsed > 0 else 0.0).__mul__,
+                           deltas))
+    width = len(self.counterNames)
+    result = []
+    for index in range(len(self.names)):
+      if previous.available[index] and current.available[index]:
+        start = index * width
+        result.append((deltas[start:start + width],
+                       rates[start:start + width]))
+      else:
+        result.append(None)
+    return result
+
+  def printTable(self, previous, current):
+    """Prints the rates of the counters in tableColumns for each volume
+    between two samples, as a table with one row per volume.
+
+    Arguments:
+      previous (VdoSample): the earlier sample
+      current (VdoSample): the later sample
+    """
+    columns = [self.counterNames.index(counter)
+               for unused_heading, counter in self.tableColumns]
+    nameWidth = max([len(name) for name in self.names] + [len(_("Device"))])
+    print(_("Device").ljust(nameWidth)
+          + "".join(" {0:>10}".format(heading)
+                    for heading, unused_counter in self.tableColumns))
+    for name, change in zip(self.names, self.changes(previous, current)):
+      if change is None:
+        fields = ["-"] * len(columns)
+      else:
+        fields = ["{0:.1f}".format(change[1][column]) for column in columns]
+      print(name.ljust(nameWidth)
+            + "".join(" {0:>10}".format(field) for field in fields))
+    print("")
+
+  def printJson(self, previous, current):
+    """Prints the deltas and rates of every counter of each volume
+    between two samples, as one JSON object per line. Volumes which
+    were not available in both samples are omitted.
+
+    Arguments:
+      previous (VdoSample): the earlier sample
+      current (VdoSample): the later sample
+    """
+    for name, change in zip(self.names, self.changes(previous, current)):
+      if change is None:
+        continue
+      deltas, rates = change
+      print(json.dumps({'name': name,
+                        'time': current.time,
+                        'interval': current.time - previous.time,
+                        'deltas': dict(zip(self.counterNames,
+                                           [int(delta) for delta in deltas])),
+                        'rates': dict(zip(self.counterNames, rates))},
+                       sort_keys=True))
@@ -6,9 +6,11 @@
   $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/VdoService.py#13 $
 
 """
-from . import Brand, Command, CommandError, Defaults
-from . import Extensions, KernelModuleService, Logger, LogicalVolume
-from . import Service, SizeString, Utils
+from . import Brand, Command, CommandError, CommandLock, CommandLockTimeout
+from . import Defaults, DeviceMapper, DeviceProbe
+from . import Extensions, KernelModuleService, Logger, RecoveryProgress
+from . import Service, SizeString, StorageDevice, SystemState, Utils
+from . import VdoStatistics, Waiter
 import os
 import re
 import time
@@ -20,16 +22,22 @@ class VdoService(Service):
   Attributes:
     blockMapCacheSize (sizeString): Memory allocated for block map pages.
     blockMapPageSize (int): Size of block map pages in bytes.
+    deduplicationTimeoutInterval (int): Milliseconds to wait for
+      deduplication advice before writing a block without it.
     enableCompression (bool): If True, compression should be
       enabled on this volume the next time the `start` method is run.
     enableDeduplication (bool): If True, deduplication should be
       enabled on this volume the next time the `start` method is run.
     enabled (bool): If True, should be started by the `start` method.
     logicalSize (SizeString): The logical size of this VDO volume.
-    logicalVolume (LogicalVolume): The logical volume used for backing
-      storage for this VDO volume.
+    logicalVolume (StorageDevice): The storage, normally a logical
+      volume, backing this VDO volume.
+    maxRequestsActive (int): The number of requests the volume may
+      have in progress at once.
     mdRaid5Mode (str): on or off.  Enables performance
       optimizations for MD RAID5 storage configurations.
+    minDeduplicationTimerInterval (int): The fewest milliseconds between
+      checks for timed-out deduplication requests.
     physicalSize (SizeString): The physical size of this VDO volume.
     readCacheSize (SizeString): The size of the read cache, in addition
       to a minimum set by the VDO software.
@@ -38,10 +46,24 @@ class VdoService(Service):
     reserveSize (SizeString): The size of the recovery reserve.
     server (str): Name of the AlbireoService object used by this
       VDO volume.
+    tuningNotes (str): Why mdRaid5Mode and writePolicy were chosen, if
+      they were chosen by probing the storage; otherwise ''.
     writePolicy (str): sync, async, or read_from_superblock.
   """
   log = Logger.getLogger(Logger.myname + '.Service.VdoService')
 
+  # The kvdo module tunables in sysfs, by attribute. The kernel reads
+  # max_requests_active only when a device is created; the
+  # deduplication timers are shared by all devices and take effect at
+  # once.
+  _tunables = {
+    'deduplicationTimeoutInterval': 'deduplication_timeout_interval',
+    'maxRequestsActive': 'max_requests_active',
+    'minDeduplicationTimerInterval': 'min_deduplication_timer_interval',
+  }
+  _liveTunables = ['deduplicationTimeoutInterval',
+                   'minDeduplicationTimerInterval']
+
   # Key values to use accessing a dictionary created via yaml-loading the
   # output of vdo status.
 
@@ -71,15 +93,22 @@ class VdoService(Service):
                                     Defaults.blockMapCacheSize)
     self.blockMapPageSize = kw.get('blockMapPageSize',
                                    Defaults.blockMapPageSize)
+    self.deduplicationTimeoutInterval = kw.get(
+        'deduplicationTimeoutInterval', Defaults.deduplicationTimeoutInterval)
     if kw.get('enable512e', Defaults.enable512e):
       self.logicalBlockSize = 512
     self.enableCompression = kw.get('enableCompression', False)
     self.enableDeduplication = kw.get('enableDeduplication', True)
     self.enabled = kw.get('enabled', True)
     self.logicalSize = kw.get('logicalSize', '')
+    self.maxRequestsActive = kw.get('maxRequestsActive',
+                                    Defaults.maxRequestsActive)
+    self.minDeduplicationTimerInterval = kw.get(
+        'minDeduplicationTimerInterval',
+        Defaults.minDeduplicationTimerInterval)
     logicalVolumePath = kw.get('logicalVolumePath', '')
     if logicalVolumePath:
-      self.logicalVolume = LogicalVolume(logicalVolumePath)
+      self.logicalVolume = StorageDevice.fromSpec(logicalVolumePath)
       self.logicalVolume.maximumSize = SizeString("256T")
     else:
       self.logicalVolume = None
@@ -92,11 +121,14 @@ class VdoService(Service):
                                     Defaults.recoverySweepRate)
     self.reserveSize = kw.get('reserveSize', Defaults.reserveSize)
     self.server = kw.get('server', '')
+    self.tuningNotes = kw.get('tuningNotes', '')
     self.writePolicy = kw.get('writePolicy', Defaults.configuredWritePolicy)
 
   def __setattr__(self, name, value):
     if isinstance(value, str):
-      if name in ['blockMapPageSize', 'logicalBlockSize', 'physicalBlockSize',
+      if name in ['blockMapPageSize', 'deduplicationTimeoutInterval',
+                  'logicalBlockSize', 'maxRequestsActive',
+                  'minDeduplicationTimerInterval', 'physicalBlockSize',
                   'recoveryScanRate', 'recoverySweepRate']:
         object.__setattr__(self, name, int(value))
       elif name in ['enableCompression', 'enableDeduplication', 'enabled']:
@@ -105,7 +137,7 @@ class VdoService(Service):
                     'readCacheSize', 'reserveSize']:
         object.__setattr__(self, name, SizeString(value))
       elif name in ['logicalVolumePath']:
-        self.logicalVolume = LogicalVolume(value)
+        self.logicalVolume = StorageDevice.fromSpec(value)
         self.logicalVolume.maximumSize = SizeString("256T")
       else:
         object.__setattr__(self, name, value)
@@ -114,9 +146,11 @@ class VdoService(Service):
 
   def __getattr__(self, name):
     # Fake this attribute so we don't have to make incompatible
-    # changes to the configuration file format.
+    # changes to the configuration file format. The value is the
+    # specification of the backing storage, which for a logical volume
+    # is just its path.
     if name in ['logicalVolumePath']:
-      return self.logicalVolume.fullpath()
+      return str(self.logicalVolume)
     else:
       raise AttributeError("'{obj}' object has no attribute '{attr}'".format(
           obj="VdoService", attr=name))
@@ -131,8 +165,13 @@ class VdoService(Service):
     lst.append(")")
     return "".join(lst)
 
-  def create(self):
-    """Creates a VDO target."""
+  def create(self, autoTune=False):
+    """Creates a VDO target.
+
+    Arguments:
+      autoTune (bool): if True, choose mdRaid5Mode and writePolicy by
+        probing the new backing storage before formatting it
+    """
     self.log.announce(_("Creating VDO device {0}").format(self.getName()))
     try:
       self.physicalSize = self.logicalVolume.create(self.physicalBlockSize,
@@ -142,6 +181,10 @@ class VdoService(Service):
           lv=self.logicalVolume, ex=ex))
       return self.ERROR
 
+    if autoTune:
+      # Nothing is on the storage yet, so the probe may write to it.
+      self.tune(benchmark=True)
+
     if not self.logicalSize:
       self.logicalSize = self.physicalSize
     self.logicalSize.round(self.physicalBlockSize)
@@ -153,6 +196,24 @@ class VdoService(Service):
       self.logicalVolume.remove(noThrow=True)
       return self.ERROR
 
+  def tune(self, benchmark=False):
+    """Chooses mdRaid5Mode and writePolicy by probing the backing
+    storage (see DeviceProbe), recording the reasons in tuningNotes.
+
+    Arguments:
+      benchmark (bool): if True, also time flushes on the storage,
+        overwriting the start of it
+    Returns:
+      The DeviceProbe.
+    """
+    probe = DeviceProbe(self.logicalVolume.fullpath()).probe(benchmark)
+    self.mdRaid5Mode = probe.mdRaid5Mode
+    self.writePolicy = probe.writePolicy
+    self.tuningNotes = probe.notes()
+    for reason in probe.reasons:
+      self.log.info(_("{0}: {1}").format(self.getName(), reason))
+    return probe
+
   def remove(self):
     """Removes a VDO target."""
     self.log.announce(_("Removing VDO volume {0}").format(self.getName()))
@@ -202,7 +263,9 @@ class VdoService(Service):
         except CommandError:
           self.log.error(_("Device {0} not read-only").format(self.getName()))
           return self.ERROR
-      dmsetupCmd()
+      with self._lockTunables(kms):
+        dmsetupCmd()
+      self._applyTunables(kms, self._liveTunables)
       try:
         if self.enableCompression:
           Extensions.extensionPoint(self, "Compression", "on")
@@ -211,11 +274,75 @@ class VdoService(Service):
             self.getName()))
         return self.ERROR
       return self.SUCCESS
+    except CommandLockTimeout as ex:
+      self.log.error(_("Could not start {0}: {1!s}").format(self.getName(),
+                                                           ex))
+      return self.ERROR
     except CommandError:
       self.log.error(_("Could not set up device mapper for {0}").format(
           self.getName()))
       return self.ERROR
 
+  def _lockTunables(self, kms):
+    """Takes the tunables lock shared, with max_requests_active set to
+    this volume's value, so that this volume can be created with it
+    while other volumes wanting the same value are created at once.
+    The lock is only taken exclusive, briefly, to change the value.
+    If the value cannot be set, the volume is created with whatever
+    value the module has.
+
+    Arguments:
+      kms (KernelModuleService): the kernel module
+    Returns:
+      The CommandLock, held shared.
+    """
+    lock = CommandLock.forTunables()
+    lock.lock()
+    if Command.noRunMode():
+      self._applyTunables(kms, ['maxRequestsActive'])
+      return lock
+    tunable = self._tunables['maxRequestsActive']
+    value = str(self.maxRequestsActive)
+    # Another process may change the value while the lock is changed
+    # back to shared, so it is checked again each time.
+    while kms.getTunable(tunable) != value:
+      lock.relock(False)
+      self._applyTunables(kms, ['maxRequestsActive'])
+      applied = kms.getTunable(tunable) == value
+      lock.relock(True)
+      if not applied:
+        break
+    return lock
+
+  def applyLiveTunables(self):
+    """Applies the tunables which take effect at once to the kernel
+    module; see _applyTunables."""
+    self._applyTunables(KernelModuleService(), self._liveTunables)
+
+  def _applyTunables(self, kms, names):
+    """Sets kernel module tunables to the values configured for this
+    volume. A value the kernel rejects is logged and otherwise ignored.
+
+    Arguments:
+      kms (KernelModuleService): the kernel module
+      names (list of str): the attributes holding the tunables to set
+    """
+    for name in names:
+      tunable = self._tunables[name]
+      value = getattr(self, name)
+      if name in self._liveTunables and not Command.noRunMode():
+        current = kms.getTunable(tunable)
+        if current == str(value):
+          continue
+        if current is not None:
+          self.log.info(_("Changing {0} from {1} to {2} for all VDO volumes"
+                          ).format(tunable, current, value))
+      try:
+        kms.setTunable(tunable, value)
+      except CommandError as ex:
+        self.log.warn(_("Could not set {0} to {1} for {2}: {3}").format(
+            tunable, value, self.getName(), ex))
+
   def stop(self, force=False):
     """Stops the VDO target mapper. In noRun mode, assumes the service
     is already running."""
@@ -234,7 +361,9 @@ class VdoService(Service):
             self.getName()))
         return self.ERROR
 
-    time.sleep(1)
+    # Let udev finish with the device (after an unmount, for instance)
+    # so it is not busy when removed.
+    Waiter.settle()
     try:
       dmsetupCmd = Command(["dmsetup", "remove", self.getName()])
       dmsetupCmd()
@@ -245,23 +374,49 @@ class VdoService(Service):
       return self.ERROR
 
   def running(self):
-    """Returns True if the VDO service is available."""
-    cmd = Command(["dmsetup", "status", self.getName()])
-    try:
-      cmd()
+    """Returns True if the VDO service is available. In noRun mode,
+    always returns True."""
+    if Command.noRunMode():
       return True
-    except CommandError:
-      return False
+    return SystemState.deviceStatus(self.getName()) is not None
+
+  def recoveryProgress(self, previous=None):
+    """Returns the state of the recovery of this volume.
+
+    Arguments:
+      previous (RecoveryProgress): an earlier state of this volume's
+        recovery, from which to estimate its rate
+    Returns:
+      A RecoveryProgress.
+    """
+    try:
+      stats = VdoStatistics(self.getName()).dedupe()
+      table = DeviceMapper.table(self.getName())
+    except CommandError as ex:
+      self.log.debug(str(ex))
+      return RecoveryProgress(RecoveryProgress.STOPPED)
+    if not stats.inRecoveryMode:
+      return RecoveryProgress(RecoveryProgress.NORMAL)
+    scanRate = sweepRate = None
+    # The parameters are as in the table built by start().
+    parameters = table[0][3].split() if table else []
+    if len(parameters) > 5:
+      scanRate, sweepRate = int(parameters[4]), int(parameters[5])
+    return RecoveryProgress(RecoveryProgress.RECOVERING,
+                            stats.recoveryPercentage, scanRate, sweepRate,
+                            previous)
 
   @staticmethod
   def getKeys():
     """Returns the list of standard attributes for this object."""
     return ["blockMapCacheSize", "blockMapPageSize",
-            "enableCompression", "enableDeduplication", "enabled",
-            "logicalBlockSize", "logicalSize", "logicalVolumePath",
-            "mdRaid5Mode", "physicalBlockSize", "physicalSize",
-            "readCacheSize", "recoveryScanRate", "recoverySweepRate",
-            "reserveSize", "server", "writePolicy"]
+            "deduplicationTimeoutInterval", "enableCompression",
+            "enableDeduplication", "enabled", "logicalBlockSize",
+            "logicalSize", "logicalVolumePath", "maxRequestsActive",
+            "mdRaid5Mode", "minDeduplicationTimerInterval",
+            "physicalBlockSize", "physicalSize", "readCacheSize",
+            "recoveryScanRate", "recoverySweepRate", "reserveSize",
+            "server", "tuningNotes", "writePolicy"]
 
   def status(self, prefix):
     """Prints the status of this object to stdout."""
@@ -284,6 +439,12 @@ class VdoService(Service):
     print(prefix + _("  Recovery sweep rate: {0}").format(
         self.recoverySweepRate))
     print(prefix + _("  Recovery reserve size: {0}").format(self.reserveSize))
+    print(prefix + _("  Max requests active: {0}").format(
+        self.maxRequestsActive))
+    print(prefix + _("  Deduplication timeout interval: {0} ms").format(
+        self.deduplicationTimeoutInterval))
+    print(prefix + _("  Min deduplication timer interval: {0} ms").format(
+        self.minDeduplicationTimerInterval))
     print(prefix + "  {0}: {1}".format(self.vdoCompressionEnabledKey,
                                        self.enableCompression))
     print(prefix + "  {0}: {1}".format(self.vdoDeduplicationEnabledKey,
@@ -300,13 +461,23 @@ class VdoService(Service):
     print(prefix + _("  Server: {0}").format(self.server))
     print(prefix + "  {0}: {1}".format(self.vdoWritePolicyKey,
                                        self.writePolicy))
+    if self.tuningNotes:
+      print(prefix + _("  Tuning notes: {0}").format(self.tuningNotes))
     if os.getuid() == 0:
       print(prefix + _("  System volume group info: {0}").format(
           self.logicalVolume.vgStatus()))
       print(prefix + _("  System logical volume info: {0}").format(
           self.logicalVolume.status()))
-      Utils.statusHelper(['dmsetup', 'status', self.getName()],
-                         prefix + _("  Device mapper status: "))
+      Utils.printStatus(SystemState.deviceStatus(self.getName()),
+                        prefix + _("  Device mapper status: "))
+      try:
+        statistics = VdoStatistics(self.getName()).describe()
+        print(prefix + "  {0}: ".format(self.vdoStatisticsKey))
+        for label, value in statistics:
+          print(prefix + "    {0:<32}: {1}".format(label, value))
+        return 0
+      except CommandError as ex:
+        self.log.debug("Reading statistics with vdoStats: {0}".format(ex))
       try:
         vdoStatsBinary = Brand.map('vdoStats')
         cmd = Command([vdoStatsBinary, '--verbose', self.getPath()])
@@ -337,8 +508,7 @@ class VdoService(Service):
       return 1
 
     try:
-      suspendCmd = Command(["dmsetup", "suspend", self.getName()])
-      suspendCmd()
+      DeviceMapper.suspend(self.getName())
     except CommandError as ex:
       self.log.error(_("Can't suspend VDO volume {0}: {1!s}").format(
           self.getName(), ex))
@@ -348,19 +518,17 @@ class VdoService(Service):
     retval = 1
     logicalBlocks = self.logicalSize.toBytes() / int(self.physicalBlockSize)
     physicalBlocks = newLvSize.toBytes() / int(self.physicalBlockSize)
-    reconfigCmd = Command(['dmsetup', 'message', self.getName(), '0',
-                           'reconfigure', str(self.physicalBlockSize),
-                           str(logicalBlocks), str(physicalBlocks)])
     try:
-      reconfigCmd()
+      DeviceMapper.message(self.getName(), 0, 'reconfigure',
+                           self.physicalBlockSize, logicalBlocks,
+                           physicalBlocks)
       self.physicalSize = newLvSize
       retval = 0
     except CommandError as (msg):
       self.log.error(msg)
     finally:
-      resumeCmd = Command(["dmsetup", "resume", self.getName()])
       try:
-        resumeCmd()
+        DeviceMapper.resume(self.getName())
       except CommandError:
         self.log.error(_("Could not resume {0}").format(self.getName()))
         return 1
@@ -0,0 +1,335 @@
+"""
+  VdoStatistics - reads VDO statistics directly from the kernel
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/VdoStatistics.py#1 $
+
+"""
+from . import CommandError, Logger
+import array
+import ctypes
+import fcntl
+import os
+
+
+class _Statistics(ctypes.Structure):
+  """Superclass for the statistics structures returned by the kvdo
+  ioctls. The layouts must match the kernel's statistics.h and ioctl.h.
+  """
+  def items(self, prefix=''):
+    """Returns the numeric fields of this structure, including those of
+    nested structures, as a list of (name, value) tuples. Nested field
+    names are joined with dots (for example, 'biosIn.read'); strings
+    and arrays are omitted.
+
+    Arguments:
+      prefix (str): a string prepended to each name
+    """
+    result = []
+    for name, ctype in self._fields_:
+      value = getattr(self, name)
+      if isinstance(value, _Statistics):
+        result.extend(value.items(prefix + name + '.'))
+      elif isinstance(value, (int, long, bool)) and ctype is not ctypes.c_char:
+        result.append((prefix + name, int(value)))
+    return result
+
+
+class BioStats(_Statistics):
+  """Counts of bios of each kind."""
+  _fields_ = [('read', ctypes.c_ulong),
+              ('write', ctypes.c_ulong),
+              ('prio', ctypes.c_ulong),
+              ('discard', ctypes.c_ulong),
+              ('fua', ctypes.c_ulong),
+              ('flush', ctypes.c_ulong),
+              ('rahead', ctypes.c_ulong)]
+
+
+class ReadCacheStats(_Statistics):
+  """Read cache accesses and hits."""
+  _fields_ = [('accesses', ctypes.c_uint64),
+              ('hits', ctypes.c_uint64)]
+
+
+class KernelStatistics(_Statistics):
+  """Statistics kept by the kernel layer (GET_KERNEL_STATS)."""
+  _fields_ = [('currIORequests', ctypes.c_ulong),
+              ('maxIORequests', ctypes.c_ulong),
+              ('currDedupeQueries', ctypes.c_ulong),
+              ('maxDedupeQueries', ctypes.c_ulong),
+              ('dedupeAdviceValid', ctypes.c_ulong),
+              ('dedupeAdviceStale', ctypes.c_ulong),
+              ('dedupeAdviceTimeouts', ctypes.c_ulong),
+              ('logicalBlockSize', ctypes.c_ulong),
+              ('biosIn', BioStats),
+              ('biosInPartial', BioStats),
+              ('biosOut', BioStats),
+              ('biosMeta', BioStats),
+              ('biosJournal', BioStats),
+              ('biosPageCache', BioStats),
+              ('biosOutCompleted', BioStats),
+              ('biosMetaCompleted', BioStats),
+              ('biosJournalCompleted', BioStats),
+              ('biosPageCacheCompleted', BioStats),
+              ('biosAcknowledged', BioStats),
+              ('biosAcknowledgedPartial', BioStats),
+              ('biosIoctlIn', BioStats),
+              ('readCache', ReadCacheStats)]
+
+
+class CommitStatistics(_Statistics):
+  """Started, written, and committed totals for a write pipeline step."""
+  _fields_ = [('started', ctypes.c_uint64),
+              ('written', ctypes.c_uint64),
+              ('committed', ctypes.c_uint64)]
+
+
+class RecoveryJournalStatistics(_Statistics):
+  """Statistics for the recovery journal."""
+  _fields_ = [('tailFull', ctypes.c_uint64),
+              ('diskFull', ctypes.c_uint64),
+              ('entries', CommitStatistics),
+              ('blocks', CommitStatistics)]
+
+
+class VDOConfig(_Statistics):
+  """The configuration of a VDO, as recorded in its super block."""
+  _pack_ = 1
+  _fields_ = [('pageSize', ctypes.c_uint32),
+              ('logicalBlocks', ctypes.c_uint64),
+              ('physicalBlocks', ctypes.c_uint64),
+              ('blockMapCacheSize', ctypes.c_uint32),
+              ('slabSize', ctypes.c_uint64),
+              ('recoveryJournalSize', ctypes.c_uint64),
+              ('reservedBlocks', ctypes.c_uint64),
+              ('writePolicy', ctypes.c_int)]
+
+
+class VDOStatistics(_Statistics):
+  """Statistics kept by the VDO itself (GET_DEDUPE_STATS)."""
+  _fields_ = [('dataBlocksUsed', ctypes.c_uint64),
+              ('overheadBlocksUsed', ctypes.c_uint64),
+              ('logicalBlocksUsed', ctypes.c_uint64),
+              ('reservedBlocks', ctypes.c_uint64),
+              ('mode', ctypes.c_char * 15),
+              ('readOnlyRecoveries', ctypes.c_uint64),
+              ('inRecoveryMode', ctypes.c_bool),
+              ('recoveryPercentage', ctypes.c_uint8),
+              ('writePolicy', ctypes.c_char * 15),
+              ('config', VDOConfig),
+              ('blockSize', ctypes.c_uint64),
+              ('journal', RecoveryJournalStatistics),
+              ('compressedFragmentsWritten', ctypes.c_uint64),
+              ('compressedBlocksWritten', ctypes.c_uint64),
+              ('compressedFragmentsInPacker', ctypes.c_uint64)]
+
+
+class SubQueueStat(_Statistics):
+  """Statistics for one kind of work item on a work queue."""
+  _fields_ = [('work', ctypes.c_char * 20),
+              ('priority', ctypes.c_uint),
+              ('pending', ctypes.c_uint),
+              ('processed', ctypes.c_uint64),
+              ('timedOut', ctypes.c_uint64)]
+
+
+class QueueStatistics(_Statistics):
+  """Statistics for one work queue."""
+  # NUM_WORK_QUEUE_ITEM_STATS in vdoCommon.h
+  workItemStatCount = 12
+  _fields_ = [('name', ctypes.c_char * 16),
+              ('idle', ctypes.c_bool),
+              ('pending', ctypes.c_uint),
+              ('processed', ctypes.c_uint64),
+              ('timedOut', ctypes.c_uint64),
+              ('waits', ctypes.c_uint64),
+              ('workStats', SubQueueStat * workItemStatCount)]
+
+
+class AllQueueStatistics(_Statistics):
+  """Statistics for all the work queues (GET_QUEUE_STATS)."""
+  # NUM_QUEUE_STATS in vdoCommon.h: request, bio, dedupe, and cpu
+  queueCount = 4
+  _fields_ = [('queueStats', QueueStatistics * queueCount)]
+
+
+class VdoStatistics(object):
+  """VdoStatistics reads the statistics of a running VDO device using
+  the ioctls provided by the kvdo module, without running vdoStats.
+
+  Each call issues one ioctl straight into a freshly allocated buffer
+  and returns a structure that is a view onto that buffer, so nothing
+  is parsed or copied; fields are decoded only when accessed.
+
+  Attributes:
+    path (str): the path of the VDO device
+  """
+  log = Logger.getLogger(Logger.myname + '.VdoStatistics')
+
+  # The ioctl numbers from ioctl.h, _IOR(0xDE, n, <structure>).
+  _ioctlType = 0xDE
+  _GET_DEDUPE_STATS = (0, VDOStatistics)
+  _GET_KERNEL_STATS = (1, KernelStatistics)
+  _GET_QUEUE_STATS = (2, AllQueueStatistics)
+
+  # The labels used by vdoStats --verbose for each statistic we report,
+  # in the order it reports them.
+  _bioLabels = [('biosIn', 'in'), ('biosInPartial', 'in partial'),
+                ('biosOut', 'out'), ('biosMeta', 'meta'),
+                ('biosJournal', 'journal'), ('biosPageCache', 'page cache'),
+                ('biosOutCompleted', 'out completed'),
+                ('biosMetaCompleted', 'meta completed'),
+                ('biosJournalCompleted', 'journal completed'),
+                ('biosPageCacheCompleted', 'page cache completed'),
+                ('biosAcknowledged', 'acknowledged'),
+                ('biosAcknowledgedPartial', 'acknowledged partial')]
+
+  def __init__(self, name):
+    self.path = os.path.join('/dev/mapper', name)
+
+  def __str__(self):
+    return "VdoStatistics(\"{0}\")".format(self.path)
+
+  def dedupe(self):
+    """Returns the VDOStatistics of the device.
+
+    Exceptions:
+      CommandError: the statistics could not be read
+    """
+    return self._read(self._GET_DEDUPE_STATS)
+
+  def kernel(self):
+    """Returns the KernelStatistics of the device.
+
+    Exceptions:
+      CommandError: the statistics could not be read
+    """
+    return self._read(self._GET_KERNEL_STATS)
+
+  def queues(self):
+    """Returns the AllQueueStatistics of the device.
+
+    Exceptions:
+      CommandError: the statistics could not be read
+    """
+    return self._read(self._GET_QUEUE_STATS)
+
+  def counters(self):
+    """Returns every numeric VDO and kernel statistic of the device as a
+    list of (name, value) tuples, in a fixed order. VDO statistics
+    have names like 'dataBlocksUsed'; kernel statistics have names
+    like 'biosIn.read'.
+
+    Exceptions:
+      CommandError: the statistics could not be read
+    """
+    return self.dedupe().items() + self.kernel().items()
+
+  @staticmethod
+  def counterNames():
+    """Returns the names of the statistics returned by counters(), in
+    the same order."""
+    return [name for name, unused_value
+            in VDOStatistics().items() + KernelStatistics().items()]
+
+  def describe(self):
+    """Returns the statistics of the device as a list of (label, value)
+    tuples using the labels and derived values of vdoStats --verbose.
+
+    Exceptions:
+      CommandError: the statistics could not be read
+    """
+    stats = self.dedupe()
+    kernel = self.kernel()
+    usedBlocks = stats.dataBlocksUsed + stats.overheadBlocksUsed
+    physicalBlocks = stats.config.physicalBlocks
+    result = [('data blocks used', stats.dataBlocksUsed),
+              ('overhead blocks used', stats.overheadBlocksUsed),
+              ('logical blocks used', stats.logicalBlocksUsed),
+              ('reserved blocks', stats.reservedBlocks),
+              ('physical blocks', physicalBlocks),
+              ('logical blocks', stats.config.logicalBlocks),
+              ('active write policy', stats.writePolicy),
+              ('recovery reserve capacity', stats.config.reservedBlocks),
+              ('block size', stats.blockSize),
+              ('recovered count', stats.readOnlyRecoveries),
+              ('operating mode', stats.mode),
+              ('recovery progress (%)', self._recoveryProgress(stats)),
+              ('compressed fragments written',
+               stats.compressedFragmentsWritten),
+              ('compressed blocks written', stats.compressedBlocksWritten),
+              ('compressed fragments in packer',
+               stats.compressedFragmentsInPacker),
+              ('journal tail full count', stats.journal.tailFull),
+              ('journal disk full count', stats.journal.diskFull)]
+    for kind in ['blocks', 'entries']:
+      commit = getattr(stats.journal, kind)
+      result.extend([('journal {0} batching'.format(kind),
+                      commit.started - commit.written),
+                     ('journal {0} writing'.format(kind),
+                      commit.written - commit.committed),
+                     ('journal {0} committed'.format(kind),
+                      commit.committed)])
+    result.extend([('current bios in progress', kernel.currIORequests),
+                   ('maximum bios in progress', kernel.maxIORequests),
+                   ('current dedupe queries', kernel.currDedupeQueries),
+                   ('maximum dedupe queries', kernel.maxDedupeQueries),
+                   ('dedupe advice valid', kernel.dedupeAdviceValid),
+                   ('dedupe advice stale', kernel.dedupeAdviceStale),
+                   ('dedupe advice timeouts', kernel.dedupeAdviceTimeouts)])
+    for field, label in self._bioLabels:
+      bios = getattr(kernel, field)
+      for name, value in bios.items():
+        result.append(('bios {0} {1}'.format(label, name), value))
+    result.extend([('read cache accesses', kernel.readCache.accesses),
+                   ('read cache hits', kernel.readCache.hits)])
+    if physicalBlocks:
+      result.append(('used percent', 100 * usedBlocks // physicalBlocks))
+    if stats.logicalBlocksUsed:
+      result.append(('saving percent',
+                     100 * (stats.logicalBlocksUsed - stats.dataBlocksUsed)
+                     // stats.logicalBlocksUsed))
+    return result
+
+  @staticmethod
+  def _recoveryProgress(stats):
+    """Returns the recovery progress for display."""
+    if stats.inRecoveryMode:
+      return stats.recoveryPercentage
+    return 'N/A'
+
+  def _read(self, request):
+    """Issues a statistics ioctl.
+
+    Arguments:
+      request (tuple): the ioctl number and the structure it returns
+    Returns:
+      An instance of the structure, backed by the buffer the kernel
+      wrote into.
+    Exceptions:
+      CommandError: the device could not be opened or the ioctl failed
+    """
+    number, structure = request
+    size = ctypes.sizeof(structure)
+    ioctl = (2 << 30) | (size << 16) | (self._ioctlType << 8) | number
+    if ioctl > 0x7fffffff:
+      # fcntl.ioctl takes a signed int.
+      ioctl -= 1 << 32
+    # fcntl.ioctl only fills in a mutable buffer it can write to
+    # directly, which a bytearray is not in Python 2.
+    buf = array.array('B', '\0' * size)
+    try:
+      fd = os.open(self.path, os.O_RDONLY)
+    except OSError as ex:
+      raise CommandError(_("open failure on {0}: {1}").format(self.path,
+                                                              ex.strerror))
+    try:
+      fcntl.ioctl(fd, ioctl, buf, True)
+    except IOError as ex:
+      raise CommandError(_("ioctl failure on {0}: {1}").format(self.path,
+                                                               ex.strerror))
+    finally:
+      os.close(fd)
+    return structure.from_buffer(buf)
@@ -0,0 +1,324 @@
+"""
+  VolumeWatchdog - watches VDO volumes for failures and recovers from them
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/VolumeWatchdog.py#1 $
+
+"""
+from . import CommandError, CommandLock, CommandLockTimeout, Configuration
+from . import Defaults, DeviceMapper, Logger, Service, VdoStatistics
+import os
+import time
+
+
+class VolumeWatchdog(object):
+  """VolumeWatchdog checks a set of VDO volumes at intervals for three
+  problems:
+
+    - the volume has gone into read-only mode after an error, as
+      reported in its operating mode;
+    - the Albireo server of a volume using deduplication has died; and
+    - the volume's connection to its index is offline although the
+      server is running.
+
+  Each check costs a statistics ioctl and a status ioctl on the device
+  and a look at the server's pid file. A problem is logged as an error
+  when it is first seen, and logged again when it clears. The index is
+  briefly offline whenever a volume connects to it, so it is only a
+  problem once it has been offline for several checks in a row.
+
+  The configuration is read again for every check, so a volume whose
+  deduplication has been disabled is no longer expected to have a
+  server. A server stopped by this program unmounts its index, as the
+  stop command does when it cannot remove a volume which is in use, so
+  a server is only taken to have died if its index is still mounted.
+  Before any recovery, the volume is read and checked again under its
+  lock, and it is only recovered if it still has the problem, since
+  another command may have dealt with it in the meantime.
+
+  What else is done depends on the policy. Each policy also does what
+  the ones before it do:
+
+    ALERT: nothing more.
+    RECONNECT: restart a server which is not running, having the
+      volume reconnect once the index is ready, and reconnect a volume
+      to a running server.
+    REBUILD: stop a read-only volume and start it with a forced
+      rebuild of its metadata, but only within the maintenance window,
+      and only if nothing is mounted on it.
+
+  A recovery which does not clear the problem is retried, after a
+  delay which doubles with each attempt, so a problem which cannot be
+  fixed is not attacked over and over. Volumes which are not running
+  are left alone, since they were presumably stopped on purpose.
+
+  Attributes:
+    names (list of str): the volumes being watched
+    confFile (str): the configuration file holding the volumes
+    policy (str): how far to go to recover, one of policies
+    window (tuple of int): the start and end of the daily maintenance
+      window, in minutes after midnight local time, or None
+    _seen (dict): for each volume, the number of checks in a row each
+      problem has been seen in
+    _attempts (dict): for each (volume, problem) being recovered from,
+      the time of the last attempt and the number of attempts
+    _scheduled (set): the read-only volumes waiting for the
+      maintenance window
+  """
+  log = Logger.getLogger(Logger.myname + '.VolumeWatchdog')
+
+  ALERT = 'alert'
+  RECONNECT = 'reconnect'
+  REBUILD = 'rebuild'
+  policies = [ALERT, RECONNECT, REBUILD]
+
+  # The problems, as they are logged.
+  READ_ONLY = 'read-only'
+  SERVER_DOWN = 'albserver not running'
+  INDEX_OFFLINE = 'index offline'
+
+  # The operating mode of a volume which has gone read-only.
+  _readOnlyMode = 'read-only'
+  # The checks in a row the index must be offline to be a problem.
+  offlineChecks = 3
+  # The seconds to wait before the first retry of a recovery, and the
+  # most to wait before any retry.
+  retryDelay = 60
+  maxRetryDelay = 3600
+
+  def __init__(self, names, confFile, policy=ALERT, window=None):
+    """Constructs a VolumeWatchdog.
+
+    Arguments:
+      names (list of str): the volumes to watch
+      confFile (str): the configuration file holding the volumes
+      policy (str): how far to go to recover, one of policies
+      window (tuple of int): the daily maintenance window, in minutes
+        after midnight, within which a volume may be rebuilt
+    """
+    self.names = list(names)
+    self.confFile = confFile
+    self.policy = policy
+    self.window = window
+    self._seen = {}
+    self._attempts = {}
+    self._scheduled = set()
+
+  def __str__(self):
+    return "VolumeWatchdog({0})".format(",".join(self.names))
+
+  def run(self, interval):
+    """Checks the volumes every interval seconds until interrupted.
+
+    Arguments:
+      interval (float): the seconds between checks
+    """
+    while True:
+      start = time.time()
+      self.step()
+      time.sleep(max(0, start + interval - time.time()))
+
+  def step(self):
+    """Checks every volume once, and recovers from any problems as the
+    policy allows.
+
+    Returns:
+      A list of the recoveries attempted, each a (volume name, problem)
+      tuple.
+    """
+    attempted = []
+    for name in self.names:
+      vdo, alb = self._volume(name)
+      problems = None
+      if vdo is not None:
+        problems = self.check(vdo, alb)
+      for problem in self._update(name, problems):
+        if self._recover(name, problem):
+          attempted.append((name, problem))
+    return attempted
+
+  def check(self, vdo, alb):
+    """Checks a volume for problems.
+
+    Arguments:
+      vdo (VdoService): the volume
+      alb (AlbireoService): its Albireo server, or None
+    Returns:
+      The set of problems seen, or None if the volume is not running.
+    """
+    name = vdo.getName()
+    try:
+      stats = VdoStatistics(name).dedupe()
+      status = DeviceMapper.status(name)
+    except CommandError as ex:
+      self.log.debug(str(ex))
+      return None
+    problems = set()
+    if stats.mode == self._readOnlyMode:
+      problems.add(self.READ_ONLY)
+    if alb is not None:
+      if not alb.running():
+        # A server which was stopped on purpose has unmounted its index.
+        if os.path.ismount(alb.indexPath):
+          problems.add(self.SERVER_DOWN)
+      elif status and status[0][3].split()[-1:] == ['offline']:
+        # The status ends with the state of the index connection.
+        problems.add(self.INDEX_OFFLINE)
+    return problems
+
+  def inWindow(self, now=None):
+    """Returns True iff a time is within the maintenance window.
+
+    Arguments:
+      now (float): the time, or None for the present
+    """
+    if self.window is None:
+      return False
+    local = time.localtime(now)
+    minute = local.tm_hour * 60 + local.tm_min
+    start, end = self.window
+    if start < end:
+      return start <= minute < end
+    # The window runs past midnight.
+    return minute >= start or minute < end
+
+  def _volume(self, name):
+    """Reads a volume from the configuration.
+
+    Returns:
+      The VdoService of the volume and its AlbireoService, which is None
+      if the volume does not use deduplication; or (None, None) if the
+      volume is no longer configured.
+    """
+    with Configuration(self.confFile, mustExist=True) as conf:
+      try:
+        vdo = conf.getVdo(name)
+      except KeyError:
+        self.log.debug("VDO volume {0} is no longer configured".format(name))
+        return None, None
+      alb = None
+      if vdo.enableDeduplication:
+        alb = conf.getAlbserver(vdo.server)
+      return vdo, alb
+
+  def _update(self, name, problems):
+    """Records the problems seen on a volume, and logs those which have
+    just arisen or cleared.
+
+    Arguments:
+      name (str): the volume
+      problems (set): the problems seen, or None if it is not running
+    Returns:
+      The problems the volume has, in a fixed order.
+    """
+    seen = self._seen.setdefault(name, {})
+    if problems is None:
+      # Nothing can be known about a volume which is not running.
+      seen.clear()
+      for key in [key for key in self._attempts if key[0] == name]:
+        del self._attempts[key]
+      self._scheduled.discard(name)
+      return []
+    for problem in sorted(problems):
+      seen[problem] = seen.get(problem, 0) + 1
+      if seen[problem] == self._threshold(problem):
+        self.log.error(_("VDO volume {0}: {1}").format(name, problem))
+    for problem in sorted(seen):
+      if problem not in problems:
+        if seen[problem] >= self._threshold(problem):
+          self.log.announce(_("VDO volume {0}: no longer {1}").format(
+              name, problem))
+        del seen[problem]
+        self._attempts.pop((name, problem), None)
+        if problem == self.READ_ONLY:
+          self._scheduled.discard(name)
+    return [problem
+            for problem in [self.READ_ONLY, self.SERVER_DOWN,
+                            self.INDEX_OFFLINE]
+            if seen.get(problem, 0) >= self._threshold(problem)]
+
+  def _threshold(self, problem):
+    """Returns the checks in a row in which a problem must be seen
+    before it is reported."""
+    return self.offlineChecks if problem == self.INDEX_OFFLINE else 1
+
+  def _recover(self, name, problem):
+    """Tries to recover a volume from a problem, if the policy and the
+    retry delay allow it now, and the volume still has the problem once
+    it is locked.
+
+    Returns:
+      True iff a recovery was attempted.
+    """
+    needed = self.REBUILD if problem == self.READ_ONLY else self.RECONNECT
+    if self.policies.index(self.policy) < self.policies.index(needed):
+      return False
+    now = time.time()
+    last, attempts = self._attempts.get((name, problem), (None, 0))
+    if last is not None:
+      delay = min(self.maxRetryDelay, self.retryDelay * 2 ** (attempts - 1))
+      if now < last + delay:
+        return False
+    if problem == self.READ_ONLY and not self.inWindow(now):
+      if name not in self._scheduled:
+        self.log.announce(_("VDO volume {0}: forced rebuild scheduled for"
+                            " the maintenance window").format(name))
+        self._scheduled.add(name)
+      return False
+    self._attempts[(name, problem)] = (now, attempts + 1)
+    try:
+      with CommandLock(Defaults.lockFile):
+        with CommandLock.forVolume(name):
+          vdo, alb = self._volume(name)
+          if vdo is None or problem not in (self.check(vdo, alb) or ()):
+            self.log.info(_("VDO volume {0}: {1} cleared before it could"
+                            " be recovered from").format(name, problem))
+            return False
+          if problem == self.SERVER_DOWN:
+            self._restartServer(vdo, alb)
+          elif problem == self.INDEX_OFFLINE:
+            self.log.announce(_("Reconnecting VDO volume {0} to its"
+                                " index").format(name))
+            DeviceMapper.message(name, 0, 'reconnect')
+          else:
+            self._forceRebuild(vdo, alb)
+    except (CommandError, CommandLockTimeout) as ex:
+      self.log.warn(_("Could not recover VDO volume {0} from {1}:"
+                      " {2}").format(name, problem, ex))
+    return True
+
+  def _restartServer(self, vdo, alb):
+    """Restarts the Albireo server of a volume, which has the volume
+    reconnect once the index is ready, as the start command does.
+
+    Exceptions:
+      CommandError: the server could not be started
+    """
+    self.log.announce(_("Restarting Albireo server for VDO volume"
+                        " {0}").format(vdo.getName()))
+    readyCmd = " ".join([Logger.mypath, '--name', vdo.getName(),
+                         'internalServiceHook'])
+    if alb.start(readyCmd) == Service.ERROR:
+      raise CommandError(_("Albireo server did not start"))
+
+  def _forceRebuild(self, vdo, alb):
+    """Stops a read-only volume and starts it with a forced rebuild.
+
+    Exceptions:
+      CommandError: the volume could not be stopped or started
+    """
+    name = vdo.getName()
+    self.log.announce(_("Stopping VDO volume {0} to force a rebuild").format(
+        name))
+    if vdo.stop() == Service.ERROR:
+      raise CommandError(_("VDO volume could not be stopped; unmount it"
+                           " to let it be rebuilt"))
+    if alb is None:
+      with Configuration(self.confFile, mustExist=True) as conf:
+        networkSpec = conf.getAlbserver(vdo.server).networkSpec
+    else:
+      networkSpec = alb.networkSpec
+    if vdo.start(networkSpec, forceRebuild=True) == Service.ERROR:
+      raise CommandError(_("VDO volume could not be started with a forced"
+                           " rebuild"))
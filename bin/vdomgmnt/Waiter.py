@@ -0,0 +1,231 @@
+"""
+  Waiter - waits for conditions on the local node
+
+  Copyright (c) 2014 Permabit Technology Corporation.
+  @LICENSE@
+  $Id: //eng/vdo-releases/nitrogen/src/c++/vdo/bin/vdomgmnt/Waiter.py#1 $
+
+"""
+from . import Command, CommandError, Logger
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import time
+
+# Definitions from <sys/inotify.h> and <asm-generic/unistd.h>.
+_IN_NONBLOCK = 04000
+_IN_CLOEXEC = 02000000
+_IN_CHANGES = (0x00000004 | 0x00000008 | 0x00000040 | 0x00000080
+               | 0x00000100 | 0x00000200)
+_SYS_pidfd_open = 434
+
+
+def _loadLibc():
+  """Returns the C library, or None if it cannot be loaded."""
+  try:
+    return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  except OSError:
+    return None
+
+
+class Waiter(object):
+  """Waiter waits, for up to a limited time, for a condition to become
+  true, such as a command succeeding, a file appearing, or a process
+  exiting.
+
+  The condition is tested at once and then again after delays which
+  start at a millisecond and double up to half a second, so a condition
+  which holds soon is noticed soon, while one which takes a long time
+  costs only a few tests a second. The waiter may also be given event
+  sources: files whose appearance, disappearance, or modification it
+  watches with inotify, and processes whose exit it watches with a
+  pidfd. Any event on a source cuts the current delay short and the
+  condition is tested again immediately. Where the kernel does not
+  support an event source, the waiter silently relies on its delays.
+
+  Attributes:
+    timeout (float): seconds to wait before giving up
+    message (str): the error message if the wait times out
+    deadline (float): the time at which the wait gives up, counted from
+      when the waiter was made
+    _inotify (int): the inotify instance, or -1
+    _fds (list of int): the descriptors which signal an event
+  """
+  log = Logger.getLogger(Logger.myname + '.Waiter')
+  initialDelay = 0.001
+  maximumDelay = 0.5
+  _libc = _loadLibc()
+
+  def __init__(self, timeout, message):
+    self.timeout = timeout
+    self.message = message
+    self.deadline = time.time() + timeout
+    self._inotify = -1
+    self._fds = []
+
+  def __str__(self):
+    return "Waiter(\"{0}\")".format(self.message)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.close()
+
+  def __del__(self):
+    self.close()
+
+  @classmethod
+  def forExit(cls, pid, timeout):
+    """Waits for a process to exit.
+
+    Arguments:
+      pid (int): the process
+      timeout (float): seconds to wait
+    Returns:
+      True iff the process exited in time.
+    """
+    def exited():
+      try:
+        os.kill(pid, 0)
+        return False
+      except OSError as ex:
+        return ex.errno == errno.ESRCH
+
+    with cls(timeout, _("process {0} still running").format(pid)) as waiter:
+      waiter.watchProcess(pid)
+      try:
+        waiter.until(exited)
+        return True
+      except CommandError:
+        return False
+
+  @classmethod
+  def forPath(cls, path, timeout, exists=True):
+    """Waits for a file to appear or disappear.
+
+    Arguments:
+      path (str): the file
+      timeout (float): seconds to wait
+      exists (bool): if True, wait for the file to exist, otherwise
+        wait for it not to exist
+    Exceptions:
+      CommandError: the wait timed out
+    """
+    if exists:
+      message = _("{0} did not appear").format(path)
+    else:
+      message = _("{0} did not go away").format(path)
+    with cls(timeout, message) as waiter:
+      waiter.watchPath(path)
+      waiter.until(lambda: os.path.exists(path) == exists)
+
+  @staticmethod
+  def settle(timeout=10):
+    """Waits for udev to finish handling the events queued so far, such
+    as those which follow creating or removing a device. A failure is
+    logged and otherwise ignored.
+
+    Arguments:
+      timeout (int): seconds to wait
+    """
+    Command(['udevadm', 'settle', '--timeout=' + str(timeout)]).noThrowCall()
+
+  def watchPath(self, path):
+    """Adds a file to the event sources. The directory containing the
+    file is watched, so the file need not exist yet.
+
+    Arguments:
+      path (str): the file
+    """
+    if self._libc is None:
+      return
+    if self._inotify < 0:
+      self._inotify = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+      if self._inotify < 0:
+        self.log.debug("inotify unavailable: {0}".format(
+            os.strerror(ctypes.get_errno())))
+        return
+      self._fds.append(self._inotify)
+    directory = os.path.dirname(os.path.abspath(path))
+    if self._libc.inotify_add_watch(self._inotify, directory,
+                                    _IN_CHANGES) < 0:
+      self.log.debug("Cannot watch {0}: {1}".format(
+          directory, os.strerror(ctypes.get_errno())))
+
+  def watchProcess(self, pid):
+    """Adds a process to the event sources.
+
+    Arguments:
+      pid (int): the process, whose exit is an event
+    """
+    if self._libc is None:
+      return
+    fd = self._libc.syscall(_SYS_pidfd_open, pid, 0)
+    if fd < 0:
+      self.log.debug("pidfd unavailable for {0}: {1}".format(
+          pid, os.strerror(ctypes.get_errno())))
+      return
+    self._fds.append(fd)
+
+  def until(self, predicate):
+    """Waits for a condition to become true.
+
+    Arguments:
+      predicate (Callable): tests the condition, returning True when it
+        holds
+    Exceptions:
+      CommandError: the condition did not hold within the timeout
+    """
+    delay = self.initialDelay
+    while not predicate():
+      remaining = self.remaining()
+      if remaining <= 0:
+        raise CommandError(self.message)
+      self._pause(min(delay, remaining))
+      delay = min(2 * delay, self.maximumDelay)
+
+  def remaining(self):
+    """Returns the seconds left until the deadline, or 0 if it has
+    passed."""
+    return max(0, self.deadline - time.time())
+
+  def close(self):
+    """Closes the event sources."""
+    for fd in self._fds:
+      os.close(fd)
+    self._fds = []
+    self._inotify = -1
+
+  def _pause(self, delay):
+    """Waits for an event on one of the event sources, or for a delay
+    to pass, whichever comes first.
+
+    Arguments:
+      delay (float): the most seconds to wait
+    """
+    if not self._fds:
+      time.sleep(delay)
+      return
+    try:
+      ready, unused_write, unused_error = select.select(self._fds, [], [],
+                                                        delay)
+    except select.error as ex:
+      if ex.args[0] != errno.EINTR:
+        raise
+      return
+    if self._inotify in ready:
+      # Discard the events; the condition is tested afresh anyway.
+      try:
+        while os.read(self._inotify, 4096):
+          pass
+      except OSError:
+        pass
+    for fd in ready:
+      if fd != self._inotify:
+        # An exited process stays readable; stop watching it so later
+        # pauses are not cut short.
+        os.close(fd)
+        self._fds.remove(fd)
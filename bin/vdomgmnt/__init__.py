@@ -4,17 +4,41 @@ gettext.install('vdomgmnt')
 from Logger import Logger
 from Command import Command, CommandError
 from SizeString import SizeString
+from Waiter import Waiter
 from Utils import Utils
+from ParallelExecutor import ParallelExecutor
 from Brand import Brand
 from Defaults import Defaults, ArgumentError
+from DeviceMapper import DeviceMapper
+from SystemState import SystemState
+from VdoStatistics import VdoStatistics
+from VdoMonitor import VdoMonitor, VdoSample
+from KernelLog import KernelLog
+from LatencyHistogram import LatencyHistogram
+from TraceAnalyzer import TraceAnalyzer
+from HistoryStore import HistoryStore
+from CommandLock import CommandLock, CommandLockTimeout
 from Service import Service
 from Extensions import Extensions
 from KernelModuleService import KernelModuleService
+from QueueAnalyzer import QueueAnalyzer
+from StorageGeometry import StorageGeometry
+from StorageDevice import StorageDevice
+from DeviceProbe import DeviceProbe
 from LogicalVolume import LogicalVolume
+from BlockDevice import BlockDevice
+from FileDevice import FileDevice
+from IndexProgress import IndexProgress
+from RecoveryProgress import RecoveryProgress
 from AlbireoService import AlbireoService
 from VdoService import VdoService
-from CommandLock import CommandLock, CommandLockTimeout
 from Configuration import Configuration, BadConfigVersionError
+from MemoryPlanner import MemoryPlanner
+from TunableController import TunableController
+from DataReductionPolicy import DataReductionPolicy
+from VolumeWatchdog import VolumeWatchdog
+from MetricsExporter import MetricsExporter
 from InitScriptService import InitScriptService
+from ManagerDaemon import ManagerDaemon
 
 